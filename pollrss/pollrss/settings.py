@@ -42,7 +42,7 @@ SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'cg#p$g+j9tax!#a3cup@1$8obt2_+&
 # SECURITY WARNING: don't run with debug turned on in production!
 #DEBUG = True
 DEBUG = os.environ.get('DJANGO_DEBUG', '') != 'False'
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -59,13 +59,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ui.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ui.middleware.TracingMiddleware',
+    'ui.middleware.MetricsMiddleware',
+    'ui.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'pollrss.urls'
@@ -88,6 +91,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'pollrss.wsgi.application'
 
+# Route page fetching and feed views to their async versions (for ASGI servers).
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS', '') == 'True'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
@@ -104,6 +110,114 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Use a shared backend (memcached, database) when running several workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a rendered feed is served without revalidation.
+FEED_CACHE_TTL = int(os.environ.get('DJANGO_FEED_CACHE_TTL', 60))
+
+# Seconds past FEED_CACHE_TTL that a stale feed may still be served.
+FEED_MAX_STALENESS = int(os.environ.get('DJANGO_FEED_MAX_STALENESS', 86400))
+
+# Feeds per page of the feed list.
+FEED_LIST_PAGE_SIZE = int(os.environ.get('DJANGO_FEED_LIST_PAGE_SIZE', 50))
+
+# Seconds a rendered feed list page is kept. Pages are replaced as soon as any feed changes.
+FEED_LIST_CACHE_TTL = int(os.environ.get('DJANGO_FEED_LIST_CACHE_TTL', 3600))
+
+
+# Seconds fetched pages are kept as snapshots for the create page.
+SNAPSHOT_TTL = int(os.environ.get('DJANGO_SNAPSHOT_TTL', 3600))
+
+# Seconds the feeds a page advertises are remembered.
+DISCOVERY_TTL = int(os.environ.get('DJANGO_DISCOVERY_TTL', 3600))
+
+
+# Seconds between polls of a feed source by the job workers.
+POLL_INTERVAL = int(os.environ.get('DJANGO_POLL_INTERVAL', 900))
+
+# Seconds a worker may hold a job before another worker can claim it.
+JOB_LEASE_TIMEOUT = int(os.environ.get('DJANGO_JOB_LEASE_TIMEOUT', 300))
+
+# Attempts at a failing job before it waits for its next regular poll.
+JOB_MAX_ATTEMPTS = int(os.environ.get('DJANGO_JOB_MAX_ATTEMPTS', 5))
+
+# Seconds before the first retry of a failed job, doubled on each retry.
+JOB_RETRY_DELAY = int(os.environ.get('DJANGO_JOB_RETRY_DELAY', 60))
+
+# Processes feeds are parsed in while polling. 0 parses in a thread instead.
+PARSE_WORKERS = int(os.environ.get('DJANGO_PARSE_WORKERS', os.cpu_count() or 1))
+
+# Sources fetched at the same time while polling.
+FETCH_CONCURRENCY = int(os.environ.get('DJANGO_FETCH_CONCURRENCY', 20))
+
+# Items each queue between polling stages holds before the stage before it waits.
+PIPELINE_QUEUE_SIZE = int(os.environ.get('DJANGO_PIPELINE_QUEUE_SIZE', 50))
+
+# Polled feeds written to the database per transaction.
+WRITE_BATCH_SIZE = int(os.environ.get('DJANGO_WRITE_BATCH_SIZE', 20))
+
+# Seconds poll log rows are kept. Feed stats are rolled up from what is left.
+POLL_LOG_RETENTION = int(os.environ.get('DJANGO_POLL_LOG_RETENTION', 7 * 86400))
+
+
+# Name of this poller node. Leave empty to poll every feed.
+SHARD_NODE_ID = os.environ.get('DJANGO_SHARD_NODE_ID', '')
+
+# Comma separated names of every poller node in the cluster.
+SHARD_NODES = [node for node in os.environ.get('DJANGO_SHARD_NODES', '').split(',') if node]
+
+# Split feeds between nodes by source 'host' or by 'feed' id.
+SHARD_BY = os.environ.get('DJANGO_SHARD_BY', 'host')
+
+# Points each node takes on the hash ring. More points spread feeds more evenly.
+SHARD_REPLICAS = int(os.environ.get('DJANGO_SHARD_REPLICAS', 100))
+
+
+# Directory each worker process writes its metrics to, so /metrics can add
+# them up. Leave empty when serving from a single process.
+METRICS_DIR = os.environ.get('DJANGO_METRICS_DIR', '')
+
+# Seconds between writes of a process' metrics to METRICS_DIR.
+METRICS_FLUSH_INTERVAL = float(os.environ.get('DJANGO_METRICS_FLUSH_INTERVAL', 5))
+
+
+# Fraction of requests profiled and stored in PROFILE_DIR. Staff users can
+# also profile single requests with an X-Profile header or ?profile=text.
+PROFILE_SAMPLE_RATE = float(os.environ.get('DJANGO_PROFILE_SAMPLE_RATE', 0))
+
+# Directory sampled profiles are kept in. Sampling is off while it is empty.
+PROFILE_DIR = os.environ.get('DJANGO_PROFILE_DIR', '')
+
+# Number of sampled profiles kept in PROFILE_DIR.
+PROFILE_RING_SIZE = int(os.environ.get('DJANGO_PROFILE_RING_SIZE', 100))
+
+# Number of slowest queries listed in a profile.
+PROFILE_SLOW_QUERIES = int(os.environ.get('DJANGO_PROFILE_SLOW_QUERIES', 5))
+
+
+# File finished traces are appended to as JSON lines.
+TRACE_FILE = os.environ.get('DJANGO_TRACE_FILE', '')
+
+# OTLP/HTTP collector traces are sent to, e.g. http://localhost:4318/v1/traces.
+# Tracing is off while both this and TRACE_FILE are empty.
+TRACE_OTLP_ENDPOINT = os.environ.get('DJANGO_TRACE_OTLP_ENDPOINT', '')
+
+# Fraction of new traces exported.
+TRACE_SAMPLE_RATE = float(os.environ.get('DJANGO_TRACE_SAMPLE_RATE', 0.01))
+
+# Seconds after which a trace is exported even if it was not sampled. 0 turns this off.
+TRACE_SLOW_SECONDS = float(os.environ.get('DJANGO_TRACE_SLOW_SECONDS', 1))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -153,4 +267,7 @@ STATIC_URL = '/static/'
 # https://warehouse.python.org/project/whitenoise/
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Directory that rendered feeds are exported to as static files (disabled when empty).
+FEED_EXPORT_ROOT = os.environ.get('DJANGO_FEED_EXPORT_ROOT', '')
+
 APPEND_SLASH = True
\ No newline at end of file
@@ -14,13 +14,153 @@
    limitations under the License.
 '''
 
-from django.contrib import admin
+
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
 # Register your models here.
 
-from .models import Feed, FeedField, Item, ItemField
+from . import poller, rss
+from .models import Feed, FeedField, FeedStats, Item, ItemField, Job, PollLog, Selector
+from .pagination import EstimatedCountPaginator
+
+
+# Item and item field tables hold millions of rows, so their changelists
+# avoid COUNT(*) over the whole table, searches that scan it and per row
+# queries for related objects. They only search and filter on indexed
+# columns; field names and poll statuses take a handful of values, so an
+# index on them would still match most of the table.
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too large to count or scan.
+
+    A numeric search term is matched against the primary key and the
+    indexed columns in id_search_fields. Other terms use search_fields.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+    id_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+
+        if term.isdigit():
+            match = Q(pk=int(term))
+            for field in self.id_search_fields:
+                match |= Q(**{field: int(term)})
+
+            return queryset.filter(match), False
+
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(Feed)
+class FeedAdmin(LargeTableAdmin):
+    list_display = ('id', 'rss_link', 'page_url', 'created', 'updated')
+    # Scraped feeds keep their canonical page url in canonical_link
+    search_fields = ('^canonical_link',)
+    actions = ['refresh_feeds']
+
+    def refresh_feeds(self, request, queryset):
+        stats = poller.poll_feeds(poller.get_pollable_feeds().filter(pk__in=queryset.values('pk')))
+
+        self.message_user(request, 'Polled %(sources)d source(s), %(failed)d failed, %(new_items)d new item(s).' % stats,
+                          messages.WARNING if stats['failed'] else messages.SUCCESS)
+
+    refresh_feeds.short_description = 'Refresh selected feeds'
+
+
+@admin.register(FeedField)
+class FeedFieldAdmin(LargeTableAdmin):
+    list_display = ('id', 'feed', 'name', 'value')
+    list_select_related = ('feed',)
+    raw_id_fields = ('feed',)
+    id_search_fields = ('feed_id',)
+
+
+@admin.register(Item)
+class ItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'feed', 'created', 'fingerprint')
+    list_select_related = ('feed',)
+    raw_id_fields = ('feed',)
+    search_fields = ('=fingerprint',)
+    id_search_fields = ('feed_id',)
+    actions = ['prune_items']
+
+    def get_actions(self, request):
+        # The default delete action lists every related item field first
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def prune_items(self, request, queryset):
+        deleted = rss.delete_items(queryset.values_list('pk', flat=True).iterator(chunk_size=rss.DELETE_BATCH_SIZE))
+
+        self.message_user(request, 'Pruned %d item(s).' % deleted, messages.SUCCESS)
+
+    prune_items.short_description = 'Prune selected items'
+    prune_items.allowed_permissions = ('delete',)
+
+
+@admin.register(ItemField)
+class ItemFieldAdmin(LargeTableAdmin):
+    list_display = ('id', 'item', 'name', 'value')
+    list_select_related = ('item',)
+    raw_id_fields = ('item',)
+    id_search_fields = ('item_id',)
+
+    # The post_save receiver clears the fragment of an edited field's item,
+    # deletes clear them here so Django can still delete fields in bulk
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            rss.clear_fragments([obj.item_id])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            item_ids = set(queryset.values_list('item_id', flat=True))
+            super().delete_queryset(request, queryset)
+            rss.clear_fragments(item_ids)
+
+
+@admin.register(Selector)
+class SelectorAdmin(admin.ModelAdmin):
+    list_display = ('feed', 'name', 'kind', 'expression')
+    list_select_related = ('feed',)
+    raw_id_fields = ('feed',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'source', 'run_after', 'locked_by', 'locked_until', 'attempts', 'last_error')
+    list_filter = ('kind',)
+    search_fields = ('source',)
+    actions = ['run_now']
+
+    def run_now(self, request, queryset):
+        # Leased jobs keep their lease
+        count = queryset.filter(Q(locked_until__isnull=True) | Q(locked_until__lte=timezone.now())).update(
+                run_after=timezone.now(), attempts=0)
+
+        self.message_user(request, 'Scheduled %d job(s).' % count, messages.SUCCESS)
+
+    run_now.short_description = 'Poll selected sources now'
+
+
+@admin.register(PollLog)
+class PollLogAdmin(LargeTableAdmin):
+    list_display = ('created', 'feed_id', 'status', 'http_status', 'bytes', 'fetch_ms', 'parse_ms', 'write_ms', 'new_items')
+    raw_id_fields = ('feed',)
+    date_hierarchy = 'created'
+
 
-admin.site.register(Feed)
-admin.site.register(FeedField)
-admin.site.register(Item)
-admin.site.register(ItemField)
+@admin.register(FeedStats)
+class FeedStatsAdmin(admin.ModelAdmin):
+    list_display = ('feed_id', 'polls', 'failures', 'change_rate', 'bytes_p50',
+                    'fetch_ms_p50', 'fetch_ms_p95', 'total_ms_p50', 'total_ms_p95', 'last_polled', 'last_changed')
+    ordering = ('-total_ms_p95',)
+    raw_id_fields = ('feed',)
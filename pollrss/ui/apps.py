@@ -19,3 +19,6 @@ from django.apps import AppConfig
 
 class UiConfig(AppConfig):
     name = 'ui'
+
+    def ready(self):
+        from . import export, feedcache, middleware, signals
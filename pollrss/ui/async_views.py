@@ -0,0 +1,102 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseBadRequest
+from django.middleware.csrf import get_token
+from django.shortcuts import render
+
+from . import snapshots, views
+from .views import create_context, feed_response, get_feed_or_404, viewfeed_context
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Async versions of the page fetching and feed serving views, used when
+# settings.ASYNC_VIEWS is enabled and pollrss is served through ASGI.
+
+FETCH_TIMEOUT = 30
+
+
+async def fetch_page(url):
+    """Fetch an external page without blocking the event loop.
+
+    Uses httpx when it is installed and falls back to running requests in a
+    worker thread.
+
+    Args:
+        url (str): Page url.
+
+    Returns:
+        tuple: Page content (bytes) and Content-Type header (str).
+    """
+    if httpx is not None:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=FETCH_TIMEOUT) as client:
+            r = await client.get(url)
+
+    else:
+        r = await sync_to_async(requests.get, thread_sensitive=False)(url, timeout=FETCH_TIMEOUT)
+
+    return r.content, r.headers.get('Content-Type')
+
+
+async def create(request):
+    if request.method == 'POST':
+        # Saving a scraped feed is database work only
+        return await sync_to_async(views.create)(request)
+
+    if request.method == 'GET' and 'url' in request.GET:
+        ext_page_url = request.GET['url']
+
+        digest = await sync_to_async(snapshots.find_snapshot)(ext_page_url)
+
+        if digest is None:
+            content, content_type = await fetch_page(ext_page_url)
+            digest = await sync_to_async(snapshots.store_snapshot)(ext_page_url, content, content_type)
+
+        # Same as ensure_csrf_cookie, which does not support async views
+        get_token(request)
+
+        return render(request, 'ui/create.html', create_context(ext_page_url, digest))
+
+    return HttpResponseBadRequest('Url is required')
+
+
+async def viewfeed(request, feed_id):
+    if request.method == 'GET':
+
+        context = await sync_to_async(viewfeed_context)(feed_id)
+
+        get_token(request)
+
+        return render(request, 'ui/feed.html', context=context)
+
+    return HttpResponseBadRequest('Feed is required')
+
+
+async def feed(request, feed_id):
+    if request.method == 'GET':
+
+        rss_feed, etag, warning = await sync_to_async(get_feed_or_404)(feed_id)
+
+        return feed_response(rss_feed, warning, etag, request)
+
+    return HttpResponseBadRequest('Feed is required')
@@ -0,0 +1,233 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import datetime
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+
+from . import rfeed
+from . import rss
+from . import serializer
+from .encoding import detect_encoding
+from .models import Feed
+
+
+SUITES = {}
+
+# Feed sizes and description lengths of the end to end suite
+E2E_SIZES = (10, 1000, 100000)
+DESCRIPTION_SIZES = {"small": 200, "large": 5000}
+
+
+def suite(name: str):
+    """Register a benchmark suite under name."""
+    def register(func):
+        SUITES[name] = func
+        return func
+
+    return register
+
+
+def best_of(func, repeat: int) -> float:
+    """Run func repeat times and return the fastest run in milliseconds."""
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings) * 1000
+
+
+def make_rfeed(items: int, description_size: int = 200) -> rfeed.Feed:
+    """Build a synthetic rfeed Feed.
+
+    Args:
+        items (int): Number of items in the feed.
+        description_size (int): Approximate description length per item.
+
+    Returns:
+        rfeed.Feed: Feed with escapable text, CDATA and dates in every item.
+    """
+    pub_date = datetime.datetime(2020, 10, 24, 15, 50, 0)
+    filler = ("Lorem ipsum & dolor <sit> amet. " * (description_size // 32 + 1))[:description_size]
+
+    rss_feed = rfeed.Feed(
+            title="Synthetic Feed",
+            link="https://example.com/",
+            description="A synthetic feed used for benchmarking."
+        )
+
+    for i in range(items):
+        rss_feed.items.append(rfeed.Item(
+                title="Item %d" % i,
+                link="https://example.com/items/%d?a=1&b=2" % i,
+                description="<![CDATA[<p>%d</p>]]>%s" % (i, filler),
+                guid=rfeed.Guid("https://example.com/items/%d" % i, False),
+                pubDate=pub_date
+            ))
+
+    return rss_feed
+
+
+@suite("serializer")
+def bench_serializer(items: int = 1000, repeat: int = 5) -> dict:
+    """Compare rfeed's XMLGenerator output against the fast-path serializer."""
+    rss_feed = make_rfeed(items)
+
+    rfeed_ms = best_of(lambda: rss_feed.rss().encode("utf-8"), repeat)
+    serializer_ms = best_of(lambda: serializer.serialize_feed(rss_feed), repeat)
+
+    return {
+            "items": items,
+            "rfeed_ms": round(rfeed_ms, 3),
+            "serializer_ms": round(serializer_ms, 3),
+            "speedup": round(rfeed_ms / serializer_ms, 2)
+        }
+
+
+@suite("decode")
+def bench_decode(items: int = 1000, repeat: int = 5) -> dict:
+    """Time encoding detection and parsing of a large cp1252 feed.
+
+    The feed has no XML encoding declaration and carries its charset in the
+    Content-Type header. Without a detected encoding the parser assumes
+    UTF-8 and mangles the text.
+    """
+    rss_feed = make_rfeed(items, description_size=1000)
+    rss_feed.title = "Caf\xe9 \xfcber"
+    content = rss_feed.rss().split("\n", 1)[1].replace("Lorem", "L\xf6r\xe9m").encode("cp1252")
+    content_type = "application/rss+xml; charset=windows-1252"
+
+    encoding = detect_encoding(content, content_type)
+    sniffed = BeautifulSoup(content, features="xml")
+
+    return {
+            "items": items,
+            "bytes": len(content),
+            "detect_declared_ms": round(best_of(lambda: detect_encoding(content, content_type), repeat), 3),
+            "detect_statistical_ms": round(best_of(lambda: detect_encoding(content), repeat), 3),
+            "parse_sniffed_ms": round(best_of(lambda: BeautifulSoup(content, features="xml"), repeat), 3),
+            "parse_detected_ms": round(best_of(lambda: BeautifulSoup(content, features="xml", from_encoding=encoding), repeat), 3),
+            "sniffed_text_correct": sniffed.find("title").string == rss_feed.title
+        }
+
+
+@contextmanager
+def serve_feeds(feeds: dict):
+    """Serve documents from a local HTTP server, standing in for upstream feeds.
+
+    Args:
+        feeds (dict): Response bodies (bytes) keyed by url path. Query strings are ignored.
+
+    Yields:
+        str: Base url of the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = feeds.get(urlsplit(self.path).path)
+
+            if body is None:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield "http://127.0.0.1:%d" % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@suite("e2e")
+def bench_e2e(items: int = None, repeat: int = 3) -> list:
+    """Time each stage of ingesting and serving a feed from a local server.
+
+    Every run reads a fresh url, so no stage is answered from a cache. Feeds
+    written to the database are deleted afterwards, but run this against a
+    scratch database all the same.
+
+    Args:
+        items (int): Items per feed. Defaults to every size in E2E_SIZES.
+        repeat (int): Runs per stage; the fastest is reported.
+
+    Returns:
+        list: One result per feed size and description size, timings in milliseconds.
+    """
+    results = []
+    documents = {}
+
+    for size in ((items,) if items else E2E_SIZES):
+        for description_name, description_size in DESCRIPTION_SIZES.items():
+            documents["/%d-%s.rss" % (size, description_name)] = (size, description_name,
+                    make_rfeed(size, description_size).rss().encode("utf-8"))
+
+    with serve_feeds({path: body for path, (size, name, body) in documents.items()}) as base_url:
+        for path, (size, description_name, body) in documents.items():
+            result = {"items": size, "description": description_name, "bytes": len(body)}
+            result.update(__time_e2e_stages(base_url + path, repeat))
+            results.append(result)
+
+    return results
+
+
+def __time_e2e_stages(url: str, repeat: int) -> dict:
+    runs = itertools.count()
+    feed_ids = []
+
+    def read_link():
+        return rss.read_feed_from_link("%s?run=%d" % (url, next(runs)))
+
+    def write_database():
+        feed_ids.append(rss.write_feed_to_database(feed_obj, "%s?run=%d" % (url, next(runs))))
+
+    try:
+        read_link_ms = best_of(read_link, repeat)
+        feed_obj = read_link()
+        write_database_ms = best_of(write_database, repeat)
+        feed_id = feed_ids[-1]
+        rss_feed = rss.create_rss_feed_from_object(feed_id)
+
+        return {
+                "read_feed_from_link_ms": round(read_link_ms, 3),
+                "write_feed_to_database_ms": round(write_database_ms, 3),
+                "read_feed_from_database_ms": round(best_of(lambda: rss.read_feed_from_database(feed_id), repeat), 3),
+                "create_rss_feed_from_object_ms": round(best_of(lambda: rss.create_rss_feed_from_object(feed_id), repeat), 3),
+                "rfeed_rss_ms": round(best_of(rss_feed.rss, repeat), 3),
+                "render_feed_ms": round(best_of(lambda: rss.render_feed(feed_id), repeat), 3)
+            }
+
+    finally:
+        Feed.objects.filter(pk__in=feed_ids).delete()
@@ -0,0 +1,86 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid", "_ga"}
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+RESOLVE_TIMEOUT = 10
+
+
+def canonicalize_url(url: str) -> str:
+    """Reduce a url to the form shared by every equivalent spelling of it.
+
+    The scheme becomes https, the host is lowercased, default ports,
+    fragments, tracking parameters and trailing slashes are dropped and the
+    remaining query parameters are sorted.
+
+    Args:
+        url (str): Feed or page url.
+
+    Returns:
+        str: Canonical url.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or "").rstrip(".")
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = "%s:%d" % (host, parts.port)
+
+    path = parts.path.rstrip("/") or "/"
+
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if name not in TRACKING_PARAMS and not name.startswith(TRACKING_PREFIXES)]
+    query.sort()
+
+    if scheme in DEFAULT_PORTS:
+        scheme = "https"
+
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def resolve_canonical_url(url: str) -> str:
+    """Follow redirects from a url and canonicalize where they end up.
+
+    Args:
+        url (str): Feed or page url.
+
+    Returns:
+        str: Canonical url of the redirect target, or of url itself if it cannot be reached.
+    """
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=RESOLVE_TIMEOUT)
+
+        # Some servers do not implement HEAD
+        if response.status_code >= 400:
+            response = requests.get(url, allow_redirects=True, stream=True, timeout=RESOLVE_TIMEOUT)
+            response.close()
+
+        if response.status_code < 400:
+            url = response.url
+
+    except requests.RequestException:
+        pass
+
+    return canonicalize_url(url)
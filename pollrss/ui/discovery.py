@@ -0,0 +1,174 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import hashlib
+import logging
+import time
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import cache
+
+import requests
+
+from . import metrics
+from .encoding import detect_encoding
+from .singleflight import SingleFlight
+
+
+logger = logging.getLogger(__name__)
+
+# Only the start of a page is read; feeds are advertised in its <head>
+HEAD_LIMIT = 65536
+CHUNK_SIZE = 8192
+FETCH_TIMEOUT = 10
+
+FEED_TYPES = {"application/rss+xml"}
+FEED_CONTENT_TYPES = ("application/rss+xml", "application/xml", "text/xml")
+
+__discover_flight = SingleFlight()
+
+
+class FeedLinkParser(HTMLParser):
+    """Collect <link rel="alternate"> feed links, stopping at the end of <head>."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        if tag == "body":
+            self.done = True
+            return
+
+        if tag != "link":
+            return
+
+        attrs = {name: value or "" for name, value in attrs}
+        rels = attrs.get("rel", "").lower().split()
+        feed_type = attrs.get("type", "").lower().split(";")[0].strip()
+
+        if "alternate" in rels and feed_type in FEED_TYPES and attrs.get("href"):
+            self.links.append((attrs["href"].strip(), attrs.get("title", "").strip()))
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+
+def discover_feeds(url: str) -> list:
+    """Find the RSS feeds a page advertises.
+
+    Results are cached for DISCOVERY_TTL seconds and concurrent lookups of
+    the same page share one fetch.
+
+    Args:
+        url (str): Page url.
+
+    Returns:
+        list: (feed url, title) tuples. Empty if the page advertises no feeds or cannot be fetched.
+    """
+    key = "pollrss:discovery:" + hashlib.md5(url.encode("utf-8")).hexdigest()
+    feeds = cache.get(key)
+
+    if feeds is None:
+        feeds = __discover_flight.do(url, __discover_feeds_once, url, key)
+
+    return feeds
+
+
+def find_feed_links(content: bytes, base_url: str, content_type: str = None) -> list:
+    """Extract advertised feed links from the start of an HTML document.
+
+    Args:
+        content (bytes): Raw page content, possibly truncated.
+        base_url (str): Url the page was fetched from, used to resolve relative links.
+        content_type (str): HTTP Content-Type header of the page, if any.
+
+    Returns:
+        list: (absolute feed url, title) tuples, without duplicates.
+    """
+    parser = FeedLinkParser()
+    parser.feed(content.decode(detect_encoding(content, content_type), errors="replace"))
+
+    feeds = []
+    seen = set()
+    for href, title in parser.links:
+        feed_url = urljoin(base_url, href)
+
+        if feed_url not in seen:
+            seen.add(feed_url)
+            feeds.append((feed_url, title or feed_url))
+
+    return feeds
+
+
+def __discover_feeds_once(url: str, key: str) -> list:
+    try:
+        content, content_type, final_url = __fetch_head(url)
+
+    except requests.RequestException as e:
+        logger.info("Feed discovery fetch of %s failed: %s", url, e)
+        # Do not cache failures, the page may come back
+        return []
+
+    # The url may already be a feed
+    if content_type.split(";")[0].strip().lower() in FEED_CONTENT_TYPES and b"<rss" in content:
+        feeds = [(final_url, final_url)]
+    else:
+        feeds = find_feed_links(content, final_url, content_type)
+
+    cache.set(key, feeds, settings.DISCOVERY_TTL)
+
+    return feeds
+
+
+def __fetch_head(url: str):
+    """Read at most HEAD_LIMIT bytes of a page, stopping early at </head>.
+
+    Returns:
+        tuple: Content, Content-Type header and the url after redirects.
+    """
+    chunks = []
+    size = 0
+    tail = b""
+    start = time.perf_counter()
+
+    with requests.get(url, stream=True, timeout=FETCH_TIMEOUT) as response:
+        metrics.FETCH_RESPONSES.inc(kind="discovery", status=response.status_code)
+
+        response.raise_for_status()
+
+        for chunk in response.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+
+            # Keep the end of the last chunk, in case </head> spans two
+            window = tail + chunk.lower()
+            tail = window[-6:]
+
+            if size >= HEAD_LIMIT or b"</head>" in window:
+                break
+
+        metrics.FETCH_SECONDS.observe(time.perf_counter() - start, kind="discovery")
+        metrics.FETCH_BYTES.inc(size, kind="discovery")
+
+        return b"".join(chunks)[:HEAD_LIMIT], response.headers.get("Content-Type", ""), response.url
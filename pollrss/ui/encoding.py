@@ -0,0 +1,117 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import codecs
+import re
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:
+    from_bytes = None
+
+
+# Character encoding detection for fetched feeds and pages. Declarations are
+# trusted in the order: HTTP charset, in-document declaration (XML prolog or
+# HTML meta charset), byte order mark. Statistical detection over the whole
+# body only runs when none of them is present.
+
+DEFAULT_ENCODING = "utf-8"
+
+# Declarations are only looked for near the start of the document
+DECLARATION_WINDOW = 2048
+
+_CHARSET_PARAM = re.compile(r"charset\s*=\s*[\"']?([^\s;\"']+)", re.I)
+_XML_PROLOG = re.compile(rb"^\s*<\?xml[^>]*?encoding\s*=\s*[\"']([A-Za-z0-9._:-]+)[\"']")
+_META_CHARSET = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([A-Za-z0-9._:-]+)", re.I)
+
+_BOMS = (
+        (codecs.BOM_UTF32_LE, "utf-32"),
+        (codecs.BOM_UTF32_BE, "utf-32"),
+        (codecs.BOM_UTF8, "utf-8-sig"),
+        (codecs.BOM_UTF16_LE, "utf-16"),
+        (codecs.BOM_UTF16_BE, "utf-16"),
+    )
+
+
+def detect_encoding(content: bytes, content_type: str = None) -> str:
+    """Find the character encoding of a document.
+
+    Args:
+        content (bytes): Raw document.
+        content_type (str): HTTP Content-Type header, if any.
+
+    Returns:
+        str: Python codec name.
+    """
+    if content_type:
+        encoding = __lookup(_CHARSET_PARAM.search(content_type))
+        if encoding is not None:
+            return encoding
+
+    head = content[:DECLARATION_WINDOW]
+
+    encoding = __lookup(_XML_PROLOG.match(head)) or __lookup(_META_CHARSET.search(head))
+    if encoding is not None:
+        return encoding
+
+    for bom, bom_encoding in _BOMS:
+        if head.startswith(bom):
+            return bom_encoding
+
+    if from_bytes is not None:
+        match = from_bytes(content).best()
+        if match is not None:
+            return codecs.lookup(match.encoding).name
+
+    return DEFAULT_ENCODING
+
+
+def to_utf8(content: bytes, encoding: str) -> bytes:
+    """Convert a document to UTF-8, reusing the input when it already is.
+
+    Args:
+        content (bytes): Raw document.
+        encoding (str): Python codec name of content.
+
+    Returns:
+        bytes: UTF-8 encoded document.
+    """
+    if codecs.lookup(encoding).name == "utf-8":
+        if content.isascii():
+            return content
+
+        try:
+            content.decode("utf-8")
+            return content
+        except UnicodeDecodeError:
+            pass
+
+    return content.decode(encoding, errors="replace").encode("utf-8")
+
+
+def __lookup(match) -> str:
+    """Normalize a declared encoding name, ignoring ones Python does not know."""
+    if match is None:
+        return None
+
+    name = match.group(1)
+    if isinstance(name, bytes):
+        name = name.decode("ascii", errors="ignore")
+
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
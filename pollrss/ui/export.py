@@ -0,0 +1,158 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import gzip
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import rss
+from .models import Feed
+from .signals import feed_updated
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+# Rendered feeds are written to <FEED_EXPORT_ROOT>/feed/<id>.rss so that a
+# front end server can answer /feed/<id>.rss from disk without calling Django.
+
+
+def export_enabled() -> bool:
+    """Check if static feed export is configured."""
+    return bool(settings.FEED_EXPORT_ROOT)
+
+
+def get_export_path(feed_id: int) -> Path:
+    """Get the path of the exported RSS file for a feed.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+
+    Returns:
+        Path: Path of the uncompressed export.
+    """
+    return Path(settings.FEED_EXPORT_ROOT) / "feed" / ("%d.rss" % feed_id)
+
+
+def export_feed(feed_id: int) -> bool:
+    """Render a feed and write it, plus compressed variants, to the export directory.
+
+    Every file is written to a temporary file and renamed into place, so
+    readers only ever see a complete document. Unchanged feeds are left alone.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+
+    Returns:
+        bool: True if the files on disk changed.
+    """
+    if not export_enabled():
+        return False
+
+    body = rss.render_feed(feed_id)
+    path = get_export_path(feed_id)
+
+    try:
+        if path.read_bytes() == body:
+            return False
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Compressed variants go first so the plain file never advertises stale ones
+    __atomic_write(path.with_suffix(".rss.gz"), gzip.compress(body, compresslevel=9, mtime=0))
+
+    if brotli is not None:
+        __atomic_write(path.with_suffix(".rss.br"), brotli.compress(body))
+
+    __atomic_write(path, body)
+
+    return True
+
+
+def export_all_feeds() -> int:
+    """Export every feed in the database.
+
+    Returns:
+        int: Number of feeds whose files changed.
+    """
+    changed = 0
+
+    for feed_id in Feed.objects.values_list("id", flat=True).iterator():
+        if export_feed(feed_id):
+            changed += 1
+
+    return changed
+
+
+def remove_exported_feed(feed_id: int):
+    """Delete the exported files of a feed.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+    """
+    if not export_enabled():
+        return
+
+    path = get_export_path(feed_id)
+
+    for variant in (path, path.with_suffix(".rss.gz"), path.with_suffix(".rss.br")):
+        try:
+            variant.unlink()
+        except FileNotFoundError:
+            pass
+
+
+@receiver(feed_updated)
+def export_updated_feed(sender, feed_id, **kwargs):
+    # Runs in an on_commit hook with the other feed_updated receivers, which
+    # must still run if the export fails
+    try:
+        export_feed(feed_id)
+    except Exception:
+        logger.exception("Exporting feed %s failed", feed_id)
+
+
+@receiver(post_delete, sender=Feed)
+def remove_deleted_feed(sender, instance, **kwargs):
+    remove_exported_feed(instance.pk)
+
+
+def __atomic_write(path: Path, data: bytes):
+    """Write data to path by renaming a fully written temporary file over it."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".%s." % path.name)
+
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,241 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import functools
+import hashlib
+from urllib.parse import urljoin
+
+from django.db import transaction
+
+import lxml.etree
+import lxml.html
+
+try:
+    from lxml.cssselect import CSSSelector
+except ImportError:
+    CSSSelector = None
+
+from . import rss, snapshots, tracing
+from .canonical import canonicalize_url
+from .models import Feed, Selector
+
+
+# Scraped feeds turn a page snapshot into feed items with per-feed selectors.
+# The item selector finds one element per item, and the title, link and
+# description selectors are evaluated relative to each item element.
+
+FIELD_NAMES = (Selector.TITLE, Selector.LINK, Selector.DESCRIPTION)
+
+
+class ExtractError(ValueError):
+    """Raised for pages that items cannot be extracted from."""
+
+
+class SelectorError(ExtractError):
+    """Raised for selector expressions that cannot be compiled or evaluated.
+
+    Args:
+        message (str): Error message.
+        name (str): Name of the selector, if known.
+    """
+    def __init__(self, message: str, name: str = None):
+        super().__init__(message)
+        self.name = name
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_selector(kind: str, expression: str):
+    """Compile a selector expression, caching the result.
+
+    Args:
+        kind (str): Selector.XPATH or Selector.CSS.
+        expression (str): Selector expression.
+
+    Returns:
+        Callable: Compiled selector that returns the matches under an element.
+    """
+    try:
+        if kind == Selector.XPATH:
+            return lxml.etree.XPath(expression)
+
+        if kind == Selector.CSS:
+            if CSSSelector is None:
+                raise SelectorError("CSS selectors require the cssselect package")
+
+            return CSSSelector(expression)
+
+    except (lxml.etree.XPathError, SyntaxError, RuntimeError) as e:
+        raise SelectorError("Invalid %s selector: %s" % (kind, e))
+
+    raise SelectorError("Unknown selector kind: %s" % kind)
+
+
+def extract_feed(content: bytes, page_url: str, selectors: dict) -> rss.FeedObj:
+    """Extract a feed object from a page.
+
+    Args:
+        content (bytes): UTF-8 encoded page content.
+        page_url (str): Page url, used to resolve relative links.
+        selectors (dict): (kind, expression) tuples keyed by selector name.
+
+    Returns:
+        rss.FeedObj: Feed object for the normal database write path.
+
+    Raises:
+        ExtractError: The page could not be parsed.
+        SelectorError: A selector failed on the page, or the item selector did not select elements.
+    """
+    compiled = {name: compile_selector(*selectors[name]) for name in selectors}
+
+    try:
+        root = lxml.html.fromstring(content, base_url=page_url)
+    except (lxml.etree.ParserError, lxml.etree.XMLSyntaxError) as e:
+        raise ExtractError("The page could not be parsed: %s" % e)
+
+    feed = rss.FeedObj()
+    feed.elements = {
+                "title": (root.findtext(".//title") or page_url).strip(),
+                "link": page_url,
+                "description": "Scraped from " + page_url
+            }
+
+    elements = __select(compiled, Selector.ITEM, root)
+
+    # Such as //a/@href or count(//a)
+    if not isinstance(elements, list) or not all(isinstance(element, lxml.etree._Element) for element in elements):
+        raise SelectorError("The item selector must select elements", Selector.ITEM)
+
+    for element in elements:
+        item = {}
+
+        for name in FIELD_NAMES:
+            if name in compiled:
+                value = __first_value(__select(compiled, name, element), name)
+
+                if value:
+                    item[name] = urljoin(page_url, value) if name == Selector.LINK else value
+
+        # rfeed items need a title
+        if Selector.TITLE not in item:
+            continue
+
+        fingerprint = hashlib.md5((item[Selector.TITLE] + "\0" + item.get(Selector.LINK, "")).encode("utf-8")).hexdigest()
+        feed.items[fingerprint] = item
+
+    return feed
+
+
+def get_feed_selectors(db_feed: Feed) -> dict:
+    """Load the selectors of a scraped feed.
+
+    Args:
+        db_feed (Feed): Scraped database feed.
+
+    Returns:
+        dict: (kind, expression) tuples keyed by selector name.
+    """
+    return {selector.name: (selector.kind, selector.expression) for selector in db_feed.selector_set.all()}
+
+
+def create_scraped_feed(page_url: str, selectors: dict, digest: str) -> int:
+    """Create a scraped feed and fill it from a page snapshot.
+
+    Args:
+        page_url (str): Page url.
+        selectors (dict): (kind, expression) tuples keyed by selector name.
+        digest (str): Snapshot digest of the page.
+
+    Returns:
+        int: New database Feed ID.
+    """
+    feed = extract_feed(__get_snapshot_content(page_url, digest), page_url, selectors)
+
+    with transaction.atomic():
+        db_feed = Feed.objects.create(page_url=page_url, canonical_link=canonicalize_url(page_url), page_hash=digest)
+
+        Selector.objects.bulk_create([
+                Selector(feed=db_feed, name=name, kind=selectors[name][0], expression=selectors[name][1])
+                for name in selectors
+            ])
+
+        rss.update_feed_in_database(db_feed.pk, feed)
+
+    return db_feed.pk
+
+
+@tracing.traced()
+def refresh_scraped_feed(db_feed: Feed, digest: str) -> int:
+    """Update a scraped feed from a page snapshot.
+
+    Extraction is skipped when the page content has not changed since the
+    last refresh.
+
+    Args:
+        db_feed (Feed): Scraped database feed.
+        digest (str): Snapshot digest of the current page content.
+
+    Returns:
+        int: Number of new items.
+    """
+    if digest == db_feed.page_hash:
+        return 0
+
+    content = __get_snapshot_content(db_feed.page_url, digest)
+    new_items = rss.update_feed_in_database(db_feed.pk, extract_feed(content, db_feed.page_url, get_feed_selectors(db_feed)))
+
+    Feed.objects.filter(pk=db_feed.pk).update(page_hash=digest)
+    db_feed.page_hash = digest
+
+    return new_items
+
+
+def __get_snapshot_content(page_url: str, digest: str) -> bytes:
+    """Get snapshot content, downloading the page again if the snapshot expired."""
+    content = snapshots.get_snapshot(digest)
+
+    if content is None:
+        content = snapshots.get_snapshot(snapshots.download_snapshot(page_url))
+
+    return content
+
+
+def __select(compiled: dict, name: str, element):
+    """Evaluate a compiled selector, such as one calling an unknown function."""
+    try:
+        return compiled[name](element)
+    except (lxml.etree.XPathError, TypeError, ValueError) as e:
+        raise SelectorError("The %s selector failed: %s" % (name, e), name)
+
+
+def __first_value(matches, name: str) -> str:
+    """Convert the first selector match into a field value."""
+    if isinstance(matches, list):
+        if not matches:
+            return ""
+        match = matches[0]
+    else:
+        match = matches
+
+    if not isinstance(match, lxml.etree._Element):
+        return str(match).strip()
+
+    if name == Selector.LINK:
+        return (match.get("href") or match.text_content()).strip()
+
+    if name == Selector.DESCRIPTION:
+        return lxml.html.tostring(match, encoding="unicode", with_tail=False).strip()
+
+    return match.text_content().strip()
@@ -0,0 +1,249 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import metrics, rss
+from .models import Feed
+from .signals import feed_updated
+from .singleflight import SingleFlight, cache_lock
+
+
+# Rendered feeds are cached together with the time they were rendered.
+# Within FEED_CACHE_TTL seconds a body is fresh. After that, for up to
+# FEED_MAX_STALENESS more seconds, the old body keeps being served while a
+# background thread renders a new one. If that render fails the old body is
+# still served, flagged as a failed revalidation.
+
+# Rendered pages of the feed list are cached under a version number that
+# changes whenever a feed is added, updated or deleted, so a change makes
+# every cached page unreachable at once.
+
+STALE_WARNING = '110 - "Response is Stale"'
+REVALIDATION_FAILED_WARNING = '111 - "Revalidation Failed"'
+
+logger = logging.getLogger(__name__)
+
+__revalidating = set()
+__revalidating_lock = threading.Lock()
+
+__render_flight = SingleFlight()
+
+__FEED_LIST_VERSION_KEY = "pollrss:feed-list-version"
+
+
+def get_feed_body(feed_id: int):
+    """Get the rendered RSS for a feed, serving a stale copy if needed.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+
+    Returns:
+        tuple: RSS body (bytes) and a Warning header value (str) or None.
+    """
+    body, etag, warning = get_feed(feed_id)
+
+    return body, warning
+
+
+def get_feed(feed_id: int):
+    """Get the rendered RSS for a feed with its entity tag.
+
+    Like get_feed_body, but also returns a strong ETag of the body, which is
+    computed once per render and cached with it.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+
+    Returns:
+        tuple: RSS body (bytes), quoted ETag (str) and a Warning header value (str) or None.
+    """
+    entry = cache.get(__cache_key(feed_id))
+
+    if entry is not None:
+        age = time.time() - entry["rendered"]
+        etag = entry.get("etag") or make_etag(entry["body"])
+
+        if age < settings.FEED_CACHE_TTL:
+            metrics.FEED_CACHE_REQUESTS.inc(result="fresh")
+            return entry["body"], etag, None
+
+        if age < settings.FEED_CACHE_TTL + settings.FEED_MAX_STALENESS:
+            metrics.FEED_CACHE_REQUESTS.inc(result="stale")
+            __start_revalidation(feed_id)
+
+            return entry["body"], etag, REVALIDATION_FAILED_WARNING if entry["failed"] else STALE_WARNING
+
+    metrics.FEED_CACHE_REQUESTS.inc(result="miss")
+
+    body = __render_flight.do(feed_id, __render_once, feed_id)
+
+    return body, make_etag(body), None
+
+
+def make_etag(body: bytes) -> str:
+    """Get the quoted entity tag of a rendered feed.
+
+    Args:
+        body (bytes): Encoded RSS document.
+
+    Returns:
+        str: Strong ETag header value.
+    """
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+def refresh_feed(feed_id: int) -> bytes:
+    """Render a feed and store it as the last good body.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+
+    Returns:
+        bytes: Encoded RSS document.
+    """
+    body = rss.render_feed(feed_id)
+
+    cache.set(__cache_key(feed_id), {"body": body, "etag": make_etag(body), "rendered": time.time(), "failed": False},
+              __cache_timeout())
+
+    return body
+
+
+def expire_feed(feed_id: int):
+    """Mark a cached feed as stale so the next request revalidates it.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+    """
+    key = __cache_key(feed_id)
+    entry = cache.get(key)
+
+    if entry is not None:
+        entry["rendered"] = min(entry["rendered"], time.time() - settings.FEED_CACHE_TTL)
+        cache.set(key, entry, __cache_timeout())
+
+
+@receiver(feed_updated)
+def expire_updated_feed(sender, feed_id, **kwargs):
+    expire_feed(feed_id)
+
+
+def get_feed_list_version() -> int:
+    """Get the current version of the feed list.
+
+    Returns:
+        int: Version number, part of the cache key of every rendered feed list page.
+    """
+    version = cache.get(__FEED_LIST_VERSION_KEY)
+
+    if version is None:
+        # Start from the clock, so a version is not reused after the cache is cleared
+        cache.add(__FEED_LIST_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(__FEED_LIST_VERSION_KEY)
+
+    return version
+
+
+def expire_feed_list():
+    """Make every cached feed list page stale."""
+    try:
+        cache.incr(__FEED_LIST_VERSION_KEY)
+    except ValueError:
+        get_feed_list_version()
+
+
+@receiver(feed_updated)
+def expire_feed_list_on_update(sender, feed_id, **kwargs):
+    expire_feed_list()
+
+
+@receiver(post_delete, sender=Feed)
+def expire_feed_list_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(expire_feed_list)
+
+
+def revalidate_feed(feed_id: int):
+    """Re-render a feed, keeping the last good body if rendering fails.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+    """
+    try:
+        refresh_feed(feed_id)
+
+    except Exception:
+        logger.exception("Rendering feed %s failed, serving the last good copy", feed_id)
+
+        key = __cache_key(feed_id)
+        entry = cache.get(key)
+
+        if entry is not None:
+            entry["failed"] = True
+            cache.set(key, entry, __cache_timeout())
+
+
+def __render_once(feed_id: int) -> bytes:
+    """Render a feed unless another process rendered it while we waited."""
+    with cache_lock("render:%d" % feed_id):
+        entry = cache.get(__cache_key(feed_id))
+
+        if entry is not None and time.time() - entry["rendered"] < settings.FEED_CACHE_TTL:
+            return entry["body"]
+
+        return refresh_feed(feed_id)
+
+
+def __start_revalidation(feed_id: int):
+    """Revalidate a feed in a background thread unless one is already running."""
+    with __revalidating_lock:
+        if feed_id in __revalidating:
+            return
+
+        __revalidating.add(feed_id)
+
+    threading.Thread(target=__revalidate_in_thread, args=(feed_id,), daemon=True).start()
+
+
+def __revalidate_in_thread(feed_id: int):
+    try:
+        # Skip if another process is already rendering this feed
+        with cache_lock("render:%d" % feed_id, wait=False) as acquired:
+            if acquired:
+                revalidate_feed(feed_id)
+
+    finally:
+        connection.close()
+
+        with __revalidating_lock:
+            __revalidating.discard(feed_id)
+
+
+def __cache_key(feed_id: int) -> str:
+    return "pollrss:feed:%d" % feed_id
+
+
+def __cache_timeout() -> int:
+    return settings.FEED_CACHE_TTL + settings.FEED_MAX_STALENESS
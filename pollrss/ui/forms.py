@@ -16,6 +16,9 @@ Copyright 2020 Chase Kidder
 
 from django import forms
 
+from .extract import SelectorError, compile_selector
+from .models import Selector
+
 FEEDS = (
     ("1", "Feed1"),
     ("2", "Feed2"),
@@ -27,4 +30,35 @@ class IndexForm(forms.Form):
     url = forms.CharField(max_length=2000, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'https://'}))
 
 class FeedForm(forms.Form):
-    feed = forms.ChoiceField(choices=FEEDS)
\ No newline at end of file
+    feed = forms.ChoiceField(choices=FEEDS)
+
+
+class SubscribeForm(forms.Form):
+    url = forms.URLField(max_length=2000, widget=forms.HiddenInput())
+
+
+class SelectorForm(forms.Form):
+    url = forms.CharField(max_length=2000, widget=forms.HiddenInput())
+    digest = forms.CharField(max_length=64, widget=forms.HiddenInput())
+    kind = forms.ChoiceField(choices=Selector.KINDS, widget=forms.Select(attrs={'class': 'form-control'}))
+    item = forms.CharField(max_length=2000, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Item selector, e.g. //article'}))
+    title = forms.CharField(max_length=2000, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Title selector, e.g. .//h2'}))
+    link = forms.CharField(max_length=2000, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Link selector, e.g. .//a'}))
+    description = forms.CharField(max_length=2000, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Description selector'}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        for name, (kind, expression) in self.get_selectors().items():
+            try:
+                compile_selector(kind, expression)
+            except SelectorError as e:
+                self.add_error(name, str(e))
+
+        return cleaned_data
+
+    def get_selectors(self):
+        kind = self.cleaned_data.get('kind', Selector.XPATH)
+        names = [Selector.ITEM, Selector.TITLE, Selector.LINK, Selector.DESCRIPTION]
+
+        return {name: (kind, self.cleaned_data[name]) for name in names if self.cleaned_data.get(name)}
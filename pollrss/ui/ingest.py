@@ -0,0 +1,369 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from . import metrics, parsing, poller, pollstats, rss, tracing
+
+
+logger = logging.getLogger(__name__)
+
+# Polling runs as a pipeline of stages joined by bounded queues, so a slow
+# stage holds back the stages feeding it instead of piling up work:
+#
+#   fetch (FETCH_CONCURRENCY tasks on the event loop)
+#     -> parse (PARSE_WORKERS processes)
+#     -> write (one task, WRITE_BATCH_SIZE feeds per transaction)
+
+FETCH_TIMEOUT = 30
+
+# Marks the end of a queue's input
+__DONE = object()
+
+__parse_pool = None
+
+
+class Stage():
+    """Counters for one pipeline stage.
+
+    Args:
+        name (str): Stage name.
+        queue (asyncio.Queue): Queue the stage reads from.
+    """
+    def __init__(self, name: str, queue: asyncio.Queue):
+        self.name = name
+        self.queue = queue
+        self.processed = 0
+        self.failed = 0
+        self.new_items = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.started = time.perf_counter()
+
+    def take(self):
+        """Record the queue depth as the stage takes its next input."""
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def report(self) -> dict:
+        """Get the stage counters.
+
+        Returns:
+            dict: Inputs processed and failed, new items written, seconds spent working, inputs per second of wall time and peak queue depth.
+        """
+        elapsed = time.perf_counter() - self.started
+
+        return {
+                    "processed": self.processed,
+                    "failed": self.failed,
+                    "new_items": self.new_items,
+                    "busy_seconds": round(self.busy, 3),
+                    "per_second": round(self.processed / elapsed, 2) if elapsed else 0.0,
+                    "max_queue_depth": self.max_depth
+                }
+
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Get the process pool feeds are parsed in.
+
+    The pool is created on first use with PARSE_WORKERS processes. With
+    PARSE_WORKERS set to 0 feeds are parsed in a thread instead.
+
+    Returns:
+        ProcessPoolExecutor: Shared parse pool, or None if parsing is not done in processes.
+    """
+    global __parse_pool
+
+    if __parse_pool is None and settings.PARSE_WORKERS != 0:
+        __parse_pool = ProcessPoolExecutor(max_workers=settings.PARSE_WORKERS)
+
+    return __parse_pool
+
+
+async def poll_feeds_async(feeds=None) -> dict:
+    """Run one poll cycle through the fetch, parse and write pipeline.
+
+    Behaves like poller.poll_feeds: each canonical source is fetched once
+    and merged into every feed subscribed to it, and every poll is logged.
+
+    Args:
+        feeds (Iterable[Feed]): Feeds to poll. Defaults to every RSS and scraped feed.
+
+    Returns:
+        dict: Number of sources fetched, sources failed and new items, and the counters of each stage under "stages".
+    """
+    if feeds is None:
+        feeds = poller.get_pollable_feeds()
+
+    groups = poller.group_feeds_by_source(await sync_to_async(list)(feeds))
+
+    fetch_queue = asyncio.Queue()
+    parse_queue = asyncio.Queue(settings.PIPELINE_QUEUE_SIZE)
+    write_queue = asyncio.Queue(settings.PIPELINE_QUEUE_SIZE)
+
+    fetch = Stage("fetch", fetch_queue)
+    parse = Stage("parse", parse_queue)
+    write = Stage("write", write_queue)
+
+    for (kind, source), group in groups.items():
+        fetch_queue.put_nowait((kind, group))
+
+    fetch_workers = max(1, settings.FETCH_CONCURRENCY)
+    parse_workers = max(1, settings.PARSE_WORKERS)
+
+    for _ in range(fetch_workers):
+        fetch_queue.put_nowait(__DONE)
+
+    client = httpx.AsyncClient(follow_redirects=True, timeout=FETCH_TIMEOUT) if httpx is not None else None
+
+    try:
+        writer = asyncio.ensure_future(__write_stage(write))
+        parsers = [asyncio.ensure_future(__parse_stage(parse, write_queue)) for _ in range(parse_workers)]
+
+        await asyncio.gather(*(__fetch_stage(fetch, parse_queue, client) for _ in range(fetch_workers)))
+
+        for _ in parsers:
+            await parse_queue.put(__DONE)
+        await asyncio.gather(*parsers)
+
+        await write_queue.put(__DONE)
+        await writer
+
+    finally:
+        if client is not None:
+            await client.aclose()
+
+    await sync_to_async(pollstats.rollup_stats)(db_feed.pk for group in groups.values() for db_feed in group)
+
+    return {
+                "sources": len(groups),
+                "failed": fetch.failed + parse.failed + write.failed,
+                "new_items": fetch.new_items + write.new_items,
+                "stages": {stage.name: stage.report() for stage in (fetch, parse, write)}
+            }
+
+
+async def fetch_source(url: str, client=None) -> tuple:
+    """Fetch a feed source without blocking the event loop.
+
+    Args:
+        url (str): Source url.
+        client (httpx.AsyncClient): Client to fetch with. Falls back to requests in a worker thread if None.
+
+    Returns:
+        tuple: Response body (bytes) and Content-Type header (str).
+    """
+    start = time.perf_counter()
+
+    if client is not None:
+        r = await client.get(url)
+    else:
+        r = await sync_to_async(requests.get, thread_sensitive=False)(url, timeout=FETCH_TIMEOUT)
+
+    elapsed = time.perf_counter() - start
+    metrics.observe_fetch("rss", elapsed, r.status_code, len(r.content))
+    pollstats.note(http_status=r.status_code, bytes=len(r.content), fetch_ms=pollstats.milliseconds(elapsed))
+
+    return r.content, r.headers.get('Content-Type')
+
+
+async def parse_source(content: bytes, content_type: str = None) -> rss.FeedObj:
+    """Parse a fetched RSS body in the parse pool.
+
+    Args:
+        content (bytes): Raw response body.
+        content_type (str): HTTP Content-Type header of the response, if any.
+
+    Returns:
+        rss.FeedObj: Parsed feed, or None if the body is not an RSS feed.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+
+    feed = await loop.run_in_executor(get_parse_pool(), parsing.parse_feed, content, content_type)
+
+    if feed is not None and feed.items:
+        metrics.PARSE_SECONDS_PER_ITEM.observe((time.perf_counter() - start) / len(feed.items))
+
+    return feed
+
+
+async def __fetch_stage(stage: Stage, parse_queue: asyncio.Queue, client):
+    while True:
+        stage.take()
+        task = await stage.queue.get()
+
+        if task is __DONE:
+            return
+
+        kind, group = task
+        start = time.perf_counter()
+
+        if kind == "page":
+            # Scraped pages go through the synchronous poller, and their
+            # results skip the parse and write stages and the rollup
+            try:
+                stats = await sync_to_async(poller.poll_feeds)(group, rollup=False)
+            except Exception:
+                logger.exception("Polling %s failed", group[0].page_url)
+                stats = {"failed": 1}
+            finally:
+                stage.busy += time.perf_counter() - start
+
+            if stats["failed"]:
+                stage.failed += 1
+            else:
+                stage.processed += 1
+                stage.new_items += stats["new_items"]
+            continue
+
+        link = group[0].rss_link
+        record = pollstats.PollRecord(group)
+        # Ends in the stage that finishes with the source
+        span = tracing.start_span("poll", kind=kind, source=link, feeds=len(group))
+
+        try:
+            with pollstats.tracking(record), tracing.use(span), tracing.span("ingest.fetch"):
+                content, content_type = await fetch_source(link, client)
+        except Exception as e:
+            logger.exception("Fetching %s failed", link)
+            stage.failed += 1
+            record.fail()
+            await sync_to_async(pollstats.save_poll)(record)
+            span.end(e)
+            continue
+        finally:
+            stage.busy += time.perf_counter() - start
+
+        # A mocked or cached fetch may not have reported its size
+        record.bytes = record.bytes or len(content)
+        record.fetch_ms = record.fetch_ms or pollstats.milliseconds(time.perf_counter() - start)
+
+        stage.processed += 1
+        await parse_queue.put((record, span, content, content_type))
+
+
+async def __parse_stage(stage: Stage, write_queue: asyncio.Queue):
+    while True:
+        stage.take()
+        task = await stage.queue.get()
+
+        if task is __DONE:
+            return
+
+        record, span, content, content_type = task
+        link = record.feeds[0].rss_link
+        start = time.perf_counter()
+
+        try:
+            with tracing.use(span), tracing.span("ingest.parse", bytes=len(content)):
+                feed = await parse_source(content, content_type)
+        except Exception:
+            logger.exception("Parsing %s failed", link)
+            feed = None
+        finally:
+            stage.busy += time.perf_counter() - start
+            record.parse_ms = pollstats.milliseconds(time.perf_counter() - start)
+
+        if feed is None:
+            logger.info("No RSS feed found at %s", link)
+            stage.failed += 1
+            record.fail()
+            await sync_to_async(pollstats.save_poll)(record)
+            span.set(failed=True)
+            span.end()
+            continue
+
+        stage.processed += 1
+        await write_queue.put((record, span, feed))
+
+
+async def __write_stage(stage: Stage):
+    done = False
+
+    while not done:
+        stage.take()
+        batch = [await stage.queue.get()]
+
+        # Take whatever else is already waiting, up to a full batch
+        while len(batch) < settings.WRITE_BATCH_SIZE and not stage.queue.empty():
+            batch.append(stage.queue.get_nowait())
+
+        if batch[-1] is __DONE:
+            batch.pop()
+            done = True
+
+        if batch:
+            start = time.perf_counter()
+
+            # The writer must keep draining its queue, or the stages before it block
+            try:
+                written, failed, new_items = await sync_to_async(__write_batch)(batch)
+            except Exception:
+                logger.exception("Writing a batch of %d source(s) failed", len(batch))
+                written, failed, new_items = 0, len(batch), 0
+            finally:
+                stage.busy += time.perf_counter() - start
+
+            stage.processed += written
+            stage.failed += failed
+            stage.new_items += new_items
+
+
+def __write_batch(batch: list) -> tuple:
+    """Merge several parsed feeds into the database in one transaction.
+
+    Each source is written under its own savepoint, so one bad feed does not
+    roll back the rest of the batch.
+
+    Returns:
+        tuple: Sources written, sources failed and new items.
+    """
+    written = failed = new_items = 0
+
+    with transaction.atomic():
+        for record, span, feed in batch:
+            error = None
+
+            try:
+                with tracing.use(span), tracing.span("ingest.write", batch=len(batch)), transaction.atomic():
+                    new_items += sum(record.write(db_feed, rss.update_feed_in_database, db_feed.pk, feed)
+                                     for db_feed in record.feeds)
+            except Exception as e:
+                logger.exception("Writing %s failed", record.feeds[0].rss_link)
+                failed += 1
+                record.fail()
+                error = e
+            else:
+                written += 1
+
+            pollstats.save_poll(record)
+            span.end(error)
+
+    return written, failed, new_items
@@ -0,0 +1,212 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import poller
+from .models import Feed, Job
+
+
+logger = logging.getLogger(__name__)
+
+# Every canonical source has one Job row that is rescheduled after each
+# poll. A worker claims a job by leasing it for JOB_LEASE_TIMEOUT seconds;
+# if the worker dies the lease runs out and another worker picks the job up.
+
+
+class JobFailed(Exception):
+    """A job ran but could not poll its source."""
+
+
+def schedule_polls(feeds=None) -> int:
+    """Make sure every feed source has a poll job.
+
+    Safe to run on several nodes at once; existing jobs are left alone.
+
+    Args:
+        feeds (Iterable[Feed]): Feeds to schedule. Defaults to every RSS and scraped feed.
+
+    Returns:
+        int: Number of sources without a job before the call.
+    """
+    if feeds is None:
+        feeds = Feed.objects.filter(~Q(rss_link='') | ~Q(page_url='')).only(
+                'id', 'rss_link', 'canonical_link', 'page_url')
+
+    keys = set(poller.group_feeds_by_source(feeds))
+    existing = set(Job.objects.values_list('kind', 'source'))
+
+    now = timezone.now()
+    Job.objects.bulk_create([Job(kind=kind, source=source, run_after=now) for kind, source in keys - existing],
+                            ignore_conflicts=True)
+
+    return len(keys - existing)
+
+
+def claim_jobs(worker_id: str, limit: int = 1) -> list:
+    """Lease up to limit due jobs to a worker.
+
+    PostgreSQL skips rows another worker is claiming with SELECT ... FOR
+    UPDATE SKIP LOCKED. Databases without SKIP LOCKED, such as SQLite, claim
+    one row at a time with a conditional update, so only one worker wins
+    each row.
+
+    Args:
+        worker_id (str): Unique name of the claiming worker.
+        limit (int): Maximum number of jobs to claim.
+
+    Returns:
+        list: Claimed Job objects.
+    """
+    now = timezone.now()
+    available = Job.objects.filter(run_after__lte=now).filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+    candidates = available.order_by('run_after').values_list('pk', flat=True)
+    lease = {
+                'locked_by': worker_id,
+                'locked_until': now + datetime.timedelta(seconds=settings.JOB_LEASE_TIMEOUT),
+                'attempts': F('attempts') + 1
+            }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            claimed = list(candidates.select_for_update(skip_locked=True)[:limit])
+            Job.objects.filter(pk__in=claimed).update(**lease)
+    else:
+        claimed = [pk for pk in candidates[:limit] if available.filter(pk=pk).update(**lease)]
+
+    return list(Job.objects.filter(pk__in=claimed, locked_by=worker_id).order_by('run_after'))
+
+
+def complete_job(job: Job, worker_id: str) -> bool:
+    """Release a finished job and schedule its next poll.
+
+    Args:
+        job (Job): Claimed job.
+        worker_id (str): Worker holding the lease.
+
+    Returns:
+        bool: False if the lease was lost to another worker.
+    """
+    return bool(__owned(job, worker_id).update(
+            run_after=timezone.now() + datetime.timedelta(seconds=settings.POLL_INTERVAL),
+            locked_until=None, locked_by='', attempts=0, last_error=''))
+
+
+def fail_job(job: Job, worker_id: str, error: str) -> bool:
+    """Release a failed job for a retry with exponential backoff.
+
+    After JOB_MAX_ATTEMPTS attempts the job waits for its next regular poll.
+
+    Args:
+        job (Job): Claimed job.
+        worker_id (str): Worker holding the lease.
+        error (str): Reason for the failure.
+
+    Returns:
+        bool: False if the lease was lost to another worker.
+    """
+    if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+        logger.warning("Giving up on %s after %d attempts: %s", job, job.attempts, error)
+        delay = settings.POLL_INTERVAL
+        attempts = 0
+    else:
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        attempts = job.attempts
+
+    return bool(__owned(job, worker_id).update(
+            run_after=timezone.now() + datetime.timedelta(seconds=delay),
+            locked_until=None, locked_by='', attempts=attempts, last_error=error))
+
+
+def run_job(job: Job, polled: set = None) -> dict:
+    """Poll the source of a job.
+
+    Jobs whose source no longer has any feeds are deleted.
+
+    Args:
+        job (Job): Job to run.
+        polled (set): If given, the ids of the polled feeds are added to it, for a later rollup of their stats.
+
+    Returns:
+        dict: Poll stats, as returned by poller.poll_feeds.
+
+    Raises:
+        JobFailed: The source could not be fetched.
+    """
+    if job.kind == Job.PAGE:
+        feeds = Feed.objects.exclude(page_url='').filter(
+                Q(canonical_link=job.source) | Q(canonical_link='', page_url=job.source))
+    else:
+        feeds = Feed.objects.filter(page_url='').exclude(rss_link='').filter(
+                Q(canonical_link=job.source) | Q(canonical_link='', rss_link=job.source))
+
+    feeds = list(feeds.only('id', 'rss_link', 'canonical_link', 'page_url', 'page_hash'))
+
+    if not feeds:
+        Job.objects.filter(pk=job.pk).delete()
+        return {"sources": 0, "failed": 0, "new_items": 0}
+
+    if polled is not None:
+        polled.update(db_feed.pk for db_feed in feeds)
+
+    # Workers roll up stats on a timer instead
+    stats = poller.poll_feeds(feeds, rollup=False)
+
+    if stats["failed"]:
+        raise JobFailed("Could not fetch " + job.source)
+
+    return stats
+
+
+def work(worker_id: str, limit: int = 1, polled: set = None) -> int:
+    """Claim and run one batch of due jobs.
+
+    Args:
+        worker_id (str): Unique name of this worker.
+        limit (int): Maximum number of jobs to claim.
+        polled (set): If given, the ids of the polled feeds are added to it.
+
+    Returns:
+        int: Number of jobs claimed.
+    """
+    jobs = claim_jobs(worker_id, limit)
+
+    for job in jobs:
+        # Earlier leases ran out without the job finishing
+        if job.attempts > settings.JOB_MAX_ATTEMPTS:
+            fail_job(job, worker_id, job.last_error or "Lease expired")
+            continue
+
+        try:
+            stats = run_job(job, polled)
+        except Exception as e:
+            logger.exception("Job %s failed", job)
+            fail_job(job, worker_id, str(e) or e.__class__.__name__)
+        else:
+            logger.info("Job %s done, %d new item(s)", job, stats["new_items"])
+            complete_job(job, worker_id)
+
+    return len(jobs)
+
+
+def __owned(job: Job, worker_id: str):
+    return Job.objects.filter(pk=job.pk, locked_by=worker_id)
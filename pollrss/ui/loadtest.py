@@ -0,0 +1,281 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import importlib.util
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+import requests
+
+from . import bench, rss
+from .models import Feed
+from .parsing import parse_feed
+
+
+# Load tests of the public feed endpoint. Seeded feeds are served by a
+# gunicorn started for each run, and reader threads request them the way
+# feed readers do: popular feeds more often than others, and, for readers
+# that support it, with the ETag of the copy they already have.
+
+# Seeded feeds are recognised, and deleted, by this link prefix
+SEED_PREFIX = "http://loadtest.invalid/"
+
+CACHE_BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "dummy": "django.core.cache.backends.dummy.DummyCache",
+}
+
+SERVER_START_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+
+QUERY_SAMPLE = re.compile(r'^pollrss_request_queries_(sum|count)\{view="feed"\} ([0-9.e+]+)$', re.MULTILINE)
+
+
+def seed_feeds(count: int, items: int, description_size: int = 200) -> list:
+    """Write synthetic feeds to the database.
+
+    Args:
+        count (int): Number of feeds.
+        items (int): Items per feed.
+        description_size (int): Approximate description length per item.
+
+    Returns:
+        list: New feed ids.
+    """
+    feed_obj = parse_feed(bench.make_rfeed(items, description_size).rss().encode("utf-8"), "application/rss+xml")
+
+    return [rss.write_feed_to_database(feed_obj, "%s%d-%d.rss" % (SEED_PREFIX, time.time_ns(), i)) for i in range(count)]
+
+
+def delete_seeded_feeds() -> int:
+    """Delete every feed written by seed_feeds.
+
+    Returns:
+        int: Number of feeds deleted.
+    """
+    _, counts = Feed.objects.filter(rss_link__startswith=SEED_PREFIX).delete()
+
+    return counts.get(Feed._meta.label, 0)
+
+
+@contextmanager
+def start_server(worker_class: str = "sync", workers: int = 2, threads: int = 1, cache: str = "locmem"):
+    """Run gunicorn on a free local port for the duration of a with block.
+
+    The server uses this process' database settings with DEBUG off. Worker
+    classes from uvicorn serve the ASGI application with the async views.
+
+    Args:
+        worker_class (str): Gunicorn worker class, e.g. sync, gthread or uvicorn.workers.UvicornWorker.
+        workers (int): Worker processes.
+        threads (int): Threads per worker, for the gthread worker class.
+        cache (str): Cache backend name from CACHE_BACKENDS.
+
+    Yields:
+        str: Base url of the server.
+
+    Raises:
+        RuntimeError: gunicorn is not installed or the server did not start.
+    """
+    if importlib.util.find_spec("gunicorn") is None:
+        raise RuntimeError("gunicorn is not installed (pip install gunicorn)")
+
+    port = __free_port()
+    base_url = "http://127.0.0.1:%d" % port
+    asgi = "uvicorn" in worker_class
+
+    with tempfile.TemporaryDirectory(prefix="pollrss-loadtest-") as scratch, \
+            open(os.path.join(scratch, "server.log"), "w+b") as log:
+        env = dict(os.environ,
+                   DJANGO_DEBUG="False",
+                   DJANGO_ALLOWED_HOSTS="127.0.0.1",
+                   DJANGO_ASYNC_VIEWS="True" if asgi else "",
+                   DJANGO_CACHE_BACKEND=CACHE_BACKENDS[cache],
+                   DJANGO_CACHE_LOCATION=os.path.join(scratch, "cache") if cache == "file" else "",
+                   DJANGO_METRICS_DIR=os.path.join(scratch, "metrics"))
+
+        server = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "pollrss.asgi" if asgi else "pollrss.wsgi",
+                 "--worker-class", worker_class, "--workers", str(workers), "--threads", str(threads),
+                 "--bind", "127.0.0.1:%d" % port, "--chdir", str(settings.BASE_DIR)],
+                env=env, stdout=subprocess.DEVNULL, stderr=log)
+
+        try:
+            __wait_for_server(server, base_url, log)
+            yield base_url
+
+        finally:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+
+
+def run_readers(base_url: str, feed_ids: list, readers: int = 10, duration: float = 10.0,
+                conditional: float = 0.8, think: float = 0.0) -> dict:
+    """Request feeds from a server with concurrent readers.
+
+    Feed popularity follows Zipf's law: the first feed is requested twice as
+    often as the second, three times as often as the third, and so on.
+
+    Args:
+        base_url (str): Server base url.
+        feed_ids (list): Feeds to request.
+        readers (int): Concurrent readers.
+        duration (float): Seconds to run for.
+        conditional (float): Fraction of readers that send If-None-Match with the last ETag they saw.
+        think (float): Seconds each reader waits between requests.
+
+    Returns:
+        dict: Requests, errors, responses by status, throughput, latency percentiles in milliseconds and, if the server exposes /metrics, database queries.
+    """
+    weights = [1 / rank for rank in range(1, len(feed_ids) + 1)]
+    results = [None] * readers
+    deadline = time.monotonic() + duration
+
+    def read(index):
+        rng = random.Random(index)
+        honours_etag = index < round(readers * conditional)
+        etags = {}
+        latencies = []
+        statuses = {}
+        errors = 0
+        size = 0
+
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                feed_id = rng.choices(feed_ids, weights)[0]
+                headers = {"If-None-Match": etags[feed_id]} if honours_etag and feed_id in etags else {}
+                start = time.perf_counter()
+
+                try:
+                    response = session.get("%s/feed/%d.rss" % (base_url, feed_id), headers=headers, timeout=REQUEST_TIMEOUT)
+                except requests.RequestException:
+                    errors += 1
+                    continue
+
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                size += len(response.content)
+
+                if response.status_code == 200 and "ETag" in response.headers:
+                    etags[feed_id] = response.headers["ETag"]
+
+                if think:
+                    time.sleep(think)
+
+        results[index] = (latencies, statuses, errors, size)
+
+    queries_before = __scrape_queries(base_url)
+    start = time.monotonic()
+
+    threads = [threading.Thread(target=read, args=(i,), daemon=True) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+    queries_after = __scrape_queries(base_url)
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    statuses = {}
+    for result in results:
+        for status, count in result[1].items():
+            statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    report = {
+                "readers": readers,
+                "seconds": round(elapsed, 3),
+                "requests": len(latencies),
+                "errors": sum(result[2] for result in results),
+                "statuses": statuses,
+                "requests_per_second": round(len(latencies) / elapsed, 2),
+                "megabytes_per_second": round(sum(result[3] for result in results) / elapsed / 1e6, 3)
+            }
+    report.update(__latency_percentiles(latencies))
+
+    if queries_before is not None and queries_after is not None:
+        queries = queries_after[0] - queries_before[0]
+        requests_counted = queries_after[1] - queries_before[1]
+        report["db_queries_per_second"] = round(queries / elapsed, 2)
+        report["db_queries_per_request"] = round(queries / requests_counted, 3) if requests_counted else 0.0
+
+    return report
+
+
+def __latency_percentiles(latencies: list) -> dict:
+    if len(latencies) < 2:
+        return {"latency_p50_ms": None, "latency_p90_ms": None, "latency_p99_ms": None, "latency_max_ms": None}
+
+    cuts = statistics.quantiles(latencies, n=100)
+
+    return {
+                "latency_p50_ms": round(cuts[49] * 1000, 3),
+                "latency_p90_ms": round(cuts[89] * 1000, 3),
+                "latency_p99_ms": round(cuts[98] * 1000, 3),
+                "latency_max_ms": round(latencies[-1] * 1000, 3)
+            }
+
+
+def __scrape_queries(base_url: str):
+    """Get the total database queries and requests of the feed view from /metrics."""
+    try:
+        response = requests.get(base_url + "/metrics", timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+
+    samples = dict(QUERY_SAMPLE.findall(response.text))
+
+    return float(samples.get("sum", 0)), float(samples.get("count", 0))
+
+
+def __wait_for_server(server: subprocess.Popen, base_url: str, log):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            raise RuntimeError("Server exited: " + log.read().decode("utf-8", "replace")[-2000:])
+
+        try:
+            requests.get(base_url + "/metrics", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    raise RuntimeError("Server did not start within %d seconds" % SERVER_START_TIMEOUT)
+
+
+def __free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,72 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from django.core.management.base import BaseCommand
+
+import datetime
+import json
+import platform
+import subprocess
+
+from django.db import connection
+
+from ui import bench
+
+
+class Command(BaseCommand):
+    help = 'Run pollrss benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', action='append', choices=sorted(bench.SUITES),
+                            help='Suite to run (repeatable). Defaults to all suites.')
+        parser.add_argument('--items', type=int, action='append',
+                            help='Items per feed (repeatable). Defaults to each suite\'s own sizes.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        results = {}
+
+        for name in options['suite'] or sorted(bench.SUITES):
+            results[name] = []
+
+            for items in options['items'] or [None]:
+                kwargs = {'repeat': options['repeat']}
+                if items is not None:
+                    kwargs['items'] = items
+
+                rows = bench.SUITES[name](**kwargs)
+
+                for row in (rows if isinstance(rows, list) else [rows]):
+                    results[name].append(row)
+                    self.stdout.write('%s: %s' % (name, ', '.join('%s=%s' % (k, v) for k, v in row.items())))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                            'commit': self.get_commit(),
+                            'db_vendor': connection.vendor,
+                            'python': platform.python_version(),
+                            'repeat': options['repeat'],
+                            'results': results
+                        }, f, indent=2)
+
+    def get_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
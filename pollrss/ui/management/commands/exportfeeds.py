@@ -0,0 +1,31 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ui import export
+
+
+class Command(BaseCommand):
+    help = 'Write every feed to FEED_EXPORT_ROOT as static RSS files.'
+
+    def handle(self, *args, **options):
+        if not export.export_enabled():
+            raise CommandError('FEED_EXPORT_ROOT is not configured.')
+
+        changed = export.export_all_feeds()
+
+        self.stdout.write('Exported %d changed feed(s).' % changed)
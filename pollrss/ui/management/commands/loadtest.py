@@ -0,0 +1,107 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+
+import datetime
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ui import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Load test the feed endpoint with concurrent readers against a local gunicorn.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--feeds', type=int, default=20, help='Feeds to seed.')
+        parser.add_argument('--items', type=int, default=100, help='Items per seeded feed.')
+        parser.add_argument('--description-size', type=int, default=200, help='Approximate description length per item.')
+        parser.add_argument('--readers', type=int, default=20, help='Concurrent readers.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds each run lasts.')
+        parser.add_argument('--warmup', type=float, default=2, help='Seconds of unreported requests before each run.')
+        parser.add_argument('--conditional', type=float, default=0.8,
+                            help='Fraction of readers that send back the ETag they last saw.')
+        parser.add_argument('--think', type=float, default=0, help='Seconds each reader waits between requests.')
+        parser.add_argument('--worker-class', action='append',
+                            help='Gunicorn worker class to compare (repeatable). Defaults to sync.')
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes.')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per worker for gthread.')
+        parser.add_argument('--cache', action='append', choices=sorted(loadtest.CACHE_BACKENDS),
+                            help='Cache backend to compare (repeatable). Defaults to locmem.')
+        parser.add_argument('--url', help='Test an already running server instead of starting gunicorn.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded feeds.')
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        feed_ids = loadtest.seed_feeds(options['feeds'], options['items'], options['description_size'])
+        results = []
+
+        try:
+            if options['url']:
+                runs = [({'url': options['url']}, None)]
+            else:
+                runs = [({'worker_class': worker_class, 'cache': cache}, (worker_class, cache))
+                        for worker_class in options['worker_class'] or ['sync']
+                        for cache in options['cache'] or ['locmem']]
+
+            for config, server in runs:
+                try:
+                    result = dict(config, **self.run(server, feed_ids, options))
+                except RuntimeError as e:
+                    raise CommandError(str(e))
+
+                results.append(result)
+                self.stdout.write(', '.join('%s=%s' % (k, v) for k, v in result.items()))
+
+        finally:
+            if not options['keep']:
+                loadtest.delete_seeded_feeds()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                            'db_vendor': connection.vendor,
+                            'python': platform.python_version(),
+                            'feeds': options['feeds'],
+                            'items': options['items'],
+                            'workers': options['workers'],
+                            'results': results
+                        }, f, indent=2)
+
+    def run(self, server, feed_ids, options):
+        reader_options = {
+                            'readers': options['readers'],
+                            'conditional': options['conditional'],
+                            'think': options['think']
+                        }
+
+        if server is None:
+            return self.measure(options['url'], feed_ids, options, reader_options)
+
+        worker_class, cache = server
+
+        with loadtest.start_server(worker_class, options['workers'], options['threads'], cache) as base_url:
+            return self.measure(base_url, feed_ids, options, reader_options)
+
+    def measure(self, base_url, feed_ids, options, reader_options):
+        if options['warmup']:
+            loadtest.run_readers(base_url, feed_ids, duration=options['warmup'], **reader_options)
+
+        return loadtest.run_readers(base_url, feed_ids, duration=options['duration'], **reader_options)
@@ -0,0 +1,50 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+
+from ui import ingest, poller, sharding
+
+
+class Command(BaseCommand):
+    help = 'Poll every RSS feed once, fetching each source a single time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--serial', action='store_true',
+                            help='Fetch and parse one source at a time in this process.')
+        parser.add_argument('--node-id', help='Poll only the feeds of this node. Defaults to SHARD_NODE_ID.')
+        parser.add_argument('--nodes', help='Comma separated names of every node. Defaults to SHARD_NODES.')
+        parser.add_argument('--shard-by', choices=[sharding.BY_HOST, sharding.BY_FEED],
+                            help='Split feeds between nodes by host or feed id. Defaults to SHARD_BY.')
+
+    def handle(self, *args, **options):
+        nodes = options['nodes'].split(',') if options['nodes'] else None
+
+        try:
+            feeds = sharding.select_feeds(poller.get_pollable_feeds(), options['node_id'], nodes, options['shard_by'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['serial']:
+            stats = poller.poll_feeds(feeds)
+        else:
+            stats = async_to_sync(ingest.poll_feeds_async)(feeds)
+
+        self.stdout.write('Polled %(sources)d source(s), %(failed)d failed, %(new_items)d new item(s).' % stats)
+
+        for name, stage in stats.get('stages', {}).items():
+            self.stdout.write('  %s: %s' % (name, ', '.join('%s=%s' % (k, v) for k, v in stage.items())))
@@ -0,0 +1,67 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from ui import jobs, pollstats
+
+
+class Command(BaseCommand):
+    help = 'Run a polling worker that drains the job queue. Any number of workers may share a database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default='%s:%d' % (socket.gethostname(), os.getpid()),
+                            help='Unique worker name. Defaults to host:pid.')
+        parser.add_argument('--batch', type=int, default=1, help='Jobs claimed at a time.')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when no job is due.')
+        parser.add_argument('--schedule-interval', type=float, default=60,
+                            help='Seconds between checks for feeds without a poll job.')
+        parser.add_argument('--rollup-interval', type=float, default=300,
+                            help='Seconds between rollups of the stats of the feeds polled meanwhile.')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due.')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id']
+        next_schedule = 0
+        next_rollup = time.monotonic() + options['rollup_interval']
+        polled = set()
+
+        self.stdout.write('Worker %s started.' % worker_id)
+
+        while True:
+            if time.monotonic() >= next_schedule:
+                jobs.schedule_polls()
+                next_schedule = time.monotonic() + options['schedule_interval']
+
+            if polled and time.monotonic() >= next_rollup:
+                pollstats.rollup_stats(polled)
+                polled.clear()
+                next_rollup = time.monotonic() + options['rollup_interval']
+
+            if jobs.work(worker_id, options['batch'], polled):
+                continue
+
+            if options['once']:
+                break
+
+            time.sleep(options['sleep'])
+
+        if polled:
+            pollstats.rollup_stats(polled)
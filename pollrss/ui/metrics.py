@@ -0,0 +1,423 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import atexit
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+
+# Counters and histograms kept in process memory and served in the
+# Prometheus text format. Under a server with several worker processes set
+# METRICS_DIR: each process then writes its values to its own file in that
+# directory at most every METRICS_FLUSH_INTERVAL seconds, and /metrics adds
+# up the files of every process. The files of processes that have exited
+# are folded into one total file, so their counts are kept.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REGISTRY = {}
+
+TOTAL_FILE = "total.json"
+
+# Process files are named metrics-<pid>-<token>.json
+PROCESS_FILE = re.compile(r"^metrics-(\d+)[-.]")
+
+_lock = threading.Lock()
+_last_flush = 0.0
+_token = None
+_token_pid = None
+
+
+class Counter():
+    """Monotonically increasing value, optionally split by labels.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        labelnames (tuple): Label names.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Add amount to the counter."""
+        key = _label_values(self, labels)
+
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+        _maybe_flush()
+
+
+class Histogram():
+    """Distribution of observed values in fixed buckets.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        buckets (tuple): Increasing bucket upper bounds. +Inf is added.
+        labelnames (tuple): Label names.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(float(bound) for bound in buckets)
+        self.labelnames = tuple(labelnames)
+        # Per label values: a count per bucket plus one for +Inf, the sum and the count
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        """Record one observation."""
+        key = _label_values(self, labels)
+
+        with _lock:
+            counts, total, count = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+
+            self.values[key] = (counts, total + value, count + 1)
+
+        _maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in a with block."""
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    """Get or register a counter.
+
+    Args:
+        name (str): Metric name, ending in _total.
+        documentation (str): Help text.
+        labelnames (tuple): Label names.
+
+    Returns:
+        Counter: Registered counter.
+    """
+    return REGISTRY.setdefault(name, Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS, labelnames: tuple = ()) -> Histogram:
+    """Get or register a histogram.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        buckets (tuple): Increasing bucket upper bounds.
+        labelnames (tuple): Label names.
+
+    Returns:
+        Histogram: Registered histogram.
+    """
+    return REGISTRY.setdefault(name, Histogram(name, documentation, buckets, labelnames))
+
+
+def snapshot() -> dict:
+    """Get the values of every metric in this process.
+
+    Returns:
+        dict: JSON serializable values keyed by metric name.
+    """
+    with _lock:
+        return {metric.name: [[list(key), _copy(value)] for key, value in metric.values.items()] for metric in REGISTRY.values()}
+
+
+def flush():
+    """Write this process' values to its file in METRICS_DIR, if set."""
+    global _last_flush
+
+    if not settings.METRICS_DIR:
+        return
+
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(snapshot(), f)
+        os.replace(tmp_path, directory / _process_file_name())
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    _last_flush = time.monotonic()
+
+
+def collect() -> dict:
+    """Add up the values of every process.
+
+    Returns:
+        dict: Values keyed by metric name, then by label values.
+    """
+    if settings.METRICS_DIR:
+        flush()
+        directory = Path(settings.METRICS_DIR)
+        snapshots = [merge_exited(directory)]
+        for path in directory.glob("metrics-*.json"):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue
+    else:
+        snapshots = [snapshot()]
+
+    totals = _sum(snapshots)
+
+    return {name: totals.get(name, {}) for name in REGISTRY}
+
+
+def merge_exited(directory: Path) -> dict:
+    """Fold the files of exited processes into the total file and delete them.
+
+    The total file lists the files it already holds, so a file is never
+    added twice, even if deleting it failed.
+
+    Args:
+        directory (Path): Metrics directory.
+
+    Returns:
+        dict: Values of every exited process, in the format of snapshot().
+    """
+    total_path = directory / TOTAL_FILE
+
+    with open(directory / ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            total = json.loads(total_path.read_text())
+        except (OSError, ValueError):
+            total = {"values": {}, "merged": []}
+
+        exited = [path for path in directory.glob("metrics-*.json") if not _is_running(path)]
+
+        if exited:
+            merged = set(total["merged"])
+            snapshots = [total["values"]]
+
+            for path in exited:
+                if path.name in merged:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+
+            total = {
+                        "values": {name: [[list(key), value] for key, value in samples.items()]
+                                   for name, samples in _sum(snapshots).items()},
+                        "merged": [path.name for path in exited]
+                    }
+
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".total-")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(total, f)
+                os.replace(tmp_path, total_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+            for path in exited:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    return total["values"]
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Metrics text.
+    """
+    out = []
+    totals = collect()
+
+    for name in sorted(REGISTRY):
+        metric = REGISTRY[name]
+        out.append("# HELP %s %s" % (name, metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")))
+        out.append("# TYPE %s %s" % (name, metric.type))
+
+        for key, value in sorted(totals[name].items()):
+            labels = list(zip(metric.labelnames, key))
+
+            if metric.type == "counter":
+                out.append("%s%s %s" % (name, _format_labels(labels), _format_value(value)))
+                continue
+
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                out.append("%s_bucket%s %d" % (name, _format_labels(labels + [("le", le)]), cumulative))
+
+            out.append("%s_sum%s %s" % (name, _format_labels(labels), _format_value(total)))
+            out.append("%s_count%s %d" % (name, _format_labels(labels), count))
+
+    return "\n".join(out) + "\n"
+
+
+def _process_file_name() -> str:
+    global _token, _token_pid
+
+    # Pids are reused, so a new process never takes over the file of an
+    # exited one. A forked child gets a token of its own.
+    if _token_pid != os.getpid():
+        _token_pid = os.getpid()
+        _token = uuid.uuid4().hex
+
+    return "metrics-%d-%s.json" % (_token_pid, _token)
+
+
+def _is_running(path: Path) -> bool:
+    match = PROCESS_FILE.match(path.name)
+
+    if match is None or int(match.group(1)) == os.getpid():
+        return True
+
+    try:
+        os.kill(int(match.group(1)), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _sum(snapshots: list) -> dict:
+    totals = {}
+    for values in snapshots:
+        for name, samples in values.items():
+            metric = totals.setdefault(name, {})
+
+            for key, value in samples:
+                key = tuple(key)
+                metric[key] = _add(metric.get(key), value)
+
+    return totals
+
+
+def _label_values(metric, labels: dict) -> tuple:
+    if set(labels) != set(metric.labelnames):
+        raise ValueError("%s takes labels %r, got %r" % (metric.name, metric.labelnames, tuple(labels)))
+
+    return tuple(str(labels[name]) for name in metric.labelnames)
+
+
+def _maybe_flush():
+    if settings.METRICS_DIR and time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def _copy(value):
+    if isinstance(value, tuple):
+        counts, total, count = value
+        return [list(counts), total, count]
+
+    return value
+
+
+def _add(current, value):
+    if current is None:
+        return value
+
+    if isinstance(value, list):
+        counts, total, count = value
+        return [[a + b for a, b in zip(current[0], counts)], current[1] + total, current[2] + count]
+
+    return current + value
+
+
+def _format_labels(labels: list) -> str:
+    if not labels:
+        return ""
+
+    return "{%s}" % ",".join('%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                             for name, value in labels)
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+# Flush on exit so short lived processes, like pollfeeds, are counted
+atexit.register(lambda: settings.METRICS_DIR and flush())
+
+
+FETCH_SECONDS = histogram("pollrss_fetch_seconds", "Time to download an upstream feed or page.", labelnames=("kind",))
+FETCH_BYTES = counter("pollrss_fetch_bytes_total", "Bytes downloaded from upstream feeds and pages.", ("kind",))
+FETCH_RESPONSES = counter("pollrss_fetch_responses_total", "Upstream responses by HTTP status.", ("kind", "status"))
+PARSE_SECONDS_PER_ITEM = histogram("pollrss_parse_seconds_per_item", "Time to parse a fetched feed divided by its items.",
+                                   buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+DB_WRITE_SECONDS = histogram("pollrss_db_write_seconds", "Time to write a fetched feed to the database.")
+ITEMS_INSERTED = counter("pollrss_items_inserted_total", "Item rows written to the database.")
+RENDER_SECONDS = histogram("pollrss_feed_render_seconds", "Time to render a feed from the database.")
+FEED_CACHE_REQUESTS = counter("pollrss_feed_cache_requests_total", "Feed body lookups by cache result: fresh, stale or miss.",
+                              ("result",))
+REQUEST_SECONDS = histogram("pollrss_request_seconds", "Time to handle a request.", labelnames=("view",))
+REQUEST_QUERIES = histogram("pollrss_request_queries", "Database queries per request.",
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500), labelnames=("view",))
+
+
+def observe_fetch(kind: str, seconds: float, status: int, size: int):
+    """Record one upstream download.
+
+    Args:
+        kind (str): What was fetched: rss, page or discovery.
+        seconds (float): Time the download took.
+        status (int): HTTP status code.
+        size (int): Body size in bytes.
+    """
+    FETCH_SECONDS.observe(seconds, kind=kind)
+    FETCH_RESPONSES.inc(kind=kind, status=status)
+    FETCH_BYTES.inc(size, kind=kind)
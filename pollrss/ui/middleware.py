@@ -0,0 +1,391 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import asyncio
+import contextvars
+import cProfile
+import io
+import json
+import marshal
+import pstats
+import random
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics, tracing
+
+
+# Number of functions listed in a text profile
+PROFILE_STATS_LIMIT = 40
+
+# Every middleware here works both ways: with sync views, and under ASGI
+# with async views, where a sync middleware would make Django run every
+# request through its single sync thread. Whitenoise and the Django
+# middleware in settings.MIDDLEWARE work both ways too.
+#
+# Under ASGI the queries of a request run in whatever thread sync_to_async
+# picks, so queries are not counted with a wrapper installed for the
+# request's thread. Every connection has one wrapper instead, which reports
+# to the recorders of the request in the current context.
+
+_recorders = contextvars.ContextVar("pollrss_query_recorders", default=())
+
+
+def _record_query(execute, sql, params, many, context):
+    recorders = _recorders.get()
+
+    if not recorders:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        for recorder in recorders:
+            recorder(duration, sql)
+
+
+def _install_recorder(db_connection):
+    if _record_query not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    _install_recorder(connection)
+
+
+@contextmanager
+def recording_queries(recorder):
+    """Report the duration and SQL of each query made in a with block, in any thread.
+
+    Args:
+        recorder (Callable): Called with the duration in seconds and SQL of each query.
+    """
+    # Connections opened before the app was ready
+    _install_recorder(connection)
+
+    token = _recorders.set(_recorders.get() + (recorder,))
+
+    try:
+        yield
+    finally:
+        _recorders.reset(token)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise, which does not support async views itself."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings=settings)
+
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks through the file system
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+
+        if static_file is not None:
+            return self.serve(static_file, request)
+
+        return await self.get_response(request)
+
+
+class MetricsMiddleware():
+    """Record the duration and database query count of each request, by view name."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        queries = []
+        start = time.perf_counter()
+
+        with recording_queries(lambda duration, sql: queries.append(duration)):
+            response = self.get_response(request)
+
+        self.observe(request, time.perf_counter() - start, len(queries))
+
+        return response
+
+    async def __acall__(self, request):
+        queries = []
+        start = time.perf_counter()
+
+        with recording_queries(lambda duration, sql: queries.append(duration)):
+            response = await self.get_response(request)
+
+        self.observe(request, time.perf_counter() - start, len(queries))
+
+        return response
+
+    def observe(self, request, seconds: float, queries: int):
+        """Record one finished request."""
+        # Label by url name rather than path to keep the number of series bounded
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match is not None else "unmatched"
+
+        metrics.REQUEST_SECONDS.observe(seconds, view=view)
+        metrics.REQUEST_QUERIES.observe(queries, view=view)
+
+
+class TracingMiddleware():
+    """Run each request in a root span, continuing the caller's trace from a traceparent header."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        if not tracing.enabled():
+            return self.get_response(request)
+
+        span = self.start(request)
+
+        with tracing.use(span):
+            try:
+                response = self.get_response(request)
+            except BaseException as e:
+                span.end(e)
+                raise
+
+        return self.finish(request, span, response)
+
+    async def __acall__(self, request):
+        if not tracing.enabled():
+            return await self.get_response(request)
+
+        span = self.start(request)
+
+        with tracing.use(span):
+            try:
+                response = await self.get_response(request)
+            except BaseException as e:
+                span.end(e)
+                raise
+
+        return self.finish(request, span, response)
+
+    def start(self, request):
+        """Start the root span of a request."""
+        return tracing.start_span("request", traceparent=request.headers.get("traceparent"),
+                                  method=request.method, path=request.path)
+
+    def finish(self, request, span, response):
+        """Name the span after the view that answered and end it."""
+        match = request.resolver_match
+        span.name = "request " + ((match.url_name or match.view_name) if match is not None else "unmatched")
+        span.set(status=response.status_code)
+        span.end()
+
+        return response
+
+
+class ProfilingMiddleware():
+    """Profile requests with cProfile and account for their SQL queries.
+
+    Staff users profile a request by sending an X-Profile header or a
+    profile query parameter. Its value picks the output:
+
+        summary (or any other value): the normal response, with a Server-Timing header
+        text: a plain text report of the slowest functions and queries
+        download: the raw cProfile stats, for snakeviz or pstats
+
+    Independently, PROFILE_SAMPLE_RATE of all requests are profiled and
+    written to PROFILE_DIR, which keeps the newest PROFILE_RING_SIZE profiles.
+
+    Under ASGI the profile only covers the event loop thread, including any
+    other requests it ran meanwhile. Queries are still those of the request.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        mode = self.requested_mode(request)
+        sampled = self.sampled()
+
+        if mode is None and not sampled:
+            return self.get_response(request)
+
+        queries = []
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+
+        with recording_queries(lambda duration, sql: queries.append((duration, sql))):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+
+        return self.respond(request, response, mode, sampled, profiler, time.perf_counter() - start, queries)
+
+    async def __acall__(self, request):
+        # Looking up the user is a query, so only for requests that ask
+        mode = None
+        if request.META.get("HTTP_X_PROFILE") or request.GET.get("profile"):
+            mode = await sync_to_async(self.requested_mode)(request)
+
+        sampled = self.sampled()
+
+        if mode is None and not sampled:
+            return await self.get_response(request)
+
+        queries = []
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+
+        with recording_queries(lambda duration, sql: queries.append((duration, sql))):
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+
+        return self.respond(request, response, mode, sampled, profiler, time.perf_counter() - start, queries)
+
+    def sampled(self) -> bool:
+        """Pick whether to store a profile of this request."""
+        return bool(settings.PROFILE_DIR) and random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def respond(self, request, response, mode: str, sampled: bool, profiler: cProfile.Profile, total: float,
+                queries: list):
+        """Store a sampled profile and build the response a profiled request asked for."""
+        summary = self.summarize(request, total, queries)
+
+        if sampled:
+            self.store(profiler, summary)
+
+        if mode == "download":
+            return self.download(profiler)
+
+        if mode == "text":
+            return HttpResponse(self.report(profiler, summary), content_type="text/plain; charset=utf-8")
+
+        if mode is not None:
+            response["Server-Timing"] = 'total;dur=%.1f, sql;dur=%.1f;desc="%d queries"' % (
+                    total * 1000, summary["sql_ms"], summary["queries"])
+
+        return response
+
+    def requested_mode(self, request) -> str:
+        """Get the profile output a staff user asked for, or None."""
+        mode = request.META.get("HTTP_X_PROFILE") or request.GET.get("profile")
+
+        if not mode:
+            return None
+
+        user = getattr(request, "user", None)
+        if user is None or not user.is_staff:
+            return None
+
+        return mode if mode in ("text", "download") else "summary"
+
+    def summarize(self, request, total: float, queries: list) -> dict:
+        """Summarize the timing and queries of a profiled request."""
+        slowest = sorted(queries, key=lambda query: query[0], reverse=True)[:settings.PROFILE_SLOW_QUERIES]
+
+        return {
+                    "path": request.get_full_path(),
+                    "method": request.method,
+                    "total_ms": round(total * 1000, 3),
+                    "queries": len(queries),
+                    "sql_ms": round(sum(duration for duration, sql in queries) * 1000, 3),
+                    "slowest_queries": [{"ms": round(duration * 1000, 3), "sql": sql} for duration, sql in slowest]
+                }
+
+    def report(self, profiler: cProfile.Profile, summary: dict) -> str:
+        """Render a plain text profile report."""
+        out = io.StringIO()
+
+        out.write("%(method)s %(path)s: %(total_ms).1f ms, %(queries)d queries in %(sql_ms).1f ms\n\n" % summary)
+
+        out.write("Slowest queries:\n")
+        for query in summary["slowest_queries"]:
+            out.write("  %8.3f ms  %s\n" % (query["ms"], query["sql"]))
+        out.write("\n")
+
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_STATS_LIMIT)
+
+        return out.getvalue()
+
+    def download(self, profiler: cProfile.Profile) -> HttpResponse:
+        """Return the raw profile as a file download."""
+        profiler.create_stats()
+
+        # The format pstats.Stats and snakeviz load from a file
+        response = HttpResponse(marshal.dumps(profiler.stats), content_type="application/octet-stream")
+        response["Content-Disposition"] = 'attachment; filename="request.prof"'
+
+        return response
+
+    def store(self, profiler: cProfile.Profile, summary: dict):
+        """Write a sampled profile to PROFILE_DIR and drop the oldest beyond PROFILE_RING_SIZE."""
+        directory = Path(settings.PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        name = "%d-%d" % (time.time() * 1000, random.randrange(1000000))
+        profiler.dump_stats(str(directory / (name + ".prof")))
+        (directory / (name + ".json")).write_text(json.dumps(summary))
+
+        # Names start with the time in milliseconds, so they sort oldest first
+        profiles = sorted(directory.glob("*.prof"))
+        for path in profiles[:max(0, len(profiles) - settings.PROFILE_RING_SIZE)]:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-19 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0006_feed_rss_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='fragment',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
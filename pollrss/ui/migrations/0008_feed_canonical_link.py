@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-19 13:23
+
+from django.db import migrations, models
+
+from ui.canonical import canonicalize_url
+
+
+def fill_canonical_links(apps, schema_editor):
+    Feed = apps.get_model('ui', 'Feed')
+
+    for feed in Feed.objects.exclude(rss_link=''):
+        feed.canonical_link = canonicalize_url(feed.rss_link)
+        feed.save(update_fields=['canonical_link'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0007_item_fragment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='canonical_link',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=256),
+        ),
+        migrations.RunPython(fill_canonical_links, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='item',
+            name='fingerprint',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AlterUniqueTogether(
+            name='item',
+            unique_together={('feed', 'fingerprint')},
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.14 on 2026-10-19 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0008_feed_canonical_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='page_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='page_url',
+            field=models.CharField(blank=True, default='', max_length=2000),
+        ),
+        migrations.CreateModel(
+            name='Selector',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('item', 'Item'), ('title', 'Title'), ('link', 'Link'), ('description', 'Description')], max_length=20)),
+                ('kind', models.CharField(choices=[('xpath', 'XPath'), ('css', 'CSS')], default='xpath', max_length=10)),
+                ('expression', models.CharField(max_length=2000)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ui.feed')),
+            ],
+            options={
+                'unique_together': {('feed', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.1.14 on 2026-10-19 13:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0010_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedStats',
+            fields=[
+                ('feed', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='ui.feed')),
+                ('polls', models.IntegerField(default=0)),
+                ('failures', models.IntegerField(default=0)),
+                ('changes', models.IntegerField(default=0)),
+                ('change_rate', models.FloatField(default=0)),
+                ('bytes_p50', models.IntegerField(default=0)),
+                ('fetch_ms_p50', models.IntegerField(default=0)),
+                ('fetch_ms_p95', models.IntegerField(default=0)),
+                ('total_ms_p50', models.IntegerField(default=0)),
+                ('total_ms_p95', models.IntegerField(default=0)),
+                ('last_polled', models.DateTimeField(blank=True, null=True)),
+                ('last_changed', models.DateTimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'feed stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='PollLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('failed', 'Failed')], default='ok', max_length=10)),
+                ('http_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('bytes', models.PositiveIntegerField(default=0)),
+                ('fetch_ms', models.PositiveIntegerField(default=0)),
+                ('parse_ms', models.PositiveIntegerField(default=0)),
+                ('write_ms', models.PositiveIntegerField(default=0)),
+                ('new_items', models.PositiveIntegerField(default=0)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ui.feed')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='polllog',
+            index=models.Index(fields=['feed', 'created'], name='ui_polllog_feed_id_02201e_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0011_polllog_feedstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feed',
+            name='canonical_link',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=2000),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0012_widen_canonical_link'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='source',
+            field=models.CharField(max_length=2000),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0013_widen_job_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='feedfield',
+            name='value',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='itemfield',
+            name='value',
+            field=models.TextField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ui', '0014_field_value_text'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='fingerprint',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+    ]
@@ -22,6 +22,9 @@ class Feed(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     rss_link = models.CharField(max_length=256, blank=True, default='')
+    canonical_link = models.CharField(max_length=2000, blank=True, default='', db_index=True)
+    page_url = models.CharField(max_length=2000, blank=True, default='')
+    page_hash = models.CharField(max_length=64, blank=True, default='')
 
     def __str__(self):
         return str(self.id)
@@ -30,26 +33,113 @@ class FeedField(models.Model):
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     required = models.BooleanField(default=True)
-    value = models.CharField(max_length=2000)
+    value = models.TextField()
 
     def __str__(self):
-        return str(self.feed.id) + " - " + self.name
+        return str(self.feed_id) + " - " + self.name
+
+class Selector(models.Model):
+    ITEM = 'item'
+    TITLE = 'title'
+    LINK = 'link'
+    DESCRIPTION = 'description'
+    NAMES = [(ITEM, 'Item'), (TITLE, 'Title'), (LINK, 'Link'), (DESCRIPTION, 'Description')]
+
+    XPATH = 'xpath'
+    CSS = 'css'
+    KINDS = [(XPATH, 'XPath'), (CSS, 'CSS')]
+
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+    name = models.CharField(max_length=20, choices=NAMES)
+    kind = models.CharField(max_length=10, choices=KINDS, default=XPATH)
+    expression = models.CharField(max_length=2000)
+
+    class Meta:
+        unique_together = [['feed', 'name']]
+
+    def __str__(self):
+        return str(self.feed_id) + " - " + self.name
 
 class Item(models.Model):
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
-    fingerprint = models.CharField(max_length=64, unique=True)
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    fragment = models.TextField(blank=True, default='')
+
+    class Meta:
+        unique_together = [['feed', 'fingerprint']]
 
     def __str__(self):
-        return str(self.feed.id) + " - " + str(self.id)
+        return str(self.feed_id) + " - " + str(self.id)
 
 class ItemField(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     required = models.BooleanField(default=True)
-    value = models.CharField(max_length=2000)
+    value = models.TextField()
 
     def __str__(self):
-        return str(self.item.id) + " - " + self.name
+        return str(self.item_id) + " - " + self.name
+
+class Job(models.Model):
+    RSS = 'rss'
+    PAGE = 'page'
+    KINDS = [(RSS, 'RSS feed'), (PAGE, 'Scraped page')]
 
+    kind = models.CharField(max_length=10, choices=KINDS)
+    source = models.CharField(max_length=2000)
+    run_after = models.DateTimeField(db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=200, blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['kind', 'source']]
 
+    def __str__(self):
+        return self.kind + " - " + self.source
+
+class PollLog(models.Model):
+    OK = 'ok'
+    FAILED = 'failed'
+    STATUSES = [(OK, 'OK'), (FAILED, 'Failed')]
+
+    feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=OK)
+    http_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    bytes = models.PositiveIntegerField(default=0)
+    fetch_ms = models.PositiveIntegerField(default=0)
+    parse_ms = models.PositiveIntegerField(default=0)
+    write_ms = models.PositiveIntegerField(default=0)
+    new_items = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['feed', 'created'])]
+
+    def __str__(self):
+        return str(self.feed_id) + " - " + self.status
+
+class FeedStats(models.Model):
+    feed = models.OneToOneField(Feed, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    polls = models.IntegerField(default=0)
+    failures = models.IntegerField(default=0)
+    changes = models.IntegerField(default=0)
+    change_rate = models.FloatField(default=0)
+    bytes_p50 = models.IntegerField(default=0)
+    fetch_ms_p50 = models.IntegerField(default=0)
+    fetch_ms_p95 = models.IntegerField(default=0)
+    total_ms_p50 = models.IntegerField(default=0)
+    total_ms_p95 = models.IntegerField(default=0)
+    last_polled = models.DateTimeField(null=True, blank=True)
+    last_changed = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'feed stats'
+
+    def __str__(self):
+        return str(self.feed_id)
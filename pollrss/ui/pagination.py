@@ -0,0 +1,75 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+
+
+# Tables estimated to hold fewer rows than this are counted exactly
+ESTIMATE_THRESHOLD = 100000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that does not COUNT(*) large unfiltered tables.
+
+    On PostgreSQL and MySQL the number of rows of an unfiltered queryset is
+    read from the planner statistics when it is at least ESTIMATE_THRESHOLD.
+    Filtered querysets, small tables and other databases are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+
+        if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+            return estimate
+
+        return super().count
+
+
+def estimate_count(queryset) -> int:
+    """Estimate the rows of an unfiltered queryset from database statistics.
+
+    Args:
+        queryset (QuerySet): Queryset to estimate.
+
+    Returns:
+        int: Estimated row count, or None if the queryset is filtered or the database keeps no estimate.
+    """
+    if not isinstance(queryset, QuerySet) or queryset.query.where or queryset.query.distinct or queryset.query.is_sliced:
+        return None
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)"
+    elif connection.vendor == "mysql":
+        sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+
+    # PostgreSQL reports -1 for tables that were never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+
+    return int(row[0])
@@ -0,0 +1,150 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from bs4 import BeautifulSoup
+
+from .encoding import detect_encoding
+
+import hashlib
+
+
+# Feed parsing is kept free of Django imports so it can run in the worker
+# processes of the poller's parse pool. Everything here takes and returns
+# plain picklable values.
+
+
+class FeedObj():
+    """Database Feed Object
+
+    Args:
+        None
+
+    Elements:
+        elements (Dict): Dictionary of feed element names and values.
+        items (Dict): Dictionary of item dictionaries.
+    """
+    def __init__(self):
+        self.elements = {}
+        self.items = {}
+
+
+def parse_feed(content: bytes, content_type: str = None) -> FeedObj:
+    """Parse a raw RSS document.
+
+    Args:
+        content (bytes): Raw response body.
+        content_type (str): HTTP Content-Type header of the response, if any.
+
+    Returns:
+        FeedObj: Feed object containing all items and elements, or None if the document is not an RSS feed.
+    """
+    # Hand the parser the raw bytes with a known encoding so it does not sniff
+    encoding = detect_encoding(content, content_type)
+    soup = BeautifulSoup(content, features='xml', from_encoding=encoding)
+
+    rss_feed = soup.find("rss")
+
+    if rss_feed is None:
+        return None
+
+    feed = FeedObj()
+
+    feed.elements = __parse_feed_elements_xml(rss_feed)
+    feed.items = __parse_feed_items_xml(rss_feed)
+
+    return feed
+
+
+def __parse_feed_elements_xml(xml):
+    
+    elements = {}
+    optional_elems = [
+                    "title",
+                    "link",
+                    "description",
+                    "author",
+                    "creator",
+                    "categories",
+                    "comments",
+                    "enclosure",
+                    "guid",
+                    "pubDate",
+                    "source",
+                    "extensions"
+                    ]
+
+    for element in optional_elems:
+        r = xml.find(element)
+
+        if r == None:
+            pass
+
+        else:
+            try:
+                elements[element] = str(r.contents[0])
+            except:
+                pass
+    
+    return elements
+
+
+def __parse_feed_items_xml(xml):
+    final_items = {}
+    elements = {}
+    optional_elems = [
+                    "title",
+                    "link",
+                    "description",
+                    "author",
+                    "creator",
+                    "categories",
+                    "comments",
+                    "enclosure",
+                    "guid",
+                    "pubDate",
+                    "source",
+                    "extensions"
+                ]
+    fingerprint = ""
+
+    items = xml.findAll("item")
+
+    for item in items:
+        for element in optional_elems:
+            result = item.find(element)
+
+            if result == None:
+                pass
+
+            else:
+                # TODO: Make sure that if there is an already existing fingerprint that the newest one overrides the oldest.
+                if element == "title":
+                    fingerprint = __get_title_fingerprint(str(result.contents[0]))
+                    final_items[fingerprint] = {}
+
+                try:
+                    final_items[fingerprint][element] = str(result.contents[0])
+
+                except:
+                    pass
+
+    return final_items
+
+
+def __get_title_fingerprint(data: str) -> str:
+    encoded_data = data.encode("utf-8")
+    
+    return str(hashlib.md5(encoded_data).hexdigest())
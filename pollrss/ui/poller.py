@@ -0,0 +1,122 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from django.db.models import Q
+
+import requests
+
+from . import extract, pollstats, rss, snapshots, tracing
+from .models import Feed
+
+
+def group_feeds_by_source(feeds) -> dict:
+    """Group feeds that read the same canonical source.
+
+    Args:
+        feeds (Iterable[Feed]): Database feeds with an rss_link or page_url.
+
+    Returns:
+        dict: Lists of feeds keyed by (source kind, canonical link).
+    """
+    groups = {}
+
+    for db_feed in feeds:
+        if db_feed.page_url:
+            key = ("page", db_feed.canonical_link or db_feed.page_url)
+        else:
+            key = ("rss", db_feed.canonical_link or db_feed.rss_link)
+
+        groups.setdefault(key, []).append(db_feed)
+
+    return groups
+
+
+def get_pollable_feeds():
+    """Get every RSS and scraped feed, with only the fields polling needs.
+
+    Returns:
+        QuerySet: Feeds to poll.
+    """
+    return Feed.objects.filter(~Q(rss_link='') | ~Q(page_url='')).only(
+            'id', 'rss_link', 'canonical_link', 'page_url', 'page_hash')
+
+
+def poll_feeds(feeds=None, rollup: bool = True) -> dict:
+    """Run one poll cycle, downloading each canonical source once.
+
+    The feed read from an RSS source is merged into every feed subscribed
+    to it. A scraped page is downloaded once and extracted for every feed
+    built on it whose last extraction saw different content. Each poll is
+    added to the poll log and the stats of the polled feeds rolled up.
+
+    Args:
+        feeds (Iterable[Feed]): Feeds to poll. Defaults to every RSS and scraped feed.
+        rollup (bool): Roll up the stats of the polled feeds. Callers polling a
+            few sources at a time leave it to the end of their cycle instead.
+
+    Returns:
+        dict: Number of sources fetched, sources failed and new items.
+    """
+    if feeds is None:
+        feeds = get_pollable_feeds()
+
+    stats = {"sources": 0, "failed": 0, "new_items": 0}
+
+    groups = group_feeds_by_source(feeds)
+
+    for (kind, source), group in groups.items():
+        stats["sources"] += 1
+
+        with tracing.span("poll", kind=kind, source=source, feeds=len(group)) as span:
+            if kind == "page":
+                new_items = __poll_page(group)
+            else:
+                new_items = __poll_rss(group)
+
+            span.set(new_items=new_items if new_items is not None else -1)
+
+        if new_items is None:
+            stats["failed"] += 1
+        else:
+            stats["new_items"] += new_items
+
+    if rollup:
+        pollstats.rollup_stats(db_feed.pk for group in groups.values() for db_feed in group)
+
+    return stats
+
+
+def __poll_rss(group: list) -> int:
+    with pollstats.recording(group) as record:
+        feed = rss.read_feed_from_link(group[0].rss_link)
+
+        if not isinstance(feed, rss.FeedObj):
+            record.fail()
+            return None
+
+        return sum(record.write(db_feed, rss.update_feed_in_database, db_feed.pk, feed) for db_feed in group)
+
+
+def __poll_page(group: list) -> int:
+    # Extraction is timed as part of each feed's write
+    with pollstats.recording(group) as record:
+        try:
+            digest = snapshots.download_snapshot(group[0].page_url)
+        except requests.RequestException:
+            record.fail()
+            return None
+
+        return sum(record.write(db_feed, extract.refresh_scraped_feed, db_feed, digest) for db_feed in group)
@@ -0,0 +1,277 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import contextvars
+import datetime
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import FeedStats, PollLog
+
+
+# Every poll of a feed appends a PollLog row. The fetch code does not know
+# which feeds it is polling for, so it reports what it saw with note() to
+# the PollRecord of the poll in progress, if any. Rows older than
+# POLL_LOG_RETENTION are pruned and the rest rolled up into FeedStats by
+# the database, so the log is never loaded into Python.
+
+_current = contextvars.ContextVar("pollrss_poll_record", default=None)
+
+# Feeds rolled up per set of queries, within SQLite's parameter limit
+ROLLUP_BATCH_SIZE = 500
+
+ROLLUP_FIELDS = ('polls', 'failures', 'changes', 'change_rate', 'bytes_p50', 'fetch_ms_p50', 'fetch_ms_p95',
+                 'total_ms_p50', 'total_ms_p95', 'last_polled', 'last_changed', 'updated')
+
+
+class PollRecord():
+    """Measurements of one poll of a feed source.
+
+    Fetch and parse numbers are shared by every feed of the source; write
+    time and new items are kept per feed.
+
+    Args:
+        feeds (Iterable[Feed]): Feeds that read the source.
+    """
+    def __init__(self, feeds):
+        self.feeds = list(feeds)
+        self.status = PollLog.OK
+        self.http_status = None
+        self.bytes = 0
+        self.fetch_ms = 0
+        self.parse_ms = 0
+        self.writes = {}
+
+    def write(self, db_feed, func, *args) -> int:
+        """Time the write of one feed.
+
+        Args:
+            db_feed (Feed): Feed being written.
+            func (Callable): Function that writes it, returning the number of new items.
+            *args: Arguments for func.
+
+        Returns:
+            int: Number of new items.
+        """
+        start = time.perf_counter()
+        new_items = func(*args)
+        self.writes[db_feed.pk] = (milliseconds(time.perf_counter() - start), new_items)
+
+        return new_items
+
+    def fail(self):
+        """Mark the poll as failed."""
+        self.status = PollLog.FAILED
+
+
+def note(**values):
+    """Report fetch measurements to the poll in progress.
+
+    Does nothing outside of a poll.
+
+    Args:
+        **values: PollRecord attributes, such as http_status, bytes, fetch_ms or parse_ms.
+    """
+    record = _current.get()
+
+    if record is not None:
+        for name, value in values.items():
+            setattr(record, name, value)
+
+
+@contextmanager
+def tracking(record: PollRecord):
+    """Send note() calls made in a with block to a record."""
+    token = _current.set(record)
+
+    try:
+        yield record
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def recording(feeds):
+    """Record a poll of a feed source made in a with block.
+
+    The log rows are saved when the block exits. An exception marks the poll
+    as failed.
+
+    Args:
+        feeds (Iterable[Feed]): Feeds that read the source.
+    """
+    record = PollRecord(feeds)
+
+    with tracking(record):
+        try:
+            yield record
+        except BaseException:
+            record.fail()
+            raise
+        finally:
+            save_poll(record)
+
+
+def save_poll(record: PollRecord):
+    """Append the log rows of a finished poll.
+
+    Args:
+        record (PollRecord): Finished poll.
+    """
+    logs = []
+    for db_feed in record.feeds:
+        write_ms, new_items = record.writes.get(db_feed.pk, (0, 0))
+        logs.append(PollLog(feed_id=db_feed.pk, status=record.status, http_status=record.http_status,
+                            bytes=record.bytes, fetch_ms=record.fetch_ms, parse_ms=record.parse_ms,
+                            write_ms=write_ms, new_items=new_items))
+
+    PollLog.objects.bulk_create(logs)
+
+
+def prune_poll_logs() -> int:
+    """Delete poll log rows older than POLL_LOG_RETENTION.
+
+    Returns:
+        int: Number of rows deleted.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.POLL_LOG_RETENTION)
+
+    return PollLog.objects.filter(created__lt=cutoff).delete()[0]
+
+
+def rollup_stats(feed_ids=None) -> int:
+    """Prune the poll log and recompute feed stats from what is left.
+
+    Pollers call this once per cycle with the feeds they polled. Rollups
+    running at the same time may overlap; the last one to write wins.
+
+    Args:
+        feed_ids (Iterable[int]): Feeds to recompute, such as those polled in a cycle. Defaults to every feed.
+
+    Returns:
+        int: Number of feeds with recomputed stats.
+    """
+    prune_poll_logs()
+
+    if feed_ids is None:
+        return __rollup(PollLog.objects.order_by(), FeedStats.objects.all())
+
+    feed_ids = sorted(set(feed_ids))
+    rolled_up = 0
+
+    for start in range(0, len(feed_ids), ROLLUP_BATCH_SIZE):
+        batch = feed_ids[start:start + ROLLUP_BATCH_SIZE]
+        rolled_up += __rollup(PollLog.objects.filter(feed_id__in=batch).order_by(),
+                              FeedStats.objects.filter(feed_id__in=batch))
+
+    return rolled_up
+
+
+def milliseconds(seconds: float) -> int:
+    """Convert seconds to whole milliseconds, as stored in the poll log."""
+    return int(round(seconds * 1000))
+
+
+def __rollup(logs, stats) -> int:
+    changed = Q(status=PollLog.OK, new_items__gt=0)
+    summaries = logs.values('feed_id').annotate(
+                    polls=Count('pk'),
+                    failures=Count('pk', filter=Q(status=PollLog.FAILED)),
+                    ok=Count('pk', filter=Q(status=PollLog.OK)),
+                    changes=Count('pk', filter=changed),
+                    last_polled=Max('created'),
+                    last_changed=Max('created', filter=changed))
+
+    ok = logs.filter(status=PollLog.OK)
+    bytes_p50, = __percentiles(ok, F('bytes'), (50,))
+    fetch_ms_p50, fetch_ms_p95 = __percentiles(ok, F('fetch_ms'), (50, 95))
+    total_ms_p50, total_ms_p95 = __percentiles(ok, F('fetch_ms') + F('parse_ms') + F('write_ms'), (50, 95))
+
+    updated = timezone.now()
+    rows = [FeedStats(
+                feed_id=row['feed_id'],
+                polls=row['polls'],
+                failures=row['failures'],
+                changes=row['changes'],
+                change_rate=row['changes'] / row['ok'] if row['ok'] else 0.0,
+                bytes_p50=bytes_p50.get(row['feed_id'], 0),
+                fetch_ms_p50=fetch_ms_p50.get(row['feed_id'], 0),
+                fetch_ms_p95=fetch_ms_p95.get(row['feed_id'], 0),
+                total_ms_p50=total_ms_p50.get(row['feed_id'], 0),
+                total_ms_p95=total_ms_p95.get(row['feed_id'], 0),
+                last_polled=row['last_polled'],
+                last_changed=row['last_changed'],
+                updated=updated
+            ) for row in summaries]
+
+    # Another rollup may write the same feeds meanwhile, so rows are never
+    # inserted twice: missing ones are added and all of them updated
+    with transaction.atomic():
+        # Feeds whose logs were all pruned
+        stats.exclude(feed_id__in=logs.values('feed_id')).delete()
+        FeedStats.objects.bulk_create(rows, ignore_conflicts=True)
+        FeedStats.objects.bulk_update(rows, ROLLUP_FIELDS)
+
+    return len(rows)
+
+
+def __percentiles(logs, expression, percents: tuple) -> list:
+    """Get nearest rank percentiles of an expression for each feed.
+
+    Each feed's rows are numbered in order of the expression and only the
+    rows at the wanted ranks are returned.
+
+    Args:
+        logs (QuerySet): Poll log rows.
+        expression (Expression): Value to rank.
+        percents (tuple): Percentiles to get, e.g. (50, 95).
+
+    Returns:
+        list: A dict of values by feed id for each percentile.
+    """
+    ranked = logs.annotate(
+                rank_value=expression,
+                rank_position=Window(RowNumber(), partition_by=[F('feed_id')], order_by=expression.asc()),
+                rank_total=Window(Count('pk'), partition_by=[F('feed_id')])
+            ).values_list('feed_id', 'rank_value', 'rank_position', 'rank_total')
+
+    connection = connections[ranked.db]
+    sql, params = ranked.query.sql_with_params()
+    feed_id, value, position, total = (connection.ops.quote_name(name)
+                                       for name in ('feed_id', 'rank_value', 'rank_position', 'rank_total'))
+
+    # The first row at or past percent of the feed's rows
+    at_rank = "(%s * 100 >= %s * %%s AND (%s - 1) * 100 < %s * %%s)" % (position, total, position, total)
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT %s, %s, %s, %s FROM (" % (feed_id, value, position, total) + sql + ") ranked WHERE " +
+                       " OR ".join([at_rank] * len(percents)),
+                       tuple(params) + tuple(percent for percent in percents for _ in range(2)))
+        rows = cursor.fetchall()
+
+    results = [{} for _ in percents]
+    for row_feed_id, row_value, row_position, row_total in rows:
+        for result, percent in zip(results, percents):
+            if row_position * 100 >= row_total * percent and (row_position - 1) * 100 < row_total * percent:
+                result[row_feed_id] = row_value
+
+    return results
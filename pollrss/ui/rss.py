@@ -15,32 +15,38 @@
 '''
 
 import datetime
+import logging
+import time
 from email.utils import parsedate_to_datetime
 
+from . import metrics, pollstats, tracing
 from . import rfeed
+from . import serializer
+from .canonical import canonicalize_url
 from .models import Feed, FeedField, Item, ItemField
+from .parsing import FeedObj, parse_feed
+from .signals import feed_updated
+from .singleflight import SingleFlight, cache_lock
+from django.core.cache import cache
 from django.db import transaction
 
 import requests
-from bs4 import BeautifulSoup
 
 import hashlib
 
 
-class FeedObj():
-    """Database Feed Object
+# Seconds a fetched feed is shared with callers that were waiting on the fetch
+FETCH_RESULT_TTL = 10
 
-    Args:
-        None
+# Items deleted per transaction by delete_items
+DELETE_BATCH_SIZE = 1000
 
-    Elements:
-        elements (Dict): Dictionary of feed element names and values.
-        items (Dict): Dictionary of item dictionaries.
-    """
-    elements = {}
-    items = {}
+logger = logging.getLogger(__name__)
 
+__fetch_flight = SingleFlight()
 
+
+@tracing.traced()
 def create_rss_feed_from_object(feed_id: int) -> rfeed.Feed:
     """Create an RSS Feed from FeedObj.
 
@@ -50,6 +56,74 @@ def create_rss_feed_from_object(feed_id: int) -> rfeed.Feed:
     Returns:
         rfeed.Feed: Finalized rfeed Feed object.
     """
+    feed_obj = read_feed_from_database(feed_id)
+
+    rss_feed = __create_rss_channel(feed_obj.elements)
+
+    for item in feed_obj.items:
+        rss_feed.items.append(__convert_to_rss_item(feed_obj.items[item]))
+
+    return rss_feed
+
+
+@tracing.traced()
+def render_feed(feed_id: int) -> bytes:
+    """Render a database feed to RSS using the stored item fragments.
+
+    Items without a stored fragment are serialized once and saved, so
+    rendering only pays for items that are new since the last render.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+
+    Returns:
+        bytes: Encoded RSS document.
+    """
+    start = time.perf_counter()
+
+    db_feed = Feed.objects.get(pk=feed_id)
+
+    elements = {}
+    for feed_field in db_feed.feedfield_set.all():
+        elements[feed_field.name] = __process_element(feed_field.value, feed_field.name)
+
+    rss_feed = __create_rss_channel(elements)
+
+    items = list(db_feed.item_set.only("feed", "fragment"))
+    stale_items = [item for item in items if not item.fragment]
+
+    if stale_items:
+        # Join rather than list the stale ids, which can exceed the parameter limit
+        item_fields = {item.pk: {} for item in stale_items}
+        for item_id, name, value in ItemField.objects.filter(item__feed_id=feed_id, item__fragment="").values_list(
+                "item_id", "name", "value"):
+            item_fields.setdefault(item_id, {})[name] = value
+
+        for item in stale_items:
+            item.content_hash = __get_content_hash(item_fields[item.pk])
+            item.fragment = __render_item_fragment(item_fields[item.pk])
+
+        Item.objects.bulk_update(stale_items, ["content_hash", "fragment"])
+
+    output = [serializer.serialize_feed_head(rss_feed)]
+    output.extend(item.fragment for item in items)
+    output.append(serializer.FEED_TAIL)
+    body = "".join(output).encode("utf-8")
+
+    metrics.RENDER_SECONDS.observe(time.perf_counter() - start)
+
+    return body
+
+
+def __create_rss_channel(feed_elements: dict) -> rfeed.Feed:
+    """Create an rfeed Feed without items from processed feed elements.
+
+    Args:
+        feed_elements (dict): Dictionary of processed feed elements.
+
+    Returns:
+        rfeed.Feed: rfeed Feed object with an empty item list.
+    """
     elements = {
                 "language": None,
                 "copyright": None,
@@ -70,12 +144,10 @@ def create_rss_feed_from_object(feed_id: int) -> rfeed.Feed:
                 "extensions": []
             }
 
-    feed_obj = read_feed_from_database(feed_id)
-
     rss_feed = rfeed.Feed(
-            title=feed_obj.elements["title"],
-            link=feed_obj.elements["link"],
-            description=feed_obj.elements["description"]
+            title=feed_elements["title"],
+            link=feed_elements["link"],
+            description=feed_elements["description"]
         )
 
     rss_feed.language = elements["language"]
@@ -96,9 +168,6 @@ def create_rss_feed_from_object(feed_id: int) -> rfeed.Feed:
     rss_feed.skipDays = elements["skipDays"]
     rss_feed.extensions = elements["extensions"]
 
-    for item in feed_obj.items:
-        rss_feed.items.append(__convert_to_rss_item(feed_obj.items[item]))
-
     return rss_feed
 
 
@@ -218,202 +287,336 @@ def read_feed_from_database(feed_id: int) -> FeedObj:
         rss_feed.elements[feed_field.name] = __process_element(feed_field.value, feed_field.name)
 
     # Read all feed items
-    for item in db_feed.item_set.all():
-        rss_feed.items[item.fingerprint] = {}
+    items = list(db_feed.item_set.only("feed", "fingerprint"))
+    item_fields = {item.pk: {} for item in items}
+
+    # Read all item elements in one query
+    for item_id, name, value in ItemField.objects.filter(item__feed_id=feed_id).values_list("item_id", "name", "value"):
+        # Items added since the item query are skipped
+        item_fields.setdefault(item_id, {})[name] = __process_element(value, name)
 
-        # Read all item elements
-        for item_field in item.itemfield_set.all():
-            rss_feed.items[item.fingerprint][item_field.name] = __process_element(item_field.value, item_field.name)
+    for item in items:
+        rss_feed.items[item.fingerprint] = item_fields[item.pk]
 
     return rss_feed
     
 
-#TODO: Need function that updates existing feeds in the database. Eg. check new feed against database fingerprints and only add new ones.
-
-
-def write_feed_to_database(feed: FeedObj, rss_link: str) -> int:
+@tracing.traced()
+def write_feed_to_database(feed: FeedObj, rss_link: str, canonical_link: str = None) -> int:
     """Write a feed object to the database and return the Feed ID.
 
     Args:
         feed (FeedObj): Feed object to be written.
         rss_link (str): Source RSS feed link.
+        canonical_link (str): Canonical form of rss_link. Derived from rss_link without following redirects if omitted.
 
     Returns:
         int: New database Feed ID. (0 = Not Created)
     """
+    if canonical_link is None:
+        canonical_link = canonicalize_url(rss_link)
 
     # Check for feed existence
-    if (__feed_exists(rss_link)):
-        print("Feed Already Exists!")
+    if (__feed_exists(canonical_link)):
+        logger.info("Feed %s already exists", canonical_link)
 
     else:
-        #TODO: If there is an Integrity Error Here, that means that a fingerprint is a duplicate. We need to check for duplicates!!!!
-
         # Start a bulk database transaction
-        with transaction.atomic():
+        with metrics.DB_WRITE_SECONDS.time(), transaction.atomic():
 
             # Create a new feed entry in database
             db_feed = Feed()
             db_feed.rss_link = rss_link
+            db_feed.canonical_link = canonical_link
             db_feed.save()
 
             # Add all feed elements to database
-            for feed_field_name in feed.elements:
-                feed_field = FeedField(feed=db_feed)
-                feed_field.name = feed_field_name
-                feed_field.value = feed.elements[feed_field_name]
-                feed_field.required = True
-                feed_field.save()
+            FeedField.objects.bulk_create([
+                    FeedField(feed=db_feed, name=feed_field_name, value=feed.elements[feed_field_name], required=True)
+                    for feed_field_name in feed.elements
+                ])
 
             # Create new item entries in database
-            for item_name in feed.items:
-                item = Item(feed=db_feed)
-                item.fingerprint = item_name
-                item.save()
-
-                # Add all item elements to database
-                for item_field_name in feed.items[item_name]:
-                    item_field = ItemField(item=item)
-                    item_field.name = item_field_name
-                    item_field.value = feed.items[item_name][item_field_name]
-                    item_field.save()
+            __write_items(db_feed, feed.items)
+
+            feed_id = db_feed.pk
+            transaction.on_commit(lambda: feed_updated.send(sender=Feed, feed_id=feed_id))
 
         return db_feed.pk
     
     return 0
 
 
-def __feed_exists(link: str) -> bool:
+@tracing.traced()
+def update_feed_in_database(feed_id: int, feed: FeedObj) -> int:
+    """Merge a freshly read feed object into an existing database feed.
+
+    Feed elements are overwritten, items with new fingerprints are added and
+    items whose content changed are rewritten.
+
+    Args:
+        feed_id (int): Unique database feed identifier.
+        feed (FeedObj): Feed object read from the feed source.
+
+    Returns:
+        int: Number of new items.
+    """
+    with metrics.DB_WRITE_SECONDS.time(), transaction.atomic():
+        db_feed = Feed.objects.select_for_update().get(pk=feed_id)
+
+        changed = False
+
+        # Update feed elements
+        feed_fields = {feed_field.name: feed_field for feed_field in db_feed.feedfield_set.all()}
+        for feed_field_name in feed.elements:
+            feed_field = feed_fields.get(feed_field_name)
+
+            if feed_field is None:
+                feed_field = FeedField(feed=db_feed, name=feed_field_name, required=True)
+            elif feed_field.value == feed.elements[feed_field_name]:
+                continue
+
+            feed_field.value = feed.elements[feed_field_name]
+            feed_field.save()
+            changed = True
+
+        # Find new and changed items
+        content_hashes = dict(db_feed.item_set.values_list("fingerprint", "content_hash"))
+
+        new_items = {}
+        changed_items = {}
+        for item_name in feed.items:
+            if item_name not in content_hashes:
+                new_items[item_name] = feed.items[item_name]
+            elif content_hashes[item_name] != __get_content_hash(feed.items[item_name]):
+                changed_items[item_name] = feed.items[item_name]
+
+        if changed_items:
+            db_feed.item_set.filter(fingerprint__in=changed_items).delete()
+
+        __write_items(db_feed, {**changed_items, **new_items})
+
+        if changed or new_items or changed_items:
+            db_feed.save(update_fields=["updated"])
+            transaction.on_commit(lambda: feed_updated.send(sender=Feed, feed_id=feed_id))
+
+    return len(new_items)
+
+
+def delete_items(item_ids, batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """Delete items and their fields, a batch per transaction.
+
+    The feeds the items belonged to are marked as updated, so their cached
+    bodies are rendered again.
+
+    Args:
+        item_ids (Iterable[int]): Ids of the items to delete. May be a lazy iterator.
+        batch_size (int): Items deleted per transaction.
+
+    Returns:
+        int: Number of items deleted.
+    """
+    deleted = 0
+    batch = []
+
+    for item_id in item_ids:
+        batch.append(item_id)
+
+        if len(batch) >= batch_size:
+            deleted += __delete_item_batch(batch)
+            batch = []
+
+    if batch:
+        deleted += __delete_item_batch(batch)
+
+    return deleted
+
+
+def __delete_item_batch(item_ids: list) -> int:
+    with transaction.atomic():
+        feed_ids = set(Item.objects.filter(pk__in=item_ids).values_list("feed_id", flat=True))
+
+        # Item fields go in one DELETE with their items
+        _, counts = Item.objects.filter(pk__in=item_ids).delete()
+
+        for feed_id in feed_ids:
+            transaction.on_commit(lambda feed_id=feed_id: feed_updated.send(sender=Feed, feed_id=feed_id))
+
+    return counts.get(Item._meta.label, 0)
+
+
+def clear_fragments(item_ids, batch_size: int = DELETE_BATCH_SIZE):
+    """Drop the stored XML fragments of items, so they are rendered again.
+
+    Deleting item fields in bulk does not send signals, so whoever deletes
+    them calls this for their items.
+
+    Args:
+        item_ids (Iterable[int]): Ids of the items.
+        batch_size (int): Items cleared per query.
+    """
+    item_ids = list(item_ids)
+
+    with transaction.atomic():
+        for start in range(0, len(item_ids), batch_size):
+            items = Item.objects.filter(pk__in=item_ids[start:start + batch_size])
+            feed_ids = set(items.values_list("feed_id", flat=True))
+
+            items.exclude(fragment="").update(fragment="")
+
+            for feed_id in feed_ids:
+                transaction.on_commit(lambda feed_id=feed_id: feed_updated.send(sender=Feed, feed_id=feed_id))
+
+
+def __write_items(db_feed: Feed, items: dict):
+    """Create database items, their fields and rendered fragments.
+
+    Args:
+        db_feed (Feed): Database feed that owns the items.
+        items (dict): Dictionary of item dictionaries keyed by fingerprint.
+    """
+    db_items = []
+    for item_name in items:
+        item = Item(feed=db_feed)
+        item.fingerprint = item_name
+        item.content_hash = __get_content_hash(items[item_name])
+        try:
+            item.fragment = __render_item_fragment(items[item_name])
+        except (KeyError, TypeError, ValueError, rfeed.ElementRequiredError):
+            # Leave it to the first render to surface the error
+            item.fragment = ""
+        db_items.append(item)
+
+    Item.objects.bulk_create(db_items)
+
+    # SQLite does not return the ids of bulk inserted rows
+    if db_items and db_items[0].pk is None:
+        item_ids = dict(Item.objects.filter(feed=db_feed).values_list("fingerprint", "pk"))
+        for item in db_items:
+            item.pk = item_ids[item.fingerprint]
+
+    # Add all item elements to database
+    item_fields = []
+    for item in db_items:
+        for item_field_name in items[item.fingerprint]:
+            item_field = ItemField(item=item)
+            item_field.name = item_field_name
+            item_field.value = items[item.fingerprint][item_field_name]
+            item_fields.append(item_field)
+
+    ItemField.objects.bulk_create(item_fields)
+
+    metrics.ITEMS_INSERTED.inc(len(items))
+
+
+def __feed_exists(canonical_link: str) -> bool:
     """Check if feed exists in database.
 
     Args:
-        link (str): Feed source link.
+        canonical_link (str): Canonical feed source link.
 
     Returns:
         bool: Feed existance in database status.
     """
-    try:
-        feeds = Feed.objects.get(rss_link__exact=link)
-    except Feed.DoesNotExist:
-        return False
-
-    return True
+    return Feed.objects.filter(canonical_link=canonical_link, page_url='').exists()
 
     
 # TODO: Refactor read feed from link functions. Change fingerprint to GUID hash?
 
+@tracing.traced()
 def read_feed_from_link(link: str) -> FeedObj:
     """Create a FeedObj from a link.
 
+    Concurrent reads of the same link, in this process or in others sharing
+    the cache, are coalesced into a single fetch.
+
     Args:
         link (str): RSS feed source link.
 
     Returns:
         FeedObj: Feed object containing all items and elements.
     """
+    return __fetch_flight.do(link, __read_feed_from_link_once, link)
+
+
+def __read_feed_from_link_once(link: str) -> FeedObj:
+    """Fetch a link unless another process fetched it while we waited."""
+    result_key = "pollrss:fetch:" + hashlib.md5(link.encode("utf-8")).hexdigest()
+
+    with cache_lock("fetch:" + link):
+        feed = cache.get(result_key)
+
+        if feed is None:
+            feed = __fetch_feed_from_link(link)
+
+            if isinstance(feed, FeedObj):
+                cache.set(result_key, feed, FETCH_RESULT_TTL)
+
+        return feed
+
+
+def __fetch_feed_from_link(link: str) -> FeedObj:
+    start = time.perf_counter()
+
     try:
-        response = requests.get(link)
+        with tracing.span("rss.fetch", url=link) as span:
+            response = requests.get(link)
+            span.set(status=response.status_code, bytes=len(response.content))
 
     except Exception as e:
-        print("RSS Feed fetch FAILED!" + e)
+        logger.warning("Fetching RSS feed %s failed: %s", link, e)
         return 1
 
-    soup = BeautifulSoup(response.content, features='xml')
+    elapsed = time.perf_counter() - start
+    metrics.observe_fetch("rss", elapsed, response.status_code, len(response.content))
+    pollstats.note(http_status=response.status_code, bytes=len(response.content), fetch_ms=pollstats.milliseconds(elapsed))
 
-    rss_feed = soup.find("rss")
-    
-    if rss_feed == False:
-        print("RSS Feed not found!")
+    start = time.perf_counter()
+    with tracing.span("rss.parse") as span:
+        feed = parse_feed(response.content, response.headers.get("Content-Type"))
+        span.set(items=len(feed.items) if feed is not None else 0)
+    pollstats.note(parse_ms=pollstats.milliseconds(time.perf_counter() - start))
+
+    if feed is None:
+        logger.warning("No RSS feed found at %s", link)
         return 1
-    
-    else:
-        print("Feed Found")
 
-    feed = FeedObj()
+    if feed.items:
+        metrics.PARSE_SECONDS_PER_ITEM.observe((time.perf_counter() - start) / len(feed.items))
 
-    feed.elements = __parse_feed_elements_xml(rss_feed)
-    feed.items = __parse_feed_items_xml(rss_feed)
+    logger.debug("Read %d item(s) from %s", len(feed.items), link)
 
     return feed
-     
-        
-def __parse_feed_elements_xml(xml):
-    
-    elements = {}
-    optional_elems = [
-                    "title",
-                    "link",
-                    "description",
-                    "author",
-                    "creator",
-                    "categories",
-                    "comments",
-                    "enclosure",
-                    "guid",
-                    "pubDate",
-                    "source",
-                    "extensions"
-                    ]
-
-    for element in optional_elems:
-        r = xml.find(element)
-
-        if r == None:
-            pass
 
-        else:
-            try:
-                elements[element] = r.contents[0]
-            except:
-                pass
-    
-    return elements
 
+def __render_item_fragment(item_fields: dict) -> str:
+    """Serialize raw item field values into an <item> XML fragment.
 
-def __parse_feed_items_xml(xml):
-    final_items = {}
-    elements = {}
-    optional_elems = [
-                    "title",
-                    "link",
-                    "description",
-                    "author",
-                    "creator",
-                    "categories",
-                    "comments",
-                    "enclosure",
-                    "guid",
-                    "pubDate",
-                    "source",
-                    "extensions"
-                ]
-    fingerprint = ""
-
-    items = xml.findAll("item")
+    Args:
+        item_fields (dict): Dictionary of unprocessed item field values.
 
-    for item in items:
-        for element in optional_elems:
-            result = item.find(element)
+    Returns:
+        str: Item XML fragment.
+    """
+    item = {}
+    for name in item_fields:
+        item[name] = __process_element(item_fields[name], name)
+
+    return serializer.serialize_item(__convert_to_rss_item(item))
 
-            if result == None:
-                pass
 
-            else:
-                # TODO: Make sure that if there is an already existing fingerprint that the newest one overrides the oldest.
-                if element == "title":
-                    fingerprint = __get_title_fingerprint(result.contents[0])
-                    final_items[fingerprint] = {}
+def __get_content_hash(item_fields: dict) -> str:
+    """Hash the raw field values of an item.
 
-                try:
-                    final_items[fingerprint][element] = result.contents[0]
+    Args:
+        item_fields (dict): Dictionary of unprocessed item field values.
 
-                except:
-                    pass
+    Returns:
+        str: SHA-256 hex digest of the item content.
+    """
+    content = hashlib.sha256()
 
-    return final_items
-            
+    for name in sorted(item_fields):
+        content.update(name.encode("utf-8") + b"\0" + str(item_fields[name]).encode("utf-8") + b"\0")
 
-def __get_title_fingerprint(data: str) -> str:
-    encoded_data = data.encode("utf-8")
-    
-    return str(hashlib.md5(encoded_data).hexdigest())
+    return content.hexdigest()
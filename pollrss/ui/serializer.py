@@ -0,0 +1,242 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import re
+from io import StringIO
+from xml.sax import saxutils
+
+from . import rfeed
+
+
+# Output is byte-for-byte identical to rfeed.Feed.rss(), but skips the
+# XMLGenerator dispatch and only does the escaping work a value needs.
+
+PROLOG = '<?xml version="1.0" encoding="UTF-8"?>\n'
+FEED_TAIL = '</channel></rss>'
+
+_WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+_CDATA_BEGIN = "<![CDATA["
+_CDATA_END = "]]>"
+
+_ATTR_SPECIAL = re.compile("[&<>\"\n\r\t]")
+
+
+def serialize_feed(feed: rfeed.Feed) -> bytes:
+    """Serialize an rfeed Feed to UTF-8 encoded RSS.
+
+    Args:
+        feed (rfeed.Feed): Feed to serialize.
+
+    Returns:
+        bytes: Encoded RSS document, identical to feed.rss().
+    """
+    out = [serialize_feed_head(feed)]
+
+    if feed.items is not None:
+        for item in feed.items:
+            out.append(serialize_item(item))
+
+    out.append(FEED_TAIL)
+
+    return "".join(out).encode("utf-8")
+
+
+def serialize_feed_head(feed: rfeed.Feed) -> str:
+    """Serialize everything in a feed up to its first item.
+
+    Args:
+        feed (rfeed.Feed): Feed to serialize.
+
+    Returns:
+        str: XML prolog, <rss> and <channel> start tags and channel elements.
+    """
+    out = [PROLOG]
+    write = out.append
+
+    write("<rss")
+    for name, value in feed._get_attributes().items():
+        write(" %s=%s" % (name, _quoteattr(value)))
+    write("><channel>")
+
+    _write_element(write, "title", feed.title)
+    _write_element(write, "link", feed.link)
+    _write_element(write, "description", feed.description)
+    _write_element(write, "language", feed.language)
+    _write_element(write, "copyright", feed.copyright)
+    _write_element(write, "managingEditor", feed.managingEditor)
+    _write_element(write, "webMaster", feed.webMaster)
+    _write_element(write, "pubDate", _date(feed.pubDate))
+    _write_element(write, "lastBuildDate", _date(feed.lastBuildDate))
+    _write_element(write, "generator", feed.generator)
+    _write_element(write, "docs", feed.docs)
+    _write_element(write, "ttl", feed.ttl)
+    _write_element(write, "rating", feed.rating)
+
+    if feed.categories is not None:
+        for category in feed.categories:
+            _write_category(write, category)
+
+    for element in (feed.cloud, feed.image, feed.textInput, feed.skipHours, feed.skipDays):
+        if element is not None:
+            _write_serializable(write, element)
+
+    if feed.extensions is not None:
+        for extension in feed.extensions:
+            _write_serializable(write, extension)
+
+    return "".join(out)
+
+
+def serialize_item(item: rfeed.Item) -> str:
+    """Serialize a single rfeed Item.
+
+    Args:
+        item (rfeed.Item): Item to serialize.
+
+    Returns:
+        str: The <item>...</item> XML fragment.
+    """
+    if type(item) is not rfeed.Item:
+        return _publish(item)
+
+    out = ["<item>"]
+    write = out.append
+
+    _write_element(write, "title", item.title)
+    _write_element(write, "link", item.link)
+    _write_element(write, "description", item.description)
+    _write_element(write, "author", item.author)
+    _write_element(write, "dc:creator", item.creator)
+    _write_element(write, "comments", item.comments)
+    _write_element(write, "pubDate", _date(item.pubDate))
+
+    for category in item.categories:
+        _write_category(write, category)
+
+    if item.enclosure is not None:
+        _write_serializable(write, item.enclosure)
+
+    if item.guid is not None:
+        _write_serializable(write, item.guid)
+
+    if item.source is not None:
+        _write_serializable(write, item.source)
+
+    for extension in item.extensions:
+        _write_serializable(write, extension)
+
+    write("</item>")
+
+    return "".join(out)
+
+
+def _write_category(write, category):
+    if isinstance(category, str):
+        category = rfeed.Category(category)
+
+    _write_serializable(write, category)
+
+
+def _write_serializable(write, element):
+    """Write one of the simple rfeed elements, deferring anything else to its own publish()."""
+    element_type = type(element)
+
+    if element_type is rfeed.Guid:
+        _write_element(write, "guid", element.guid, {"isPermaLink": "true" if element.isPermaLink else "false"})
+    elif element_type is rfeed.Category:
+        _write_element(write, "category", element.category, {"domain": element.domain} if element.domain is not None else {})
+    elif element_type is rfeed.Enclosure:
+        _write_element(write, "enclosure", None, {"url": element.url, "length": str(element.length), "type": element.type})
+    elif element_type is rfeed.Source:
+        _write_element(write, "source", element.name, {"url": element.url})
+    else:
+        write(_publish(element))
+
+
+def _publish(element) -> str:
+    """Serialize an element through rfeed's own XMLGenerator based publish()."""
+    output = StringIO()
+    element.publish(saxutils.XMLGenerator(output, "UTF-8"))
+
+    return output.getvalue()
+
+
+def _write_element(write, name, value, attributes=None):
+    if value is None and not attributes:
+        return
+
+    if attributes:
+        write("<" + name)
+        for attr_name, attr_value in attributes.items():
+            write(" %s=%s" % (attr_name, _quoteattr(attr_value)))
+        write(">")
+    else:
+        write("<" + name + ">")
+
+    if value is not None:
+        str_value = value if isinstance(value, str) else str(value)
+
+        if _CDATA_BEGIN in str_value:
+            _write_cdata_text(write, str_value)
+        else:
+            write(_escape(str_value))
+
+    write("</" + name + ">")
+
+
+def _write_cdata_text(write, str_value):
+    """Escape text while passing complete CDATA sections through untouched."""
+    while str_value:
+        begin = str_value.find(_CDATA_BEGIN)
+        end = str_value.find(_CDATA_END, begin) if begin != -1 else -1
+
+        if end == -1:
+            write(_escape(str_value))
+            break
+
+        end += len(_CDATA_END)
+        write(_escape(str_value[:begin]))
+        write(str_value[begin:end])
+        str_value = str_value[end:]
+
+
+def _escape(data: str) -> str:
+    if "&" in data:
+        data = data.replace("&", "&amp;")
+    if ">" in data:
+        data = data.replace(">", "&gt;")
+    if "<" in data:
+        data = data.replace("<", "&lt;")
+
+    return data
+
+
+def _quoteattr(data: str) -> str:
+    if _ATTR_SPECIAL.search(data) is None:
+        return '"' + data + '"'
+
+    return saxutils.quoteattr(data)
+
+
+def _date(date) -> str:
+    """Format a datetime as an RFC 822 date, the same way rfeed does."""
+    if date is None:
+        return None
+
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (_WEEKDAYS[date.weekday()], date.day,
+        _MONTHS[date.month - 1], date.year, date.hour, date.minute, date.second)
@@ -0,0 +1,123 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import bisect
+import hashlib
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from . import poller
+
+
+# Feeds are split between poller nodes with a consistent hash ring. Each
+# node is placed on the ring many times (virtual nodes), and a feed source
+# belongs to the first node clockwise from the hash of its shard key. When
+# a node joins or leaves only the sources next to its points move.
+
+BY_FEED = "feed"
+BY_HOST = "host"
+
+
+class HashRing():
+    """Consistent hash ring of node names.
+
+    Args:
+        nodes (Iterable[str]): Node names.
+        replicas (int): Virtual nodes per node.
+    """
+    def __init__(self, nodes, replicas: int = 100):
+        self.nodes = sorted(set(nodes))
+        self.__points = sorted((_hash("%s#%d" % (node, i)), node) for node in self.nodes for i in range(replicas))
+        self.__hashes = [point for point, node in self.__points]
+
+    def get_node(self, key: str) -> str:
+        """Get the node that owns a key.
+
+        Args:
+            key (str): Shard key.
+
+        Returns:
+            str: Node name, or None if the ring is empty.
+        """
+        if not self.__points:
+            return None
+
+        index = bisect.bisect(self.__hashes, _hash(key)) % len(self.__points)
+
+        return self.__points[index][1]
+
+
+def get_shard_key(group: list, by: str = BY_HOST) -> str:
+    """Get the shard key of the feeds that share a source.
+
+    Keying whole source groups keeps a source on one node, so it is still
+    fetched once per cycle.
+
+    Args:
+        group (list): Feeds that read the same canonical source.
+        by (str): BY_HOST to keep every source of a host on one node, BY_FEED to spread sources by feed id.
+
+    Returns:
+        str: Shard key.
+    """
+    if by == BY_FEED:
+        return str(min(db_feed.pk for db_feed in group))
+
+    db_feed = group[0]
+    link = db_feed.canonical_link or db_feed.page_url or db_feed.rss_link
+
+    return (urlsplit(link).hostname or link).lower()
+
+
+def select_feeds(feeds, node_id: str = None, nodes=None, by: str = None) -> list:
+    """Keep the feeds whose source belongs to a node.
+
+    Arguments default to SHARD_NODE_ID, SHARD_NODES and SHARD_BY. With no
+    node id every feed is kept.
+
+    Args:
+        feeds (Iterable[Feed]): Candidate feeds.
+        node_id (str): This node's name.
+        nodes (Iterable[str]): Names of every node in the cluster.
+        by (str): Shard key, BY_HOST or BY_FEED.
+
+    Returns:
+        list: Feeds this node should poll.
+    """
+    node_id = node_id or settings.SHARD_NODE_ID
+    nodes = nodes or settings.SHARD_NODES
+    by = by or settings.SHARD_BY
+
+    if not node_id:
+        return list(feeds)
+
+    if node_id not in nodes:
+        raise ValueError("Node %r is not in the cluster %r" % (node_id, list(nodes)))
+
+    ring = HashRing(nodes, settings.SHARD_REPLICAS)
+
+    selected = []
+    for group in poller.group_feeds_by_source(feeds).values():
+        if ring.get_node(get_shard_key(group, by)) == node_id:
+            selected.extend(group)
+
+    return selected
+
+
+def _hash(key: str) -> int:
+    # Python's hash() is salted per process; nodes must agree
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
@@ -0,0 +1,35 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+
+from .models import Item, ItemField
+
+
+# Sent with a feed_id argument once a change to a feed's content is committed.
+feed_updated = Signal()
+
+
+@receiver(post_save, sender=ItemField)
+def clear_item_fragment(sender, instance, **kwargs):
+    """Drop the stored XML fragment of an item whose fields were edited."""
+    Item.objects.filter(pk=instance.item_id).exclude(fragment='').update(fragment='')
+
+    for feed_id in Item.objects.filter(pk=instance.item_id).values_list('feed_id', flat=True):
+        transaction.on_commit(lambda feed_id=feed_id: feed_updated.send(sender=Item, feed_id=feed_id))
+
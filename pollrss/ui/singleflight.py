@@ -0,0 +1,124 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+
+# Coalescing of duplicate work. SingleFlight shares one call between the
+# threads of a process, and cache_lock() serializes callers in different
+# processes through an atomic cache.add(), so it needs a cache backend that
+# is shared between workers (see CACHES in settings).
+
+LOCK_TIMEOUT = 60
+LOCK_POLL_INTERVAL = 0.05
+
+
+class SingleFlight():
+    """Per-process call coalescing.
+
+    Concurrent calls to do() with the same key run the function once; the
+    other callers wait for it and get the same result or exception.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """Run func(*args, **kwargs), or wait for a call already running for key.
+
+        Args:
+            key (Hashable): Identity of the computation.
+            func (Callable): Function to call.
+
+        Returns:
+            Any: Result of the shared call.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+
+        except BaseException as e:
+            call.error = e
+            raise
+
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+
+            call.done.set()
+
+        return call.result
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+@contextmanager
+def cache_lock(name: str, timeout: int = LOCK_TIMEOUT, wait: bool = True):
+    """Hold a lock shared by every process using the same cache.
+
+    The lock expires after timeout seconds so a crashed holder cannot block
+    others forever. Waiting gives up after the same timeout.
+
+    Args:
+        name (str): Lock name.
+        timeout (int): Lock lifetime and maximum wait in seconds.
+        wait (bool): Wait for the lock instead of returning immediately.
+
+    Yields:
+        bool: True if the lock was acquired.
+    """
+    key = "pollrss:lock:" + hashlib.md5(name.encode("utf-8")).hexdigest()
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout
+
+    acquired = cache.add(key, token, timeout)
+
+    while not acquired and wait and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        acquired = cache.add(key, token, timeout)
+
+    try:
+        yield acquired
+
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
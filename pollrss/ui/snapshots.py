@@ -0,0 +1,129 @@
+'''
+Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+import requests
+
+from . import metrics, pollstats, tracing
+from .encoding import detect_encoding, to_utf8
+from .singleflight import SingleFlight
+
+
+# Fetched pages are stored in the cache under the SHA-256 of their UTF-8
+# content, with a second entry mapping the page url to that digest. Both
+# expire after SNAPSHOT_TTL seconds.
+
+FETCH_TIMEOUT = 30
+
+__fetch_flight = SingleFlight()
+
+
+def fetch_snapshot(url: str) -> str:
+    """Get a snapshot of a page, downloading it only if none is cached.
+
+    Args:
+        url (str): Page url.
+
+    Returns:
+        str: Snapshot digest.
+    """
+    digest = find_snapshot(url)
+
+    if digest is None:
+        digest = __fetch_flight.do(url, download_snapshot, url)
+
+    return digest
+
+
+def find_snapshot(url: str) -> str:
+    """Look up the cached snapshot of a page.
+
+    Args:
+        url (str): Page url.
+
+    Returns:
+        str: Snapshot digest, or None if the page has no live snapshot.
+    """
+    digest = cache.get(__url_key(url))
+
+    if digest is not None and cache.get(__content_key(digest)) is not None:
+        return digest
+
+    return None
+
+
+def store_snapshot(url: str, content: bytes, content_type: str = None) -> str:
+    """Store page content as a snapshot.
+
+    Args:
+        url (str): Page url.
+        content (bytes): Raw page content.
+        content_type (str): HTTP Content-Type header of the page, if any.
+
+    Returns:
+        str: Snapshot digest.
+    """
+    html = to_utf8(content, detect_encoding(content, content_type))
+    digest = hashlib.sha256(html).hexdigest()
+
+    cache.set(__content_key(digest), html, settings.SNAPSHOT_TTL)
+    cache.set(__url_key(url), digest, settings.SNAPSHOT_TTL)
+
+    return digest
+
+
+def get_snapshot(digest: str) -> bytes:
+    """Get the UTF-8 encoded content of a snapshot.
+
+    Args:
+        digest (str): Snapshot digest.
+
+    Returns:
+        bytes: Page content, or None if the snapshot expired.
+    """
+    return cache.get(__content_key(digest))
+
+
+@tracing.traced()
+def download_snapshot(url: str) -> str:
+    """Download a page and store it as a snapshot, ignoring any cached one.
+
+    Args:
+        url (str): Page url.
+
+    Returns:
+        str: Snapshot digest.
+    """
+    start = time.perf_counter()
+    r = requests.get(url, timeout=FETCH_TIMEOUT)
+    elapsed = time.perf_counter() - start
+    metrics.observe_fetch("page", elapsed, r.status_code, len(r.content))
+    pollstats.note(http_status=r.status_code, bytes=len(r.content), fetch_ms=pollstats.milliseconds(elapsed))
+
+    return store_snapshot(url, r.content, r.headers.get("Content-Type"))
+
+
+def __url_key(url: str) -> str:
+    return "pollrss:snapshot-url:" + hashlib.md5(url.encode("utf-8")).hexdigest()
+
+
+def __content_key(digest: str) -> str:
+    return "pollrss:snapshot:" + digest
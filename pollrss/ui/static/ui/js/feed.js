@@ -0,0 +1,106 @@
+/*
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+*/
+
+// Load a feed from the feed endpoint (and the browser cache) and show it
+// indented. The server sends the feed as it is served to readers.
+
+var INDENT = "  ";
+var serializer = new XMLSerializer();
+
+function escapeAttribute(value) {
+    return value.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/"/g, "&quot;");
+}
+
+// Serialize a node and its children, one element per line
+function indentNode(node, depth, lines) {
+    var pad = INDENT.repeat(depth);
+
+    if (node.nodeType === Node.TEXT_NODE) {
+        if (node.nodeValue.trim()) {
+            lines.push(pad + serializer.serializeToString(node).trim());
+        }
+        return;
+    }
+
+    if (node.nodeType !== Node.ELEMENT_NODE) {
+        lines.push(pad + serializer.serializeToString(node));
+        return;
+    }
+
+    var open = "<" + node.nodeName;
+    for (var i = 0; i < node.attributes.length; i++) {
+        var attribute = node.attributes[i];
+        open += " " + attribute.name + "=\"" + escapeAttribute(attribute.value) + "\"";
+    }
+
+    var children = Array.prototype.filter.call(node.childNodes, function (child) {
+        return child.nodeType !== Node.TEXT_NODE || child.nodeValue.trim();
+    });
+
+    if (!children.length) {
+        lines.push(pad + open + "/>");
+        return;
+    }
+
+    // Keep text content on the line of its element
+    var inline = children.every(function (child) {
+        return child.nodeType === Node.TEXT_NODE || child.nodeType === Node.CDATA_SECTION_NODE;
+    });
+
+    if (inline) {
+        var text = children.map(function (child) { return serializer.serializeToString(child); }).join("");
+        lines.push(pad + open + ">" + text.trim() + "</" + node.nodeName + ">");
+        return;
+    }
+
+    lines.push(pad + open + ">");
+    children.forEach(function (child) { indentNode(child, depth + 1, lines); });
+    lines.push(pad + "</" + node.nodeName + ">");
+}
+
+function indentXml(text) {
+    var doc = new DOMParser().parseFromString(text, "text/xml");
+
+    // Show what was received if it is not well formed
+    if (doc.getElementsByTagName("parsererror").length) {
+        return text;
+    }
+
+    var lines = [];
+    Array.prototype.forEach.call(doc.childNodes, function (node) { indentNode(node, 0, lines); });
+
+    return lines.join("\n");
+}
+
+function loadFeed(element) {
+    fetch(element.dataset.feedUrl)
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status + " " + response.statusText);
+            }
+            return response.text();
+        })
+        .then(function (text) {
+            element.textContent = indentXml(text);
+        })
+        .catch(function (error) {
+            element.textContent = "Could not load feed: " + error.message;
+        });
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+    loadFeed(document.getElementById("feed-xml"));
+});
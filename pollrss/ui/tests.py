@@ -14,6 +14,1361 @@ Copyright 2020 Chase Kidder
    limitations under the License.
 '''
 
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import io
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.utils import timezone
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.test import AsyncClient, LiveServerTestCase, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+
+from . import async_views, bench, discovery, export, extract, feedcache, ingest, jobs, loadtest, metrics, pagination, poller, pollstats, rfeed, rss, serializer, sharding, singleflight, snapshots, tracing, views
+from .admin import LargeTableAdmin
+from .canonical import canonicalize_url
+from .encoding import detect_encoding, to_utf8
+from .models import Feed, FeedField, FeedStats, Item, ItemField, Job, PollLog, Selector
+from .signals import feed_updated
+
+
+class SerializerTests(SimpleTestCase):
+    """The fast-path serializer must match rfeed.Feed.rss() byte for byte."""
+
+    def assertSameAsRfeed(self, rss_feed):
+        self.assertEqual(serializer.serialize_feed(rss_feed), rss_feed.rss().encode("utf-8"))
+
+    def test_synthetic_feed(self):
+        self.assertSameAsRfeed(bench.make_rfeed(25))
+
+    def test_empty_feed(self):
+        self.assertSameAsRfeed(rfeed.Feed(title="", link="https://example.com", description=""))
+
+    def test_escaping_and_cdata(self):
+        rss_feed = rfeed.Feed(title="A & B <C>", link="https://example.com/?a=1&b=2", description="x > y", ttl=60)
+
+        for value in [
+                "plain",
+                "<![CDATA[<b>bold</b>]]> & after",
+                "before <![CDATA[one]]> mid & <![CDATA[two]]> end",
+                "unterminated <![CDATA[ & <tag>",
+                "]]> stray end",
+                "",
+            ]:
+            rss_feed.items.append(rfeed.Item(title=value, description=value))
+
+        self.assertSameAsRfeed(rss_feed)
+
+    def test_all_item_elements(self):
+        pub_date = datetime.datetime(2020, 2, 29, 23, 5, 9, tzinfo=datetime.timezone.utc)
+
+        item = rfeed.Item(
+                title="Title",
+                link="https://example.com/1",
+                description="Description",
+                author="author@example.com",
+                creator="Creator",
+                categories=["one", rfeed.Category("two", domain="it's \"quoted\"\n")],
+                comments="https://example.com/1#comments",
+                enclosure=rfeed.Enclosure("https://example.com/a.mp3", 1024, "audio/mpeg"),
+                guid=rfeed.Guid("1", isPermaLink=False),
+                pubDate=pub_date,
+                source=rfeed.Source("Source", "https://example.com/rss?x=1&y=2"),
+                extensions=[rfeed.iTunesItem(author="Someone", explicit="yes", order=1)]
+            )
+
+        rss_feed = rfeed.Feed(
+                title="Title",
+                link="https://example.com",
+                description="Description",
+                pubDate=pub_date,
+                lastBuildDate=pub_date,
+                categories="channel",
+                cloud=rfeed.Cloud("example.com", 80, "/rpc", "notify", "xml-rpc"),
+                image=rfeed.Image("https://example.com/i.png", "Image", "https://example.com", width=10),
+                textInput=rfeed.TextInput("Search", "Search it", "q", "https://example.com/s"),
+                skipHours=rfeed.SkipHours([1, 2]),
+                skipDays=rfeed.SkipDays(["Monday"]),
+                items=[item],
+                extensions=[rfeed.iTunes(author="Someone", owner=rfeed.iTunesOwner("Name", "a@b.c"), categories="Tech")]
+            )
+
+        self.assertSameAsRfeed(rss_feed)
+
+
+def make_feed_obj(items: int) -> rss.FeedObj:
+    """Build a FeedObj shaped like the output of rss.read_feed_from_link."""
+    feed_obj = rss.FeedObj()
+    feed_obj.elements = {"title": "Feed & Co", "link": "https://example.com/", "description": "<Description>"}
+
+    for i in range(items):
+        feed_obj.items["fingerprint-%d" % i] = {
+                "title": "Item %d" % i,
+                "link": "https://example.com/%d" % i,
+                "description": "<![CDATA[<p>%d</p>]]>" % i,
+                "guid": "guid-%d" % i,
+                "pubDate": "Sat, 24 Oct 2020 15:50:00 GMT"
+            }
+
+    return feed_obj
+
+
+class RenderFeedTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(5), "https://example.com/rss")
+
+    def test_render_matches_rfeed(self):
+        expected = rss.create_rss_feed_from_object(self.feed_id).rss().encode("utf-8")
+
+        self.assertEqual(rss.render_feed(self.feed_id), expected)
+
+    def test_fragments_stored_at_ingest(self):
+        self.assertFalse(Item.objects.filter(feed_id=self.feed_id, fragment="").exists())
+
+    def test_render_does_not_query_per_item(self):
+        # Feed, feed fields and items
+        with self.assertNumQueries(3):
+            rss.render_feed(self.feed_id)
+
+    def test_edited_item_is_rerendered(self):
+        item_field = ItemField.objects.filter(item__feed_id=self.feed_id, name="title").first()
+        item_field.value = "Edited"
+        item_field.save()
+
+        self.assertEqual(Item.objects.get(pk=item_field.item_id).fragment, "")
+        self.assertIn(b"<title>Edited</title>", rss.render_feed(self.feed_id))
+        self.assertFalse(Item.objects.filter(feed_id=self.feed_id, fragment="").exists())
+
+
+class DeletedFieldTests(TransactionTestCase):
+    """Item fields deleted in the admin clear their items' fragments."""
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(3), "https://example.com/rss")
+        self.model_admin = admin.site._registry[ItemField]
+        self.request = RequestFactory().post("/")
+        self.updated = []
+
+        def record(sender, feed_id, **kwargs):
+            self.updated.append(feed_id)
+
+        feed_updated.connect(record)
+        self.addCleanup(feed_updated.disconnect, record)
+
+    def test_deleted_field_clears_fragment(self):
+        item_field = ItemField.objects.filter(item__feed_id=self.feed_id, name="guid").first()
+        self.model_admin.delete_model(self.request, item_field)
+
+        self.assertEqual(Item.objects.get(pk=item_field.item_id).fragment, "")
+        self.assertEqual(self.updated, [self.feed_id])
+        self.assertNotIn(item_field.value.encode(), rss.render_feed(self.feed_id))
+
+    def test_deleted_fields_clear_fragments(self):
+        fields = ItemField.objects.filter(item__feed_id=self.feed_id, name="guid")
+        self.model_admin.delete_queryset(self.request, fields)
+
+        self.assertFalse(Item.objects.filter(feed_id=self.feed_id).exclude(fragment="").exists())
+        self.assertEqual(self.updated, [self.feed_id])
+
+    def test_deleting_items_does_not_query_per_field(self):
+        counts = []
+        for size in (1, 10):
+            feed_id = rss.write_feed_to_database(make_feed_obj(size), "https://example.com/rss/%d" % size)
+
+            with CaptureQueriesContext(connection) as queries:
+                rss.delete_items(Item.objects.filter(feed_id=feed_id).values_list("id", flat=True))
+
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(3), "https://example.com/rss")
+        self.request = RequestFactory().get("/")
+
+    def test_feed_matches_sync_view(self):
+        response = async_to_sync(async_views.feed)(self.request, self.feed_id)
+
+        self.assertEqual(response.content, views.feed(self.request, self.feed_id).content)
+
+    def test_viewfeed_sets_csrf_cookie(self):
+        response = async_to_sync(async_views.viewfeed)(self.request, self.feed_id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.request.META.get("CSRF_COOKIE_USED"))
+
+    def test_viewfeed_loads_feed_from_endpoint(self):
+        response = views.viewfeed(self.request, self.feed_id)
+
+        self.assertContains(response, 'data-feed-url="/feed/%d.rss"' % self.feed_id)
+        self.assertContains(response, "Feed &amp; Co")
+        self.assertNotContains(response, "Item 0")
+
+    def test_viewfeed_missing_feed(self):
+        with self.assertRaises(Http404):
+            async_to_sync(async_views.viewfeed)(self.request, self.feed_id + 1)
+
+    def test_feed_missing_feed(self):
+        with self.assertRaises(Http404):
+            views.feed(self.request, self.feed_id + 1)
+
+        with self.assertRaises(Http404):
+            async_to_sync(async_views.feed)(self.request, self.feed_id + 1)
+
+
+# The async views, for tests that run them whatever ASYNC_VIEWS is
+urlpatterns = [
+                path("create/", async_views.create, name="create"),
+                path("snapshot/<str:digest>/", views.snapshot, name="snapshot"),
+                path("feed/<int:feed_id>.rss", async_views.feed, name="feed"),
+              ]
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage", ROOT_URLCONF=__name__)
+class AsyncMiddlewareTests(TestCase):
+
+    def test_async_views_run_concurrently(self):
+        async def slow_fetch(url):
+            await asyncio.sleep(1)
+            return b"<html><body><p>Page</p></body></html>", "text/html; charset=utf-8"
+
+        async def create_feeds():
+            client = AsyncClient()
+            return await asyncio.gather(*(client.get("/create/?url=https%%3A//example.com/%d" % i) for i in range(4)))
+
+        with mock.patch.object(async_views, "fetch_page", slow_fetch):
+            start = time.monotonic()
+            responses = async_to_sync(create_feeds)()
+            elapsed = time.monotonic() - start
+
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.assertLess(elapsed, 2)
+
+    def test_async_view_queries_are_counted(self):
+        feed_id = rss.write_feed_to_database(make_feed_obj(2), "https://example.com/rss")
+        cache.clear()
+        queries_before = metrics.REQUEST_QUERIES.values.get(("feed",), (None, 0, 0))[1]
+
+        response = async_to_sync(AsyncClient().get)("/feed/%d.rss" % feed_id)
+
+        self.assertEqual(response.status_code, 200)
+        # Made in a sync_to_async thread, not the one running the middleware
+        self.assertGreater(metrics.REQUEST_QUERIES.values[("feed",)][1], queries_before)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage", FEED_LIST_PAGE_SIZE=2)
+class FeedListTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.feed_ids = [rss.write_feed_to_database(make_feed_obj(i + 1), "https://example.com/rss/%d" % i) for i in range(3)]
+
+    def test_pages_show_titles_and_counts(self):
+        response = self.client.get("/feeds/")
+
+        feeds = list(response.context["feed_list"])
+        self.assertEqual(len(feeds), 2)
+        self.assertTrue(response.context["is_paginated"])
+        # Most recently updated first
+        self.assertEqual([(feed.title, feed.item_count) for feed in feeds], [("Feed & Co", 3), ("Feed & Co", 2)])
+        self.assertIsNotNone(feeds[0].last_item)
+
+        response = self.client.get("/feeds/?page=2")
+        self.assertEqual([feed.pk for feed in response.context["feed_list"]], self.feed_ids[:1])
+
+    def test_pages_are_cached_until_a_feed_changes(self):
+        first = self.client.get("/feeds/").content
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/feeds/").content, first)
+
+        feedcache.expire_feed_list_on_update(sender=Feed, feed_id=self.feed_ids[0])
+
+        with self.assertNumQueries(2):
+            self.client.get("/feeds/")
+
+
+@override_settings(FEED_CACHE_TTL=60, FEED_MAX_STALENESS=3600)
+class FeedCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(3), "https://example.com/rss")
+        self.body = feedcache.refresh_feed(self.feed_id)
+
+        # Run revalidation inline instead of in a thread
+        patcher = mock.patch.object(feedcache, "__start_revalidation", feedcache.revalidate_feed)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def age_entry(self, seconds):
+        key = "pollrss:feed:%d" % self.feed_id
+        entry = cache.get(key)
+        entry["rendered"] -= seconds
+        cache.set(key, entry)
+
+    def test_fresh_body_served_from_cache(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(feedcache.get_feed_body(self.feed_id), (self.body, None))
+
+    def test_stale_body_served_with_warning(self):
+        self.age_entry(120)
+
+        self.assertEqual(feedcache.get_feed_body(self.feed_id), (self.body, feedcache.STALE_WARNING))
+        self.assertEqual(feedcache.get_feed_body(self.feed_id), (self.body, None))
+
+    def test_failed_render_serves_last_good_body(self):
+        self.age_entry(120)
+
+        with mock.patch.object(rss, "render_feed", side_effect=rfeed.ElementRequiredError("title")):
+            feedcache.get_feed_body(self.feed_id)
+            body, warning = feedcache.get_feed_body(self.feed_id)
+
+        self.assertEqual(body, self.body)
+        self.assertEqual(warning, feedcache.REVALIDATION_FAILED_WARNING)
+
+    def test_body_past_max_staleness_is_not_served(self):
+        self.age_entry(60 + 3600)
+
+        with mock.patch.object(rss, "render_feed", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                feedcache.get_feed_body(self.feed_id)
+
+    def test_view_sets_warning_header(self):
+        self.age_entry(120)
+
+        response = views.feed(RequestFactory().get("/"), self.feed_id)
+
+        self.assertEqual(response["Warning"], feedcache.STALE_WARNING)
+
+    def test_conditional_get(self):
+        url = "/feed/%d.rss" % self.feed_id
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = singleflight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("key", compute))) for _ in range(5)]
+
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+
+        # Give the followers time to queue up behind the leader
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 5)
+
+    def test_errors_are_shared_and_not_cached(self):
+        flight = singleflight.SingleFlight()
+
+        with self.assertRaises(ValueError):
+            flight.do("key", mock.Mock(side_effect=ValueError))
+
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+
+    def test_cache_lock_is_exclusive(self):
+        cache.clear()
+
+        with singleflight.cache_lock("name") as first:
+            with singleflight.cache_lock("name", wait=False) as second:
+                self.assertTrue(first)
+                self.assertFalse(second)
+
+        with singleflight.cache_lock("name", wait=False) as third:
+            self.assertTrue(third)
+
+
+class CanonicalUrlTests(SimpleTestCase):
+
+    def test_equivalent_urls_share_a_canonical_form(self):
+        for url in [
+                "http://example.com/feed",
+                "https://EXAMPLE.com/feed/",
+                "https://example.com:443/feed?utm_source=x&utm_medium=y",
+                "https://example.com/feed#top",
+                "http://example.com:80/feed?fbclid=abc",
+            ]:
+            self.assertEqual(canonicalize_url(url), "https://example.com/feed", url)
+
+    def test_query_is_sorted_and_kept(self):
+        self.assertEqual(canonicalize_url("https://example.com/?b=2&a=1"), "https://example.com/?a=1&b=2")
+
+    def test_non_default_port_is_kept(self):
+        self.assertEqual(canonicalize_url("http://example.com:8080"), "https://example.com:8080/")
+
+
+class EncodingTests(SimpleTestCase):
+
+    def test_http_charset_wins(self):
+        content = b'<?xml version="1.0" encoding="utf-8"?><rss/>'
+
+        self.assertEqual(detect_encoding(content, "application/rss+xml; charset=ISO-8859-1"), "iso8859-1")
+
+    def test_xml_prolog(self):
+        self.assertEqual(detect_encoding(b"<?xml version='1.0' encoding='windows-1252'?><rss/>", "text/xml"), "cp1252")
+
+    def test_html_meta_charset(self):
+        self.assertEqual(detect_encoding(b'<html><head><meta charset="koi8-r"></head></html>'), "koi8-r")
+
+    def test_byte_order_mark(self):
+        self.assertEqual(detect_encoding("<rss/>".encode("utf-16")), "utf-16")
+
+    def test_unknown_declaration_is_ignored(self):
+        self.assertEqual(detect_encoding(b"<?xml version='1.0' encoding='bogus'?>\xef\xbb\xbf", "text/xml; charset=bogus"), "utf-8")
+
+    def test_utf8_input_is_reused(self):
+        content = "caf\xe9".encode("utf-8")
+
+        self.assertIs(to_utf8(content, "utf-8"), content)
+        self.assertEqual(to_utf8("caf\xe9".encode("cp1252"), "cp1252"), content)
+
+
+class PollTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(3), "https://example.com/rss")
+
+    def test_equivalent_link_is_not_subscribed_twice(self):
+        self.assertEqual(rss.write_feed_to_database(make_feed_obj(3), "http://example.com/rss/?utm_source=x"), 0)
+
+    def test_update_adds_only_new_items(self):
+        self.assertEqual(rss.update_feed_in_database(self.feed_id, make_feed_obj(5)), 2)
+        self.assertEqual(Item.objects.filter(feed_id=self.feed_id).count(), 5)
+
+    def test_update_rewrites_changed_items(self):
+        feed_obj = make_feed_obj(3)
+        feed_obj.items["fingerprint-0"]["title"] = "Changed"
+
+        self.assertEqual(rss.update_feed_in_database(self.feed_id, feed_obj), 0)
+        self.assertIn(b"<title>Changed</title>", rss.render_feed(self.feed_id))
+
+    def test_each_source_is_fetched_once(self):
+        # A duplicate subscription from before canonical links existed
+        duplicate = Feed.objects.create(rss_link="http://example.com/rss/", canonical_link="https://example.com/rss")
+
+        with mock.patch.object(rss, "read_feed_from_link", return_value=make_feed_obj(4)) as read_feed:
+            stats = poller.poll_feeds()
+
+        read_feed.assert_called_once()
+        self.assertEqual(stats, {"sources": 1, "failed": 0, "new_items": 1 + 4})
+        self.assertEqual(Item.objects.filter(feed=duplicate).count(), 4)
+
+
+@override_settings(POLL_INTERVAL=900, JOB_LEASE_TIMEOUT=300, JOB_MAX_ATTEMPTS=3, JOB_RETRY_DELAY=60)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(1), "https://example.com/rss")
+        jobs.schedule_polls()
+
+    def test_each_source_gets_one_job(self):
+        Feed.objects.create(rss_link="http://example.com/rss/", canonical_link="https://example.com/rss")
+
+        self.assertEqual(jobs.schedule_polls(), 0)
+        self.assertEqual(list(Job.objects.values_list("kind", "source")), [("rss", "https://example.com/rss")])
+
+    def test_source_fits_every_source_field(self):
+        # SQLite does not enforce lengths, so compare the columns
+        width = Job._meta.get_field("source").max_length
+
+        for name in ("rss_link", "canonical_link", "page_url"):
+            self.assertGreaterEqual(width, Feed._meta.get_field(name).max_length, name)
+
+    def test_leased_job_is_not_claimed_twice(self):
+        self.assertEqual(len(jobs.claim_jobs("a", 5)), 1)
+        self.assertEqual(jobs.claim_jobs("b", 5), [])
+
+        # Once the lease runs out another worker takes over
+        Job.objects.update(locked_until=timezone.now())
+        job, = jobs.claim_jobs("b")
+
+        self.assertEqual((job.locked_by, job.attempts), ("b", 2))
+        self.assertFalse(jobs.complete_job(job, "a"))
+
+    def test_skip_locked_claim(self):
+        with mock.patch.object(connection.features, "has_select_for_update_skip_locked", True):
+            job, = jobs.claim_jobs("a", 5)
+
+        self.assertEqual(job.locked_by, "a")
+
+    def test_worker_polls_and_reschedules(self):
+        with mock.patch.object(rss, "read_feed_from_link", return_value=make_feed_obj(3)):
+            self.assertEqual(jobs.work("a"), 1)
+
+        job = Job.objects.get()
+        self.assertEqual((job.locked_by, job.attempts), ("", 0))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(Item.objects.filter(feed_id=self.feed_id).count(), 3)
+
+    def test_worker_rolls_up_polled_feeds(self):
+        with mock.patch.object(rss, "read_feed_from_link", return_value=make_feed_obj(3)):
+            call_command("runworker", "--once", stdout=io.StringIO())
+
+        self.assertEqual(PollLog.objects.count(), 1)
+        self.assertEqual(FeedStats.objects.get(feed_id=self.feed_id).polls, 1)
+
+    def test_jobs_leave_rollup_to_the_worker(self):
+        polled = set()
+
+        with mock.patch.object(rss, "read_feed_from_link", return_value=make_feed_obj(3)):
+            jobs.work("a", polled=polled)
+
+        self.assertEqual(polled, {self.feed_id})
+        self.assertFalse(FeedStats.objects.exists())
+
+    def test_failed_job_backs_off(self):
+        with mock.patch.object(rss, "read_feed_from_link", return_value=1):
+            jobs.work("a")
+
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("https://example.com/rss", job.last_error)
+        self.assertLess(job.run_after, timezone.now() + datetime.timedelta(seconds=61))
+
+
+class IngestTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(1), "https://example.com/rss")
+        self.body = bench.make_rfeed(4).rss().encode("utf-8")
+
+    def poll(self, body):
+        with mock.patch.object(ingest, "fetch_source", mock.AsyncMock(return_value=(body, "application/rss+xml"))):
+            return async_to_sync(ingest.poll_feeds_async)()
+
+    @override_settings(PARSE_WORKERS=0)
+    def test_poll_merges_fetched_items(self):
+        stats = self.poll(self.body)
+
+        self.assertEqual((stats["sources"], stats["failed"], stats["new_items"]), (1, 0, 4))
+        self.assertEqual(Item.objects.filter(feed_id=self.feed_id).count(), 5)
+
+    @override_settings(PARSE_WORKERS=0)
+    def test_non_feed_body_fails(self):
+        stats = self.poll(b"<html></html>")
+
+        self.assertEqual((stats["sources"], stats["failed"], stats["new_items"]), (1, 1, 0))
+        self.assertEqual(stats["stages"]["parse"]["failed"], 1)
+
+    @override_settings(PARSE_WORKERS=0, FETCH_CONCURRENCY=4, PIPELINE_QUEUE_SIZE=1, WRITE_BATCH_SIZE=3)
+    def test_writer_batches_sources(self):
+        for i in range(5):
+            rss.write_feed_to_database(make_feed_obj(1), "https://example.com/rss/%d" % i)
+
+        with mock.patch.object(ingest, "__write_batch", wraps=getattr(ingest, "__write_batch")) as write_batch:
+            stats = self.poll(self.body)
+
+        batch_sizes = [len(call.args[0]) for call in write_batch.call_args_list]
+
+        self.assertEqual(sum(batch_sizes), 6)
+        self.assertLessEqual(max(batch_sizes), 3)
+        self.assertEqual(stats["stages"]["write"]["processed"], 6)
+        self.assertEqual(stats["new_items"], 6 * 4)
+
+    @override_settings(PARSE_WORKERS=1)
+    def test_parse_pool_returns_feed_objects(self):
+        feed = async_to_sync(ingest.parse_source)(self.body, "application/rss+xml")
+
+        self.assertIsInstance(feed, rss.FeedObj)
+        self.assertEqual(len(feed.items), 4)
+
+
+@override_settings(POLL_LOG_RETENTION=3600)
+class PollStatsTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(1), "https://example.com/rss")
+
+    def test_poll_is_logged_and_rolled_up(self):
+        with mock.patch.object(rss, "read_feed_from_link", return_value=make_feed_obj(3)):
+            poller.poll_feeds()
+            poller.poll_feeds()
+
+        with mock.patch.object(rss, "read_feed_from_link", return_value=1):
+            poller.poll_feeds()
+
+        self.assertEqual(list(PollLog.objects.order_by("id").values_list("status", "new_items")),
+                         [(PollLog.OK, 2), (PollLog.OK, 0), (PollLog.FAILED, 0)])
+
+        stats = FeedStats.objects.get(feed_id=self.feed_id)
+        self.assertEqual((stats.polls, stats.failures, stats.changes, stats.change_rate), (3, 1, 1, 0.5))
+        self.assertIsNotNone(stats.last_changed)
+
+    def test_fetch_is_noted(self):
+        record = pollstats.PollRecord(Feed.objects.all())
+        response = mock.Mock(status_code=200, content=bench.make_rfeed(2).rss().encode("utf-8"), headers={})
+
+        with pollstats.tracking(record), mock.patch("requests.get", return_value=response):
+            rss.read_feed_from_link("https://example.com/other")
+
+        self.assertEqual((record.http_status, record.bytes), (200, len(response.content)))
+
+    def test_rollup_percentiles(self):
+        for fetch_ms in range(1, 101):
+            PollLog.objects.create(feed_id=self.feed_id, fetch_ms=fetch_ms, parse_ms=1, write_ms=1)
+
+        self.assertEqual(pollstats.rollup_stats(), 1)
+
+        stats = FeedStats.objects.get(feed_id=self.feed_id)
+        self.assertEqual((stats.fetch_ms_p50, stats.fetch_ms_p95, stats.total_ms_p95), (50, 95, 97))
+
+    def test_old_logs_are_pruned(self):
+        PollLog.objects.create(feed_id=self.feed_id)
+        PollLog.objects.create(feed_id=self.feed_id)
+        PollLog.objects.filter(pk=PollLog.objects.first().pk).update(
+                created=timezone.now() - datetime.timedelta(hours=2))
+
+        pollstats.rollup_stats([self.feed_id])
+
+        self.assertEqual(PollLog.objects.count(), 1)
+        self.assertEqual(FeedStats.objects.get(feed_id=self.feed_id).polls, 1)
+
+    def test_rollup_skips_feeds_not_given(self):
+        other_id = rss.write_feed_to_database(make_feed_obj(1), "https://example.com/other")
+        PollLog.objects.create(feed_id=self.feed_id, fetch_ms=10)
+        PollLog.objects.create(feed_id=other_id, fetch_ms=20, new_items=1)
+        PollLog.objects.create(feed_id=other_id, status=PollLog.FAILED)
+
+        self.assertEqual(pollstats.rollup_stats([other_id]), 1)
+
+        stats = FeedStats.objects.get()
+        self.assertEqual((stats.feed_id, stats.polls, stats.failures, stats.changes, stats.change_rate, stats.fetch_ms_p50),
+                         (other_id, 2, 1, 1, 1.0, 20))
+
+    def test_rollup_updates_existing_stats(self):
+        pruned_id = rss.write_feed_to_database(make_feed_obj(1), "https://example.com/other")
+        FeedStats.objects.create(feed_id=self.feed_id, polls=5)
+        FeedStats.objects.create(feed_id=pruned_id, polls=5)
+        PollLog.objects.create(feed_id=self.feed_id, fetch_ms=10)
+
+        # Prune, three percentile queries, the summary and the writes in a savepoint
+        with self.assertNumQueries(10):
+            self.assertEqual(pollstats.rollup_stats([self.feed_id, pruned_id]), 1)
+
+        self.assertEqual(list(FeedStats.objects.values_list("feed_id", "polls", "fetch_ms_p50")), [(self.feed_id, 1, 10)])
+
+    @override_settings(PARSE_WORKERS=0)
+    def test_pipeline_logs_polls(self):
+        body = bench.make_rfeed(2).rss().encode("utf-8")
+
+        with mock.patch.object(ingest, "fetch_source", mock.AsyncMock(return_value=(body, "application/rss+xml"))):
+            async_to_sync(ingest.poll_feeds_async)()
+
+        log = PollLog.objects.get()
+        self.assertEqual((log.status, log.bytes, log.new_items), (PollLog.OK, len(body), 2))
+        self.assertEqual(FeedStats.objects.get().polls, 1)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_e2e_suite_times_every_stage_and_cleans_up(self):
+        results = bench.bench_e2e(items=3, repeat=1)
+
+        self.assertEqual([(result["items"], result["description"]) for result in results],
+                         [(3, name) for name in bench.DESCRIPTION_SIZES])
+        self.assertIn("read_feed_from_link_ms", results[0])
+        self.assertIn("render_feed_ms", results[0])
+        self.assertFalse(Feed.objects.exists())
+
+    def test_large_descriptions_are_not_truncated(self):
+        # SQLite does not enforce lengths, so check the columns are unbounded
+        self.assertIsNone(ItemField._meta.get_field("value").max_length)
+        self.assertIsNone(FeedField._meta.get_field("value").max_length)
+
+
+@override_settings(METRICS_DIR="")
+class LoadTestTests(LiveServerTestCase):
+
+    def test_readers_revalidate_with_etags(self):
+        feed_ids = loadtest.seed_feeds(2, 3)
+
+        report = loadtest.run_readers(self.live_server_url, feed_ids, readers=2, duration=0.5, conditional=1)
+
+        self.assertGreater(report["requests"], 2)
+        self.assertEqual(report["errors"], 0)
+        self.assertIn("304", report["statuses"])
+        self.assertIn("db_queries_per_request", report)
+        self.assertEqual(loadtest.delete_seeded_feeds(), 2)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.counter = metrics.Counter("test_requests_total", "Test counter.", ("status",))
+        self.histogram = metrics.Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1))
+
+        for metric in (self.counter, self.histogram):
+            metrics.REGISTRY[metric.name] = metric
+            self.addCleanup(metrics.REGISTRY.pop, metric.name)
+
+    def test_text_format(self):
+        self.counter.inc(status=200)
+        self.counter.inc(2, status=304)
+        self.histogram.observe(0.05)
+        self.histogram.observe(5)
+
+        text = metrics.render()
+
+        self.assertIn('test_requests_total{status="304"} 2\n', text)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('test_seconds_bucket{le="1"} 1\n', text)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2\n', text)
+        self.assertIn("test_seconds_count 2\n", text)
+
+    def test_worker_processes_are_added_up(self):
+        self.counter.inc(status=200)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            with open(directory + "/metrics-1.json", "w") as f:
+                f.write('{"test_requests_total": [[["200"], 4]], "test_seconds": [[[], [[1, 0, 0], 0.05, 1]]]}')
+
+            text = metrics.render()
+
+        self.assertIn('test_requests_total{status="200"} 5\n', text)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1\n', text)
+
+    def test_exited_processes_are_kept(self):
+        self.counter.inc(status=200)
+        exited = subprocess.Popen([sys.executable, "-c", ""])
+        exited.wait()
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            with open(directory + "/metrics-%d-old.json" % exited.pid, "w") as f:
+                f.write('{"test_requests_total": [[["200"], 4]]}')
+
+            first = metrics.render()
+            second = metrics.render()
+
+            self.assertFalse(Path(directory, "metrics-%d-old.json" % exited.pid).exists())
+
+        self.assertIn('test_requests_total{status="200"} 5\n', first)
+        self.assertEqual(first, second)
+
+    def test_reused_pid_gets_its_own_file(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            with mock.patch.multiple(metrics, _token=None, _token_pid=None):
+                metrics.flush()
+            metrics.flush()
+
+            self.assertEqual(len(list(Path(directory).glob("metrics-%d-*.json" % os.getpid()))), 2)
+
+    def test_requests_are_counted_by_view(self):
+        feed_id = rss.write_feed_to_database(make_feed_obj(2), "https://example.com/rss")
+        self.client.get("/feed/%d.rss" % feed_id)
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pollrss_request_queries_count{view="feed"}', response.content.decode())
+
+
+@override_settings(PROFILE_DIR="", PROFILE_SAMPLE_RATE=0, PROFILE_RING_SIZE=2, PROFILE_SLOW_QUERIES=3)
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(2), "https://example.com/rss")
+        self.url = "/feed/%d.rss" % self.feed_id
+
+    def login(self, is_staff):
+        user = User.objects.create_user("user", password="password", is_staff=is_staff)
+        self.client.force_login(user)
+
+    def test_only_staff_can_profile(self):
+        self.login(is_staff=False)
+
+        response = self.client.get(self.url, HTTP_X_PROFILE="1")
+
+        self.assertNotIn("Server-Timing", response)
+
+    def test_summary_header(self):
+        self.login(is_staff=True)
+
+        response = self.client.get(self.url, HTTP_X_PROFILE="1")
+
+        self.assertEqual(response["Content-Type"], "application/rss+xml")
+        self.assertRegex(response["Server-Timing"], r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ queries"$')
+
+    def test_text_report_lists_queries_and_functions(self):
+        self.login(is_staff=True)
+
+        response = self.client.get(self.url, {"profile": "text"})
+
+        self.assertContains(response, "Slowest queries:")
+        self.assertContains(response, "render_feed")
+
+    def test_sampled_profiles_are_kept_in_a_ring(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILE_DIR=directory, PROFILE_SAMPLE_RATE=1):
+            for _ in range(3):
+                self.client.get(self.url)
+
+            profiles = sorted(Path(directory).glob("*.prof"))
+
+            self.assertEqual(len(profiles), 2)
+            pstats.Stats(str(profiles[0]))
+            self.assertIn('"queries"', profiles[0].with_suffix(".json").read_text())
+
+
+@override_settings(SHARD_REPLICAS=100)
+class TracingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.trace_file = Path(tempfile.mkdtemp()) / "traces.jsonl"
+        self.settings = override_settings(TRACE_FILE=str(self.trace_file), TRACE_SAMPLE_RATE=1, TRACE_SLOW_SECONDS=0)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def exported(self) -> list:
+        tracing.flush()
+
+        if not self.trace_file.exists():
+            return []
+
+        return [json.loads(line) for line in self.trace_file.read_text().splitlines()]
+
+    def test_children_share_the_trace(self):
+        with tracing.span("root") as root:
+            with tracing.span("child"):
+                pass
+
+        child, parent = self.exported()
+        self.assertEqual((parent["name"], child["name"]), ("root", "child"))
+        self.assertEqual((child["trace_id"], child["parent_id"]), (root.trace_id, root.span_id))
+
+    def test_sampling(self):
+        with override_settings(TRACE_SAMPLE_RATE=0):
+            with tracing.span("fast"):
+                pass
+
+            with override_settings(TRACE_SLOW_SECONDS=0.001), tracing.span("slow"):
+                time.sleep(0.002)
+
+        self.assertEqual([span["name"] for span in self.exported()], ["slow"])
+
+    def test_off_without_exporter(self):
+        with override_settings(TRACE_FILE=""):
+            self.assertIs(tracing.start_span("root"), tracing.NULL_SPAN)
+
+    @override_settings(PARSE_WORKERS=0)
+    def test_pipeline_carries_the_trace(self):
+        rss.write_feed_to_database(make_feed_obj(1), "https://example.com/rss")
+        body = bench.make_rfeed(2).rss().encode("utf-8")
+
+        with mock.patch.object(ingest, "fetch_source", mock.AsyncMock(return_value=(body, "application/rss+xml"))):
+            async_to_sync(ingest.poll_feeds_async)()
+
+        spans = {span["name"]: span for span in self.exported()}
+        trace_ids = {spans[name]["trace_id"] for name in ("poll", "ingest.fetch", "ingest.parse", "ingest.write")}
+        self.assertEqual(len(trace_ids), 1)
+        self.assertEqual(spans["rss.update_feed_in_database"]["parent_id"], spans["ingest.write"]["span_id"])
+
+    def test_request_continues_caller_trace(self):
+        feed_id = rss.write_feed_to_database(make_feed_obj(2), "https://example.com/rss")
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+        with override_settings(TRACE_SAMPLE_RATE=0):
+            self.client.get("/feed/%d.rss" % feed_id, HTTP_TRACEPARENT="00-%s-00f067aa0ba902b7-01" % trace_id)
+
+        spans = {span["name"]: span for span in self.exported()}
+        self.assertEqual(spans["request feed"]["parent_id"], "00f067aa0ba902b7")
+        self.assertEqual(spans["rss.render_feed"]["trace_id"], trace_id)
+
+    def test_otlp_export(self):
+        with tracing.span("root", feeds=2) as root:
+            pass
+
+        body = tracing.to_otlp([root])
+        span, = body["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual(span["traceId"], root.trace_id)
+        self.assertEqual(span["attributes"], [{"key": "feeds", "value": {"intValue": "2"}}])
+
+
+class ShardingTests(TestCase):
+
+    def test_adding_a_node_only_moves_keys_to_it(self):
+        keys = [str(i) for i in range(2000)]
+        before = sharding.HashRing(["a", "b", "c"])
+        after = sharding.HashRing(["a", "b", "c", "d"])
+
+        moved = [key for key in keys if before.get_node(key) != after.get_node(key)]
+
+        self.assertTrue(all(after.get_node(key) == "d" for key in moved))
+        self.assertLess(len(moved), len(keys) / 2)
+
+    def test_nodes_split_feeds_without_overlap(self):
+        for i in range(30):
+            Feed.objects.create(rss_link="https://host%d.example.com/rss" % (i % 10),
+                                canonical_link="https://host%d.example.com/rss/%d" % (i % 10, i))
+
+        nodes = ["a", "b", "c"]
+        shards = {node: sharding.select_feeds(Feed.objects.all(), node, nodes, sharding.BY_HOST) for node in nodes}
+
+        self.assertEqual(sorted(db_feed.pk for shard in shards.values() for db_feed in shard),
+                         sorted(Feed.objects.values_list("pk", flat=True)))
+
+        # Every feed of a host is polled by the same node
+        for shard in shards.values():
+            hosts = {db_feed.rss_link for db_feed in shard}
+            self.assertEqual(len(shard), 3 * len(hosts))
+
+    def test_unknown_node_is_rejected(self):
+        with self.assertRaises(ValueError):
+            sharding.select_feeds([], "z", ["a", "b"])
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        page = mock.Mock(content="<p>caf\xe9</p>".encode("latin-1"), headers={"Content-Type": "text/html; charset=ISO-8859-1"})
+        patcher = mock.patch.object(snapshots.requests, "get", return_value=page)
+        self.addCleanup(patcher.stop)
+        self.get = patcher.start()
+
+    def test_page_is_fetched_once(self):
+        first = self.client.get("/create/", {"url": "https://example.com/"})
+        second = self.client.get("/create/", {"url": "https://example.com/"})
+
+        self.get.assert_called_once()
+        self.assertEqual(first.context["snapshot_digest"], second.context["snapshot_digest"])
+
+    def test_snapshot_is_served_as_utf8(self):
+        digest = snapshots.fetch_snapshot("https://example.com/")
+
+        response = self.client.get("/snapshot/%s/" % digest)
+
+        self.assertEqual(response.content, "<p>caf\xe9</p>".encode("utf-8"))
+        self.assertEqual(response["Content-Security-Policy"], "sandbox")
+        self.assertEqual(response["X-Frame-Options"], "SAMEORIGIN")
+
+    def test_expired_snapshot_is_not_found(self):
+        self.assertEqual(self.client.get("/snapshot/%s/" % ("0" * 64)).status_code, 404)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class DiscoveryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_feed_links_in_head_are_found(self):
+        content = b"""<html><head>
+<link rel="alternate" type="application/rss+xml" title="News" href="/rss">
+<link rel="alternate" type="application/rss+xml" href="/rss">
+<link rel="stylesheet" href="/style.css">
+</head><body><link rel="alternate" type="application/rss+xml" href="/late"></body></html>"""
+
+        self.assertEqual(discovery.find_feed_links(content, "https://example.com/news/"),
+                         [("https://example.com/rss", "News")])
+
+    def test_page_without_feeds_is_scraped(self):
+        with mock.patch.object(discovery, "discover_feeds", return_value=[]):
+            response = self.client.get("/", {"url": "example.com"})
+
+        self.assertRedirects(response, "/create/?url=https%3A//example.com", fetch_redirect_response=False)
+
+    def test_advertised_feeds_are_offered(self):
+        page = mock.MagicMock(headers={"Content-Type": "text/html"}, url="https://example.com/")
+        page.__enter__.return_value = page
+        page.iter_content.return_value = [b'<head><link rel="alternate" type="application/rss+xml" href="/rss"></head>']
+
+        with mock.patch.object(discovery.requests, "get", return_value=page) as get:
+            self.client.get("/", {"url": "https://example.com/"})
+            response = self.client.get("/", {"url": "https://example.com/"})
+
+        get.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'value="https://example.com/rss"')
+
+    def test_head_end_split_across_chunks_stops_reading(self):
+        chunks = [b'<head><link rel="alternate" type="application/rss+xml" href="/rss"></he', b'ad>', b'<body>']
+        page = mock.MagicMock(headers={"Content-Type": "text/html"}, url="https://example.com/")
+        page.__enter__.return_value = page
+        page.iter_content.return_value = iter(chunks)
+
+        with mock.patch.object(discovery.requests, "get", return_value=page):
+            discovery.discover_feeds("https://example.com/split")
+
+        self.assertEqual(list(page.iter_content.return_value), [b'<body>'])
+
+    def test_subscribing_to_existing_feed_does_not_fetch(self):
+        feed_id = rss.write_feed_to_database(make_feed_obj(1), "https://example.com/rss")
+
+        with mock.patch.object(views, "resolve_canonical_url", return_value="https://example.com/rss"), \
+                mock.patch.object(rss, "read_feed_from_link") as read_feed:
+            response = self.client.post("/subscribe/", {"url": "https://example.com/rss"})
+
+        read_feed.assert_not_called()
+        self.assertRedirects(response, "/viewfeed/%d/" % feed_id, fetch_redirect_response=False)
+
+
+PAGE = b"""<html><head><title>News</title></head><body>
+<article><h2><a href="/one">One</a></h2><p>First &amp; best</p></article>
+<article><h2><a href="https://other.example.com/two">Two</a></h2></article>
+<article><p>No title</p></article>
+</body></html>"""
+
+
+class ExtractTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.digest = snapshots.store_snapshot("https://example.com/news", PAGE, "text/html; charset=utf-8")
+
+    def test_xpath_extraction(self):
+        feed = extract.extract_feed(PAGE, "https://example.com/news", {
+                "item": ("xpath", "//article"),
+                "title": ("xpath", "./h2"),
+                "link": ("xpath", ".//a/@href"),
+                "description": ("xpath", "./p"),
+            })
+
+        items = list(feed.items.values())
+
+        self.assertEqual(feed.elements["title"], "News")
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0], {"title": "One", "link": "https://example.com/one", "description": "<p>First &amp; best</p>"})
+        self.assertEqual(items[1]["link"], "https://other.example.com/two")
+
+    def test_css_matches_xpath(self):
+        xpath = extract.extract_feed(PAGE, "https://example.com/", {"item": ("xpath", "//article"), "title": ("xpath", ".//a"), "link": ("xpath", ".//a")})
+        css = extract.extract_feed(PAGE, "https://example.com/", {"item": ("css", "article"), "title": ("css", "a"), "link": ("css", "a")})
+
+        self.assertEqual(xpath.items, css.items)
+
+    def test_compiled_selectors_are_cached(self):
+        self.assertIs(extract.compile_selector("xpath", "//article"), extract.compile_selector("xpath", "//article"))
+
+    def test_invalid_selector(self):
+        with self.assertRaises(extract.SelectorError):
+            extract.compile_selector("xpath", "//[")
+
+    def test_unchanged_page_skips_extraction(self):
+        feed_id = extract.create_scraped_feed("https://example.com/news", {"item": ("xpath", "//article"), "title": ("xpath", "./h2")}, self.digest)
+        db_feed = Feed.objects.get(pk=feed_id)
+
+        self.assertEqual(Item.objects.filter(feed=db_feed).count(), 2)
+
+        with mock.patch.object(extract, "extract_feed") as extract_feed:
+            self.assertEqual(extract.refresh_scraped_feed(db_feed, self.digest), 0)
+
+        extract_feed.assert_not_called()
+
+    def test_changed_page_adds_items(self):
+        feed_id = extract.create_scraped_feed("https://example.com/news", {"item": ("xpath", "//article"), "title": ("xpath", "./h2")}, self.digest)
+        digest = snapshots.store_snapshot("https://example.com/news", PAGE.replace(b"</body>", b"<article><h2>Three</h2></article></body>"), "text/html; charset=utf-8")
+
+        self.assertEqual(extract.refresh_scraped_feed(Feed.objects.get(pk=feed_id), digest), 1)
+
+    def test_long_page_url_fits_canonical_link(self):
+        # SQLite does not enforce lengths, so compare the columns
+        self.assertGreaterEqual(Feed._meta.get_field("canonical_link").max_length, Feed._meta.get_field("page_url").max_length)
+
+    def test_create_view_saves_scraped_feed(self):
+        response = self.client.post("/create/", {
+                "url": "https://example.com/news",
+                "digest": self.digest,
+                "kind": "xpath",
+                "item": "//article",
+                "title": "./h2",
+            })
+
+        feed = Feed.objects.get(page_url="https://example.com/news")
+
+        self.assertRedirects(response, "/viewfeed/%d/" % feed.pk, fetch_redirect_response=False)
+        self.assertIn(b"<title>One</title>", rss.render_feed(feed.pk))
+
+    def test_item_selector_must_select_elements(self):
+        for expression in ("//a/@href", "count(//a)"):
+            with self.assertRaises(extract.SelectorError) as raised:
+                extract.extract_feed(PAGE, "https://example.com/", {"item": ("xpath", expression), "title": ("xpath", ".")})
+
+            self.assertEqual(raised.exception.name, "item")
+
+    def test_failing_selector(self):
+        # Compiles, but the function only fails once evaluated
+        with self.assertRaises(extract.SelectorError) as raised:
+            extract.extract_feed(PAGE, "https://example.com/", {"item": ("xpath", "//article"), "title": ("xpath", "unknown()")})
+
+        self.assertEqual(raised.exception.name, "title")
+
+    def test_empty_page(self):
+        with self.assertRaises(extract.ExtractError):
+            extract.extract_feed(b"", "https://example.com/", {"item": ("xpath", "//article"), "title": ("xpath", "./h2")})
+
+    @override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+    def test_create_view_shows_extraction_errors(self):
+        response = self.client.post("/create/", {
+                "url": "https://example.com/news",
+                "digest": self.digest,
+                "kind": "xpath",
+                "item": "//a/@href",
+                "title": "./h2",
+            })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["form"].errors["item"], ["The item selector must select elements"])
+        self.assertFalse(Feed.objects.filter(page_url="https://example.com/news").exists())
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(3), "https://example.com/rss")
+
+        export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(export_root.cleanup)
+
+        settings_override = override_settings(FEED_EXPORT_ROOT=export_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_export_writes_plain_and_gzip(self):
+        self.assertTrue(export.export_feed(self.feed_id))
+
+        path = export.get_export_path(self.feed_id)
+        body = rss.render_feed(self.feed_id)
+
+        self.assertEqual(path.read_bytes(), body)
+        self.assertEqual(gzip.decompress(path.with_suffix(".rss.gz").read_bytes()), body)
+
+    def test_unchanged_feed_is_not_rewritten(self):
+        export.export_feed(self.feed_id)
+
+        self.assertFalse(export.export_feed(self.feed_id))
+
+    def test_failed_export_still_expires_cache(self):
+        cache.clear()
+        version = feedcache.get_feed_list_version()
+
+        with mock.patch.object(rss, "render_feed", side_effect=ValueError("Invalid date value or format 'garbage'")), \
+                self.assertLogs("ui.export", "ERROR"):
+            feed_updated.send(sender=Feed, feed_id=self.feed_id)
+
+        self.assertNotEqual(feedcache.get_feed_list_version(), version)
+
+    def test_deleted_feed_is_removed(self):
+        export.export_feed(self.feed_id)
+        Feed.objects.get(pk=self.feed_id).delete()
+
+        self.assertFalse(export.get_export_path(self.feed_id).exists())
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class AdminTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        self.feed_id = rss.write_feed_to_database(make_feed_obj(3), "https://example.com/rss")
+
+    def test_prune_selected_items(self):
+        item_ids = list(Item.objects.filter(feed_id=self.feed_id).values_list("pk", flat=True)[:2])
+
+        response = self.client.post("/admin/ui/item/", {"action": "prune_items", "_selected_action": item_ids})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Item.objects.filter(feed_id=self.feed_id).count(), 1)
+        self.assertFalse(ItemField.objects.filter(item_id__in=item_ids).exists())
+
+    def test_delete_items_in_batches(self):
+        item_ids = Item.objects.values_list("pk", flat=True)
+
+        with mock.patch.object(rss, "__delete_item_batch", wraps=getattr(rss, "__delete_item_batch")) as delete_batch:
+            self.assertEqual(rss.delete_items(iter(list(item_ids)), batch_size=2), 3)
+
+        self.assertEqual([len(call.args[0]) for call in delete_batch.call_args_list], [2, 1])
+
+    def test_refresh_selected_feeds(self):
+        with mock.patch.object(rss, "read_feed_from_link", return_value=make_feed_obj(5)):
+            self.client.post("/admin/ui/feed/", {"action": "refresh_feeds", "_selected_action": [self.feed_id]})
+
+        self.assertEqual(Item.objects.filter(feed_id=self.feed_id).count(), 5)
+
+    def test_numeric_search_matches_ids(self):
+        item_id = Item.objects.filter(feed_id=self.feed_id).first().pk
+
+        response = self.client.get("/admin/ui/itemfield/", {"q": str(item_id)})
+
+        self.assertEqual(response.context["cl"].result_count, 5)
+
+    def test_large_table_searches_are_indexed(self):
+        def indexed(model, name):
+            field = model._meta.get_field(name)
+            leading = [index.fields[0] for index in model._meta.indexes] + \
+                      [fields[0] for fields in model._meta.unique_together]
+
+            return field.db_index or field.unique or name in leading
+
+        large_tables = [model_admin for model_admin in admin.site._registry.values()
+                        if isinstance(model_admin, LargeTableAdmin)]
+        self.assertIn(ItemField, [model_admin.model for model_admin in large_tables])
+
+        for model_admin in large_tables:
+            names = [name.lstrip("^=@") for name in model_admin.search_fields]
+            names += [name for name in model_admin.list_filter if isinstance(name, str)]
+            names += list(model_admin.id_search_fields)
+            if model_admin.date_hierarchy:
+                names.append(model_admin.date_hierarchy)
+
+            for name in names:
+                self.assertTrue(indexed(model_admin.model, name), "%s.%s" % (model_admin.model.__name__, name))
+
+    def test_estimated_count(self):
+        paginator = pagination.EstimatedCountPaginator(Item.objects.all(), 10)
+
+        with mock.patch.object(pagination, "estimate_count", return_value=5000000):
+            self.assertEqual(paginator.count, 5000000)
+
+        # SQLite keeps no estimate
+        self.assertIsNone(pagination.estimate_count(Item.objects.all()))
+        self.assertIsNone(pagination.estimate_count(Item.objects.filter(feed_id=self.feed_id)))
+        self.assertEqual(pagination.EstimatedCountPaginator(Item.objects.all(), 10).count, 3)
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class QueryBudgetTests(TestCase):
+    """Query counts must not grow with the number of items or feeds."""
+
+    SIZES = (1, 10, 40)
+
+    def setUp(self):
+        cache.clear()
+
+    def make_feed(self, items: int) -> int:
+        return rss.write_feed_to_database(make_feed_obj(items), "https://example.com/rss/%d" % items)
+
+    def assertQueryBudget(self, budget: int, func):
+        """Run func(size) for every size and check its query count is constant and within budget."""
+        counts = []
+        for size in self.SIZES:
+            with CaptureQueriesContext(connection) as queries:
+                func(size)
+            counts.append(len(queries))
+
+        self.assertEqual(len(set(counts)), 1, "Query count grows with size: %r" % dict(zip(self.SIZES, counts)))
+        self.assertLessEqual(counts[0], budget)
+
+    def test_feed_view(self):
+        feed_ids = {size: self.make_feed(size) for size in self.SIZES}
+
+        self.assertQueryBudget(3, lambda size: self.client.get("/feed/%d.rss" % feed_ids[size]))
+
+    def test_viewfeed_view(self):
+        feed_ids = {size: self.make_feed(size) for size in self.SIZES}
+
+        self.assertQueryBudget(1, lambda size: self.client.get("/viewfeed/%d/" % feed_ids[size]))
+
+    @override_settings(FEED_LIST_PAGE_SIZE=100)
+    def test_feed_list_view(self):
+        def list_feeds(size):
+            cache.clear()
+            Feed.objects.all().delete()
+            for i in range(size):
+                rss.write_feed_to_database(make_feed_obj(2), "https://example.com/%d" % i)
+
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/feeds/")
+
+            return queries
+
+        counts = {size: len(list_feeds(size)) for size in self.SIZES}
+
+        self.assertEqual(len(set(counts.values())), 1, "Query count grows with feeds: %r" % counts)
+        # Count and page
+        self.assertLessEqual(counts[1], 2)
+
+    def test_write_feed_to_database(self):
+        # Existence check, feed, feed fields, items, item ids on SQLite, item fields
+        self.assertQueryBudget(8, lambda size: self.make_feed(size))
+
+    def test_update_feed_in_database(self):
+        # Half of each update is new items
+        feed_ids = {size: self.make_feed(size // 2) for size in self.SIZES}
+
+        self.assertQueryBudget(14, lambda size: rss.update_feed_in_database(feed_ids[size], make_feed_obj(size)))
+
+    def test_admin_changelists(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+        for model in (Feed, FeedField, Item, ItemField, Selector, Job, PollLog, FeedStats):
+            with self.subTest(model=model.__name__):
+                url = "/admin/ui/%s/" % model._meta.model_name
+
+                def changelist(size):
+                    Feed.objects.all().delete()
+                    feed_id = self.make_feed(size)
+                    Selector.objects.create(feed_id=feed_id, name=Selector.ITEM, expression="//article")
+
+                    with CaptureQueriesContext(connection) as queries:
+                        self.assertEqual(self.client.get(url).status_code, 200)
+
+                    return queries
+
+                counts = {size: len(changelist(size)) for size in self.SIZES}
+
+                self.assertEqual(len(set(counts.values())), 1, "Query count grows with rows: %r" % counts)
+
+    def test_render_allocation_is_proportional_to_output(self):
+        for size in (10, 100):
+            feed_id = self.make_feed(size)
+
+            tracemalloc.start()
+            try:
+                body = rss.render_feed(feed_id)
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            self.assertLess(peak, 10 * len(body) + 64 * 1024)
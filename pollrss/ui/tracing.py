@@ -0,0 +1,337 @@
+'''
+    Copyright 2020 Chase Kidder
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+'''
+
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+# Spans time the stages a poll or request goes through. Spans started while
+# another is current become its children and share its trace id. A trace is
+# exported when its root span ends, if it was sampled: TRACE_SAMPLE_RATE of
+# new traces, every trace an upstream caller marked as sampled in its
+# traceparent header, and every trace slower than TRACE_SLOW_SECONDS.
+#
+# Finished traces go to a background thread, which appends them to
+# TRACE_FILE as JSON lines and/or posts them to the OTLP/HTTP collector at
+# TRACE_OTLP_ENDPOINT. With neither set, tracing is off and costs nothing.
+
+EXPORT_TIMEOUT = 5
+SERVICE_NAME = "pollrss"
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current = contextvars.ContextVar("pollrss_span", default=None)
+
+_queue = queue.Queue()
+_lock = threading.Lock()
+_exporter_pid = None
+
+
+class Span():
+    """One timed operation of a trace.
+
+    Args:
+        name (str): Operation name.
+        parent (Span): Parent span, or None to start a trace.
+        trace_id (str): Id of a trace continued from another service, when there is no parent.
+        parent_id (str): Id of the remote parent span, when there is no parent.
+        sampled (bool): Whether a new trace is exported regardless of its duration.
+        attributes (dict): Span attributes.
+    """
+    def __init__(self, name: str, parent=None, trace_id: str = None, parent_id: str = None, sampled: bool = False,
+                 attributes: dict = None):
+        self.name = name
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start = time.time_ns()
+        self.duration = None
+        self.__started = time.perf_counter()
+
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.root = parent.root
+        else:
+            self.trace_id = trace_id or "%032x" % random.getrandbits(128)
+            self.parent_id = parent_id
+            self.root = self
+            self.sampled = sampled
+            # Finished spans of the trace, shared by all of them
+            self.spans = []
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException = None):
+        """Finish the span. Ending the root span exports the trace if it is sampled.
+
+        Args:
+            error (BaseException): Exception the operation failed with, if any.
+        """
+        if self.duration is not None:
+            return
+
+        self.duration = time.perf_counter() - self.__started
+
+        if error is not None:
+            self.error = "%s: %s" % (error.__class__.__name__, error)
+
+        self.root.spans.append(self)
+
+        if self.root is self:
+            slow = settings.TRACE_SLOW_SECONDS and self.duration >= settings.TRACE_SLOW_SECONDS
+
+            if self.sampled or slow:
+                _export(list(self.spans))
+
+    def to_dict(self) -> dict:
+        """Get the span as a JSON serializable dict."""
+        return {
+                    "trace_id": self.trace_id,
+                    "span_id": self.span_id,
+                    "parent_id": self.parent_id,
+                    "name": self.name,
+                    "start": self.start,
+                    "duration_ms": round(self.duration * 1000, 3),
+                    "attributes": self.attributes,
+                    "error": self.error
+                }
+
+
+class NullSpan():
+    """Stand-in for a span while tracing is off."""
+    trace_id = span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error: BaseException = None):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def enabled() -> bool:
+    """Check if spans are recorded, that is if an exporter is configured."""
+    return bool(settings.TRACE_FILE or settings.TRACE_OTLP_ENDPOINT)
+
+
+def current_span():
+    """Get the span of the operation in progress, or None."""
+    return _current.get()
+
+
+def start_span(name: str, parent=None, traceparent: str = None, **attributes):
+    """Start a span, without making it current.
+
+    Args:
+        name (str): Operation name.
+        parent (Span): Parent span. Defaults to the current span.
+        traceparent (str): W3C traceparent header to continue, when there is no parent.
+        **attributes: Span attributes.
+
+    Returns:
+        Span: Started span, or NULL_SPAN if tracing is off.
+    """
+    if not enabled():
+        return NULL_SPAN
+
+    parent = parent or _current.get()
+
+    if parent is not None:
+        return Span(name, parent, attributes=attributes)
+
+    remote = TRACEPARENT.match(traceparent or "")
+
+    if remote:
+        trace_id, parent_id, flags = remote.groups()
+        return Span(name, trace_id=trace_id, parent_id=parent_id, sampled=bool(int(flags, 16) & 1),
+                    attributes=attributes)
+
+    return Span(name, sampled=random.random() < settings.TRACE_SAMPLE_RATE, attributes=attributes)
+
+
+@contextmanager
+def use(span):
+    """Make a started span current in a with block, without ending it."""
+    if span is NULL_SPAN:
+        yield span
+        return
+
+    token = _current.set(span)
+
+    try:
+        yield span
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a with block as a child of the current span.
+
+    Args:
+        name (str): Operation name.
+        **attributes: Span attributes.
+    """
+    started = start_span(name, **attributes)
+
+    with use(started):
+        try:
+            yield started
+        except BaseException as e:
+            started.end(e)
+            raise
+
+    started.end()
+
+
+def traced(name: str = None):
+    """Decorate a function to run in a span named after it.
+
+    Args:
+        name (str): Span name. Defaults to the function's module and name.
+    """
+    def decorator(func):
+        span_name = name or "%s.%s" % (func.__module__.rsplit(".", 1)[-1], func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def flush(timeout: float = EXPORT_TIMEOUT):
+    """Wait until the traces ended so far are exported.
+
+    Args:
+        timeout (float): Seconds to wait at most.
+    """
+    deadline = time.monotonic() + timeout
+
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def to_otlp(spans: list) -> dict:
+    """Convert spans to an OTLP/HTTP JSON export request.
+
+    Args:
+        spans (list): Finished spans.
+
+    Returns:
+        dict: ExportTraceServiceRequest body.
+    """
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    otlp_spans = []
+    for s in spans:
+        otlp_span = {
+                        "traceId": s.trace_id,
+                        "spanId": s.span_id,
+                        "name": s.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(s.start),
+                        "endTimeUnixNano": str(s.start + int(s.duration * 1e9)),
+                        "attributes": [attribute(key, value) for key, value in s.attributes.items()],
+                        "status": {"code": 2, "message": s.error} if s.error else {"code": 1}
+                    }
+
+        if s.parent_id:
+            otlp_span["parentSpanId"] = s.parent_id
+
+        otlp_spans.append(otlp_span)
+
+    return {"resourceSpans": [{
+                "resource": {"attributes": [attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}]
+            }]}
+
+
+def _export(spans: list):
+    global _exporter_pid
+
+    # The thread does not survive a fork, so each worker process starts its own
+    with _lock:
+        if _exporter_pid != os.getpid():
+            _exporter_pid = os.getpid()
+            threading.Thread(target=_run_exporter, name="pollrss-trace-exporter", daemon=True).start()
+
+    _queue.put(spans)
+
+
+def _run_exporter():
+    while True:
+        batch = _queue.get()
+        count = 1
+
+        # Send whatever else is already waiting along with it
+        while not _queue.empty():
+            batch = batch + _queue.get_nowait()
+            count += 1
+
+        try:
+            _write(batch)
+        except Exception:
+            logger.exception("Exporting %d span(s) failed", len(batch))
+        finally:
+            for _ in range(count):
+                _queue.task_done()
+
+
+def _write(spans: list):
+    if settings.TRACE_FILE:
+        with open(settings.TRACE_FILE, "a") as f:
+            f.write("".join(json.dumps(s.to_dict()) + "\n" for s in spans))
+
+    if settings.TRACE_OTLP_ENDPOINT:
+        requests.post(settings.TRACE_OTLP_ENDPOINT, json=to_otlp(spans), timeout=EXPORT_TIMEOUT).raise_for_status()
+
+
+atexit.register(flush)
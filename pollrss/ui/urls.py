@@ -14,16 +14,23 @@ Copyright 2020 Chase Kidder
    limitations under the License.
 '''
 
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# Views that fetch pages or serve feeds have async versions for ASGI deployments
+serving_views = async_views if settings.ASYNC_VIEWS else views
 
 
 urlpatterns = [
                 path('', views.index, name = 'index'),
-                path('create/', views.create, name = 'create'),
+                path('subscribe/', views.subscribe, name = 'subscribe'),
+                path('create/', serving_views.create, name = 'create'),
+                path('snapshot/<str:digest>/', views.snapshot, name = 'snapshot'),
                 path('feeds/', views.FeedListView.as_view(), name = 'feeds'),
-                path('feed/<int:feed_id>.rss', views.feed, name = 'feed'),
-                path('viewfeed/<int:feed_id>/', views.viewfeed, name = 'viewfeed'),
+                path('feed/<int:feed_id>.rss', serving_views.feed, name = 'feed'),
+                path('viewfeed/<int:feed_id>/', serving_views.viewfeed, name = 'viewfeed'),
+                path('metrics', views.prometheus_metrics, name = 'metrics'),
                 path('test/', views.test, name='test'),
                 ]
@@ -15,22 +15,26 @@ Copyright 2020 Chase Kidder
 '''
 
 from django.views.decorators.csrf import ensure_csrf_cookie
-from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest
-from django.shortcuts import render
+from django.views.decorators.clickjacking import xframe_options_sameorigin
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.conf import settings
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest, Http404
+from django.shortcuts import get_object_or_404, render
 from django.views import generic
+from django.core.cache import cache
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 
 from .models import Feed, FeedField, Item, ItemField
-from .forms import IndexForm, FeedForm
-from . import rss
+from .forms import IndexForm, FeedForm, SelectorForm, SubscribeForm
+from . import discovery, extract, feedcache, metrics, rss, snapshots
+from .canonical import resolve_canonical_url
 
-import requests
 import urllib
-from base64 import b64encode
-from bs4 import BeautifulSoup
 
 
 # Serve the index page and get url
@@ -41,62 +45,168 @@ def index(request):
             val = URLValidator()
             try:
                 url = request.GET['url']
-                if not url.startswith('https'):
+                if not url.lower().startswith(('http://', 'https://')):
                     url = 'https://' + url
                 val(url)
             except ValidationError:
                 form.add_error('url', 'Invalid url')
             else:
-                return HttpResponseRedirect('/create/?url=%s' % urllib.parse.quote(url.encode('utf8')))
+                create_url = '/create/?url=%s' % urllib.parse.quote(url.encode('utf8'))
+
+                # Offer the page's own feeds before falling back to scraping it
+                feeds = discovery.discover_feeds(url)
+                if not feeds:
+                    return HttpResponseRedirect(create_url)
+
+                return render(request, 'ui/index.html', {
+                            'form': form,
+                            'feeds': [(SubscribeForm(initial={'url': feed_url}), title) for feed_url, title in feeds],
+                            'create_url': create_url
+                        })
     else:
         form = IndexForm()
 
     return render(request, 'ui/index.html', {'form': form})
 
 
+# Subscribe to a native RSS feed
+def subscribe(request):
+    if request.method == 'POST':
+        form = SubscribeForm(request.POST)
+
+        if form.is_valid():
+            url = form.cleaned_data['url']
+            canonical_link = resolve_canonical_url(url)
+
+            db_feed = Feed.objects.filter(canonical_link=canonical_link, page_url='').first()
+            if db_feed is not None:
+                return HttpResponseRedirect('/viewfeed/%d/' % db_feed.pk)
+
+            feed = rss.read_feed_from_link(url)
+            if isinstance(feed, rss.FeedObj):
+                feed_id = rss.write_feed_to_database(feed, url, canonical_link)
+
+                if feed_id:
+                    return HttpResponseRedirect('/viewfeed/%d/' % feed_id)
+
+    return HttpResponseBadRequest('A valid feed url is required')
+
+
 @ensure_csrf_cookie
 def create(request):
-    if request.method == 'GET' and 'url' in request.GET:
-        ext_page_url = request.GET['url']
+    if request.method == 'POST':
+        form = SelectorForm(request.POST)
 
-        r = requests.get(ext_page_url)
+        if form.is_valid():
+            try:
+                feed_id = extract.create_scraped_feed(form.cleaned_data['url'], form.get_selectors(), form.cleaned_data['digest'])
+            except extract.ExtractError as e:
+                form.add_error(getattr(e, 'name', None), str(e))
+            else:
+                return HttpResponseRedirect('/viewfeed/%d/' % feed_id)
 
-        b64_html = b64encode(r.content.decode(r.encoding).encode("utf-8"))
+        if 'url' in request.POST and 'digest' in request.POST:
+            return render(request, 'ui/create.html', create_context(request.POST['url'], request.POST['digest'], form))
 
-        return render(request, 'ui/create.html',
-                        {
-                            'b64_html': b64_html.decode("utf-8"),
-                            'ext_page_url': ext_page_url
-                        })
+    elif request.method == 'GET' and 'url' in request.GET:
+        ext_page_url = request.GET['url']
+
+        digest = snapshots.fetch_snapshot(ext_page_url)
+
+        return render(request, 'ui/create.html', create_context(ext_page_url, digest))
 
     return HttpResponseBadRequest('Url is required')
 
 
+# Build the create page context for a page snapshot
+def create_context(ext_page_url, digest, form=None):
+    if form is None:
+        form = SelectorForm(initial={'url': ext_page_url, 'digest': digest})
+
+    return {
+                'form': form,
+                'snapshot_digest': digest,
+                'ext_page_url': ext_page_url
+            }
+
+
+# Serve a cached page snapshot to the create page iframe
+@xframe_options_sameorigin
+def snapshot(request, digest):
+    content = snapshots.get_snapshot(digest)
+
+    if content is None:
+        raise Http404('Snapshot expired')
+
+    response = HttpResponse(content, content_type='text/html; charset=utf-8')
+
+    # Snapshots are content addressed, so they never change
+    patch_cache_control(response, private=True, max_age=settings.SNAPSHOT_TTL, immutable=True)
+    response['Content-Security-Policy'] = 'sandbox'
+
+    return response
+
+
+# List feeds a page at a time, with each feed's title, item count and newest
+# item read by subqueries in the page query. Rendered pages are cached until
+# any feed changes.
 class FeedListView(generic.ListView):
-	model = Feed
+    model = Feed
+
+    def get_paginate_by(self, queryset):
+        return settings.FEED_LIST_PAGE_SIZE
+
+    def get_queryset(self):
+        items = Item.objects.filter(feed=OuterRef('pk')).order_by().values('feed')
+
+        return Feed.objects.annotate(
+                title=Subquery(FeedField.objects.filter(feed=OuterRef('pk'), name='title').values('value')[:1]),
+                item_count=Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), 0),
+                last_item=Subquery(items.annotate(last=Max('created')).values('last'))
+            ).order_by('-updated', '-pk')
+
+    def get(self, request, *args, **kwargs):
+        page = request.GET.get(self.page_kwarg, '1')
+
+        # Other page values are not worth a cache entry
+        if not page.isdigit():
+            return super().get(request, *args, **kwargs)
+
+        key = 'pollrss:feed-list:%d:%s' % (feedcache.get_feed_list_version(), page)
+        content = cache.get(key)
+
+        if content is not None:
+            return HttpResponse(content)
+
+        response = super().get(request, *args, **kwargs)
+        response.render()
+
+        if response.status_code == 200:
+            cache.set(key, response.content, settings.FEED_LIST_CACHE_TTL)
+
+        return response
 
 
 @ensure_csrf_cookie
 def viewfeed(request, feed_id):
     if request.method == 'GET':
 
-        rss_feed = rss.create_rss_feed_from_object(feed_id)
-        
-        soup = BeautifulSoup(rss_feed.rss(), "xml")
-        
-        pretty_xml = soup.prettify()
+        return render(request, 'ui/feed.html', context=viewfeed_context(feed_id))
 
-        b64_xml = b64encode(pretty_xml.encode('utf-8'))
+    return HttpResponseBadRequest('Feed is required')
 
-        context = {
-                    'feed_name': rss_feed.title,
-                    'feed_id': feed_id,
-                    'feed_xml': b64_xml.decode("utf-8")
-                }
 
-        return render(request, 'ui/feed.html', context=context)
+# Build the feed preview context. The page loads the feed itself from the
+# feed endpoint, so only the title is read here.
+def viewfeed_context(feed_id):
+    db_feed = get_object_or_404(Feed.objects.annotate(
+                    title=Subquery(FeedField.objects.filter(feed=OuterRef('pk'), name='title').values('value')[:1])),
+                pk=feed_id)
 
-    return HttpResponseBadRequest('Feed is required')
+    return {
+                'feed_name': db_feed.title,
+                'feed_id': feed_id
+            }
 
 
 
@@ -104,17 +214,51 @@ def viewfeed(request, feed_id):
 def feed(request, feed_id):
     if request.method == 'GET':
 
-        rss_feed = rss.create_rss_feed_from_object(feed_id).rss()
+        rss_feed, etag, warning = get_feed_or_404(feed_id)
 
-        return HttpResponse(rss_feed, content_type='application/rss+xml')
+        return feed_response(rss_feed, warning, etag, request)
         #return render(request, "ui/feed.xml", context)
 
     return HttpResponseBadRequest('Feed is required')
 
 
+# Get a feed's rendered RSS, ETag and Warning, from the cache if possible
+def get_feed_or_404(feed_id):
+    try:
+        return feedcache.get_feed(feed_id)
+    except Feed.DoesNotExist:
+        raise Http404('Feed not found')
+
+
+# Build the RSS response, flagging stale bodies. Readers that send back the
+# ETag of the body they have get an empty 304 instead.
+def feed_response(rss_feed, warning, etag=None, request=None):
+    response = None
+
+    if etag is not None and request is not None:
+        response = get_conditional_response(request, etag=etag)
+
+    if response is None:
+        response = HttpResponse(rss_feed, content_type='application/rss+xml')
+
+    if etag is not None:
+        response['ETag'] = etag
+
+    if warning is not None:
+        response['Warning'] = warning
+
+    return response
+
+
+# Serve metrics in the Prometheus text format
+def prometheus_metrics(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 
 @ensure_csrf_cookie
 def test(request):
     if request.method == 'GET':
         url = "http://rss.cnn.com/rss/cnn_topstories.rss"
-        return HttpResponseRedirect('/viewfeed/%s' % str(rss.write_feed_to_database(rss.read_feed_from_link(url), url)))
\ No newline at end of file
+        canonical_link = resolve_canonical_url(url)
+        return HttpResponseRedirect('/viewfeed/%s' % str(rss.write_feed_to_database(rss.read_feed_from_link(url), url, canonical_link)))
\ No newline at end of file
@@ -37,10 +37,27 @@ else
 
 fi
 
+# Check if running the async views under ASGI
+if [[ "$1" = "ASGI" || "$2" = "ASGI" || "$3" = "ASGI" ]]; then
+    export DJANGO_ASYNC_VIEWS=True
+fi
+
+# Gunicorn workers share their metrics through per-process files
+export DJANGO_METRICS_DIR="${DJANGO_METRICS_DIR:-$(pwd)/metrics}"
+
 # Check for migration commands
 if [ "$1" = "RUN" ]; then
     $2
+elif [ "$DJANGO_ASYNC_VIEWS" = "True" ]; then
+    # Counters restart with the server
+    rm -rf "$DJANGO_METRICS_DIR"
+
+    # Run Gunicorn with Uvicorn workers (pip install uvicorn httpx)
+    gunicorn pollrss.asgi -k uvicorn.workers.UvicornWorker
+
 else
+    rm -rf "$DJANGO_METRICS_DIR"
+
     # Run Gunicorn
     gunicorn pollrss.wsgi
 